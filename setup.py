@@ -49,12 +49,19 @@ setup(
     namespace_packages=['zope'],
     install_requires=[
         'setuptools',
-        'github3.py'
+        'github3.py',
+        'requests',
         ],
+    extras_require=dict(
+        http2=['httpx[http2]'],
+        ),
     entry_points = dict(console_scripts=[
         'addrepos = zope.githubsupport.repos:addrepos',
         'updaterepos = zope.githubsupport.repos:updaterepos',
         'migrate = zope.githubsupport.migrate:migrate',
+        'benchrepos = zope.githubsupport.benchmark:main',
+        'reposd = zope.githubsupport.daemon:main',
+        'mergeshards = zope.githubsupport.shard:merge',
         ]),
     include_package_data = True,
     zip_safe = False,
@@ -0,0 +1,368 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Benchmarks against the Local GitHub/PyPI Stand-in
+
+Runs ``addrepos``, ``updaterepos`` and the create and push stages of
+``migrate`` against a seeded ``zope.githubsupport.fakeserver`` and records the wall time, the requests
+per endpoint, the number of started subprocesses and the peak RSS of every
+scenario. Results are appended to a JSON lines file and compared with the
+last result of the same scenario and size.
+"""
+from __future__ import print_function
+import configparser
+import importlib
+import io
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from importlib import metadata
+
+from zope.githubsupport import fakeserver, repos, util
+
+DEFAULT_RESULTS_FILE = 'benchmark-results.jsonl'
+DEFAULT_TOLERANCE = 0.2
+
+# Run in this order; every scenario sees the state left by the previous.
+# The entry point is given as ``module:function``.
+SCENARIOS = (
+    ('addrepos', 'repos:addrepos', ()),
+    ('updaterepos-all', 'repos:updaterepos', ('--all',)),
+    ('updaterepos-since-last-run', 'repos:updaterepos',
+     ('--all', '--since-last-run')),
+    ('updaterepos-graphql', 'repos:updaterepos', ('--all', '--graphql')),
+    ('updaterepos-plan', 'repos:updaterepos', ('--plan', '--all')),
+    # Without SVN: the repositories exist and are pushed to local remotes.
+    ('migrate', 'migrate:migrate',
+     ('--create', '--skip-convert', '--skip-clean-svn', '--skip-update-ztk',
+      '--skip-update-winegg', '--skip-travis-yaml')),
+    )
+
+CHILD_SCRIPT = ('import sys; from zope.githubsupport import benchmark; '
+                'benchmark.run_child(*sys.argv[1:])')
+
+# Compared with the previous result: (key, whether the tolerance applies)
+COMPARED = (
+    ('wall', True),
+    ('total_requests', False),
+    ('subprocesses', False),
+    ('peak_rss_kb', True),
+    )
+
+
+def get_version():
+    try:
+        return metadata.version('zope.githubsupport')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def write_config(path, base_path, server, work_path, options):
+    config = configparser.ConfigParser()
+    config.read([base_path])
+    for section in ('github', 'pypi', 'travis', 'local', 'migrate'):
+        if not config.has_section(section):
+            config.add_section(section)
+    template = config.get('travis', 'yaml-template', fallback=None)
+    if template and not os.path.isabs(template):
+        config.set('travis', 'yaml-template', os.path.join(
+            os.path.dirname(os.path.abspath(base_path)), template))
+    config.set('github', 'organization', server.github.org)
+    config.set('github', 'api-url', server.url)
+    config.set('github', 'graphql-url', server.url + '/graphql')
+    config.set('github', 'repo-url',
+               'file://' + os.path.join(work_path, 'remotes') + '/')
+    config.set('github', 'cache-dir', os.path.join(work_path, 'github'))
+    config.set('github', 'teams', '\n'.join(
+        list(server.github.teams)[:options.wanted_teams]))
+    config.set('pypi', 'url', server.url + '/pypi')
+    config.set('pypi', 'cache-dir', os.path.join(work_path, 'pypi'))
+    config.set('travis', 'update-mode', options.travis_mode)
+    config.set('local', 'packages-dir', os.path.join(work_path, 'packages'))
+    config.set('local', 'state-file', os.path.join(work_path, 'state.json'))
+    config.set('migrate', 'push-url',
+               'file://' + os.path.join(work_path, 'remotes') + '/')
+    # The migrate scenario has no SVN mirror to index.
+    config.remove_option('migrate', 'svn-index')
+    with io.open(path, 'w', encoding='utf-8') as file:
+        config.write(file)
+    return config
+
+
+def create_conversions(path, remotes_path, names):
+    """Create Git repositories as if converted, one commit and tag ahead of
+    their remotes."""
+    git = ['git', '-c', 'user.name=Benchmark',
+           '-c', 'user.email=benchmark@localhost']
+    for name in names:
+        git_path = os.path.join(path, name)
+        subprocess.check_call(git + ['clone', '-q', os.path.join(
+            remotes_path, name), git_path])
+        subprocess.check_call(
+            git + ['commit', '-q', '--allow-empty', '-m', 'Converted.'],
+            cwd=git_path)
+        subprocess.check_call(git + ['tag', '1.0'], cwd=git_path)
+
+
+def run_child(stats_path, entry, *args):
+    """Run a script in the benchmark process and store its own counters."""
+    module, function = entry.split(':')
+    module = importlib.import_module('zope.githubsupport.' + module)
+    try:
+        getattr(module, function)(list(args))
+    finally:
+        with io.open(stats_path, 'w', encoding='utf-8') as file:
+            json.dump({'subprocesses': util.runner.processes}, file)
+
+
+def run_scenario(name, entry, args, server, work_path):
+    """Run one scenario in a fresh process and return its measurements."""
+    stats_path = os.path.join(work_path, name + '.json')
+    log_path = os.path.join(work_path, name + '.log')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+    server.github.reset_counts()
+    start = time.time()
+    with io.open(log_path, 'wb') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-c', CHILD_SCRIPT, stats_path, entry] +
+            list(args), stdout=log, stderr=subprocess.STDOUT, env=env)
+        # ``wait4`` reports the resources of this process only.
+        pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - start
+    process.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                          else -os.WTERMSIG(status))
+    counts = server.github.reset_counts()
+    stats = {}
+    if os.path.exists(stats_path):
+        with io.open(stats_path, 'r', encoding='utf-8') as file:
+            stats = json.load(file)
+    return {'scenario': name, 'exit_code': process.returncode,
+            'wall': round(wall, 3), 'requests': counts,
+            'total_requests': sum(counts.values()),
+            'subprocesses': stats.get('subprocesses'),
+            # Kilobytes on Linux.
+            'peak_rss_kb': usage.ru_maxrss, 'log': log_path}
+
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with io.open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    results.append(json.loads(line))
+    return results
+
+
+def find_previous(results, result):
+    for previous in reversed(results):
+        if (previous['scenario'] == result['scenario'] and
+            previous['params'] == result['params']):
+            return previous
+    return None
+
+
+def compare(previous, result, tolerance=DEFAULT_TOLERANCE):
+    """Return the regressions as ``[(key, previous, current)]``."""
+    regressions = []
+    for key, relative in COMPARED:
+        old, new = previous.get(key), result.get(key)
+        if old is None or new is None:
+            continue
+        limit = old * (1 + tolerance) if relative else old
+        if new > limit:
+            regressions.append((key, old, new))
+    return regressions
+
+
+def print_result(result, previous, regressions):
+    name = result['scenario']
+    print()
+    print('=====[ ' + name + ' ]' + '='*(70-len(name)))
+    if result['exit_code']:
+        print('**FAILED** with exit code %i (see %s)' % (
+            result['exit_code'], result['log']))
+    print('Wall time: %.2fs' % result['wall'])
+    print('Requests: %i' % result['total_requests'])
+    for endpoint, count in sorted(result['requests'].items()):
+        print('  %6i %s' % (count, endpoint))
+    print('Subprocesses: %s' % result['subprocesses'])
+    print('Peak RSS: %s kB' % result['peak_rss_kb'])
+    if previous is None:
+        print('No previous result to compare with.')
+        return
+    print('Compared with %s (%s):' % (
+        previous['version'], time.ctime(previous['time'])))
+    for key, old, new in regressions:
+        print('  * **REGRESSION** %s: %s -> %s' % (key, old, new))
+    if not regressions:
+        print('  * No regressions.')
+
+
+def benchmark(options):
+    names = [scenario[0] for scenario in SCENARIOS]
+    unknown = set(options.scenarios or ()).difference(names)
+    if unknown:
+        sys.exit('Unknown scenarios: ' + ', '.join(sorted(unknown)))
+    work_path = options.work_dir or tempfile.mkdtemp(prefix='benchmark-')
+    if not os.path.exists(work_path):
+        os.makedirs(work_path)
+    params = {'repos': options.repos, 'teams': options.teams,
+              'hooks': options.hooks, 'jobs': options.jobs,
+              'travis_mode': options.travis_mode,
+              'migrate_repos': options.migrate_repos}
+    results = load_results(options.results_file)
+    failed = False
+    base_config = configparser.ConfigParser()
+    base_config.read([options.configfile])
+    hook_names = sorted(section[6:] for section in base_config.sections()
+                        if section.startswith('hooks'))
+    github = fakeserver.FakeGitHub()
+    print('Seeding %i repositories ...' % options.repos)
+    repo_names = github.seed(options.repos, options.teams, options.hooks,
+                             hook_names=hook_names + ['unmanaged'])
+    try:
+        with fakeserver.FakeServer(github) as server:
+            config_path = os.path.join(work_path, 'benchmark.cfg')
+            write_config(config_path, options.configfile, server, work_path,
+                         options)
+            remotes_path = os.path.join(work_path, 'remotes')
+            if options.travis_mode == 'checkout':
+                print('Creating %i Git remotes ...' % len(repo_names))
+                fakeserver.create_git_remotes(remotes_path, github)
+                os.makedirs(os.path.join(work_path, 'packages'))
+            migrate_names = repo_names[:options.migrate_repos]
+            git_path = os.path.join(work_path, 'converted')
+            if not options.scenarios or 'migrate' in options.scenarios:
+                print('Creating %i converted repositories ...' % len(
+                    migrate_names))
+                if options.travis_mode != 'checkout':
+                    fakeserver.create_git_remotes(
+                        remotes_path, github, migrate_names)
+                create_conversions(git_path, remotes_path, migrate_names)
+            common = ['-c', config_path, '--user', 'benchmark',
+                      '--pass', 'benchmark', '--token', 'benchmark',
+                      '--jobs', str(options.jobs)]
+            for name, entry, args in SCENARIOS:
+                if options.scenarios and name not in options.scenarios:
+                    continue
+                args = common + list(args)
+                if entry == 'repos:addrepos':
+                    args += repo_names
+                elif entry == 'migrate:migrate':
+                    args += ['--git-path', git_path] + migrate_names
+                result = run_scenario(name, entry, args, server, work_path)
+                result.update(version=get_version(), label=options.label,
+                              time=time.time(), params=params)
+                previous = find_previous(results, result)
+                regressions = []
+                if previous is not None:
+                    regressions = compare(previous, result, options.tolerance)
+                print_result(result, previous, regressions)
+                failed = failed or bool(result['exit_code'] or regressions)
+                del result['log']
+                results.append(result)
+                with io.open(options.results_file, 'a',
+                             encoding='utf-8') as file:
+                    file.write(json.dumps(result, sort_keys=True) + '\n')
+    finally:
+        # Failed runs keep their logs.
+        if not (options.keep or options.work_dir or failed):
+            shutil.rmtree(work_path)
+    return not failed
+
+###############################################################################
+# Command-line UI
+
+parser = optparse.OptionParser("%prog [options]")
+
+parser.add_option(
+    '--repos', action="store", type="int", dest='repos', default=1000,
+    help="The number of synthetic repositories.")
+
+parser.add_option(
+    '--teams', action="store", type="int", dest='teams', default=5,
+    help="The number of synthetic teams.")
+
+parser.add_option(
+    '--wanted-teams', action="store", type="int", dest='wanted_teams',
+    default=2,
+    help="How many of the teams are configured for all repositories.")
+
+parser.add_option(
+    '--hooks', action="store", type="int", dest='hooks', default=3,
+    help="The number of existing hooks per repository.")
+
+parser.add_option(
+    '--migrate-repos', action="store", type="int", dest='migrate_repos',
+    default=20,
+    help="The number of repositories the migrate scenario pushes.")
+
+parser.add_option(
+    '--jobs', '-j', action="store", type="int", dest='jobs', default=1,
+    help="Passed to the scripts.")
+
+parser.add_option(
+    '--travis-mode', action="store", dest='travis_mode', default='remote',
+    choices=['remote', 'checkout'],
+    help="The Travis YAML update mode. `checkout` creates a local Git "
+         "remote per repository first.")
+
+parser.add_option(
+    '--scenario', action="append", dest='scenarios', default=None,
+    help="Only run this scenario (repeatable): " +
+         ', '.join(scenario[0] for scenario in SCENARIOS))
+
+parser.add_option(
+    '--results', action="store", dest='results_file',
+    default=DEFAULT_RESULTS_FILE,
+    help="The JSON lines file collecting all results.")
+
+parser.add_option(
+    '--tolerance', action="store", type="float", dest='tolerance',
+    default=DEFAULT_TOLERANCE,
+    help="Allowed relative increase of wall time and memory.")
+
+parser.add_option(
+    '--label', action="store", dest='label', default=None,
+    help="A label stored with the results, e.g. a branch name.")
+
+parser.add_option(
+    '--work-dir', action="store", dest='work_dir', default=None,
+    help="Keep configuration, caches, checkouts and logs in this directory.")
+
+parser.add_option(
+    '--keep', action="store_true", dest='keep', default=False,
+    help="Do not remove the temporary working directory.")
+
+parser.add_option(
+    '--config', '-c', action="store", dest='configfile',
+    default=repos.DEFAULT_CONFIG_FILE,
+    help="The config file the benchmark configuration is based on.")
+
+# Command-line UI
+###############################################################################
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    options, positional = parser.parse_args(args)
+    if not benchmark(options):
+        sys.exit(1)
@@ -0,0 +1,219 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Package Checkouts on a Shared Object Store
+
+The checkouts below ``[local] packages-dir`` borrow their history from one
+bare repository (``[local] object-store``) through Git alternates. The
+store has a remote per package and fetches all of them with a few
+``git fetch --multiple`` calls, after which existing checkouts are updated
+from the store without network access. New checkouts are blobless and
+sparse, since only top-level files are read and changed.
+
+Remotes must not be removed from the store, since the checkouts depend on
+its objects.
+"""
+from __future__ import print_function
+import os
+import threading
+
+from . import util
+from .util import run_parallel
+
+DEFAULT_FETCH_JOBS = 8
+DEFAULT_CLONE_FILTER = 'blob:none'
+FETCH_BATCH = 100
+
+
+def _quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class CheckoutManager(object):
+
+    def __init__(self, packages_dir, repo_url, store_path=None,
+                 jobs=DEFAULT_FETCH_JOBS, clone_filter=DEFAULT_CLONE_FILTER,
+                 sparse=True):
+        self.packages_dir = packages_dir
+        self.repo_url = repo_url
+        self.store_path = store_path or os.path.join(
+            packages_dir, '.objects.git')
+        self.jobs = jobs
+        self.clone_filter = clone_filter
+        self.sparse = sparse
+        # Packages whose checkouts are up-to-date with the store.
+        self.refreshed = set()
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.packages_dir, name)
+
+    def url(self, name):
+        return self.repo_url + name
+
+    def git(self, args, cwd):
+        return util.run(['git'] + args, cwd=cwd, capture=100, check=True)
+
+    def is_checkout(self, name):
+        return os.path.exists(os.path.join(self.path(name), '.git'))
+
+    def is_empty(self, name):
+        """Whether a checkout has no commits, e.g. of a new repository."""
+        result = util.run(['git', 'rev-parse', '-q', '--verify', 'HEAD'],
+                          cwd=self.path(name))
+        return result.returncode != 0
+
+    def init_store(self):
+        with self._lock:
+            if not os.path.exists(self.store_path):
+                self.git(['init', '-q', '--bare', self.store_path],
+                         self.packages_dir)
+
+    def store_remotes(self):
+        result = self.git(['remote'], self.store_path)
+        return set(result.stdout.split())
+
+    def add_remotes(self, names):
+        """Add the missing package remotes to the store in one go."""
+        missing = sorted(set(names).difference(self.store_remotes()))
+        if not missing:
+            return
+        lines = []
+        for name in missing:
+            lines.append('[remote %s]' % _quote(name))
+            lines.append('\turl = %s' % _quote(self.url(name)))
+            lines.append('\tfetch = %s' % _quote(
+                '+refs/heads/*:refs/remotes/%s/*' % name))
+            if self.clone_filter:
+                lines.append('\tpromisor = true')
+                lines.append('\tpartialclonefilter = %s' % self.clone_filter)
+        # Writing the config directly avoids several processes per package.
+        with self._lock:
+            with open(os.path.join(self.store_path, 'config'), 'a') as file:
+                file.write('\n'.join(lines) + '\n')
+
+    def fetch(self, names):
+        """Fetch the packages into the store; return the fetched ones."""
+        names = sorted(names)
+        fetched = []
+        for start in range(0, len(names), FETCH_BATCH):
+            batch = names[start:start + FETCH_BATCH]
+            result = util.run(
+                ['git', 'fetch', '-q', '--prune', '--multiple',
+                 '--jobs=%i' % self.jobs] + batch,
+                cwd=self.store_path, capture=100)
+            if result.returncode == 0:
+                fetched.extend(batch)
+                continue
+            # Find the failing packages without refetching the others.
+            succeeded, failed = run_parallel(
+                lambda name: self.git(['fetch', '-q', '--prune', name],
+                                      self.store_path),
+                batch, self.jobs)
+            fetched.extend(succeeded)
+        return fetched
+
+    def clone(self, name):
+        cmd = ['clone', '-q', '--reference-if-able', self.store_path]
+        if self.clone_filter:
+            cmd.append('--filter=' + self.clone_filter)
+        if self.sparse:
+            # Only the top-level files.
+            cmd.append('--sparse')
+        self.git(cmd + [self.url(name), name], self.packages_dir)
+
+    def sync(self, name):
+        """Update a checkout from the store, without network access."""
+        path = self.path(name)
+        self.git(['fetch', '-q', self.store_path,
+                  '+refs/remotes/%s/*:refs/remotes/origin/*' % name], path)
+        self.git(['rebase', '-q', '@{upstream}'], path)
+
+    def refresh(self, names):
+        """Fetch all packages at once and update or create their checkouts.
+
+        Returns the succeeded and failed packages like ``run_parallel``.
+        """
+        names = list(names)
+        print()
+        print('=====[ Checkouts ]' + '='*60)
+        if not os.path.exists(self.packages_dir):
+            os.makedirs(self.packages_dir)
+        self.init_store()
+        self.add_remotes(names)
+        fetched = set(self.fetch(names))
+        print('Fetched %i of %i packages into %s' % (
+            len(fetched), len(names), self.store_path))
+
+        def update(name):
+            if not os.path.exists(self.path(name)):
+                self.clone(name)
+            elif not self.is_checkout(name):
+                return
+            else:
+                self.sync(name)
+            with self._lock:
+                self.refreshed.add(name)
+
+        succeeded, failed = run_parallel(
+            update, [name for name in names if name in fetched], self.jobs)
+        print('Updated %i checkouts' % len(self.refreshed))
+        for name, err in failed:
+            print('  * %s: %s' % (name, util.describe_error(err)))
+        return succeeded, failed
+
+    def checkout(self, name):
+        """Return the path of an up-to-date checkout or ``None``.
+
+        ``None`` means that the directory exists but is no Git checkout.
+        """
+        path = self.path(name)
+        if not os.path.exists(path):
+            self.clone(name)
+        elif not self.is_checkout(name):
+            return None
+        elif name not in self.refreshed:
+            self.git(['pull', '-q', '-r'], path)
+        return path
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def reset():
+    """Forget which checkouts are up-to-date, e.g. in long-running
+    processes."""
+    with _managers_lock:
+        for manager in _managers.values():
+            with manager._lock:
+                manager.refreshed.clear()
+
+def get_manager(config):
+    """Return the checkout manager shared by everything in this run."""
+    packages_dir = config.get('local', 'packages-dir')
+    key = (
+        packages_dir,
+        config.get('github', 'repo-url'),
+        config.get('local', 'object-store', fallback=None),
+        config.getint('local', 'fetch-jobs', fallback=DEFAULT_FETCH_JOBS),
+        config.get('local', 'clone-filter',
+                   fallback=DEFAULT_CLONE_FILTER).strip(),
+        config.getboolean('local', 'sparse-checkout', fallback=True))
+    with _managers_lock:
+        if key not in _managers:
+            store_path = key[2]
+            if store_path:
+                store_path = os.path.expanduser(store_path)
+            _managers[key] = CheckoutManager(
+                packages_dir, key[1], store_path, *key[3:])
+        return _managers[key]
@@ -0,0 +1,148 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Shared HTTP Client
+
+All HTTP traffic of the tools goes through one pool of keep-alive
+connections with explicit timeouts and bounded retries. The asynchronous
+interface uses HTTP/2 if ``httpx`` is installed.
+"""
+import asyncio
+import functools
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_POOL_SIZE = 20
+RETRY_STATUSES = (502, 503, 504)
+
+
+class PooledAdapter(HTTPAdapter):
+    """A connection pool with default timeouts and retries."""
+
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE, **kw):
+        kw.setdefault('pool_connections', pool_size)
+        kw.setdefault('pool_maxsize', pool_size)
+        # Only idempotent requests are retried.
+        kw.setdefault('max_retries', Retry(
+            total=retries, backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES, raise_on_status=False))
+        super(PooledAdapter, self).__init__(**kw)
+        self.timeout = timeout
+
+    def send(self, request, **kw):
+        if kw.get('timeout') is None:
+            kw['timeout'] = self.timeout
+        start = time.time()
+        response = super(PooledAdapter, self).send(request, **kw)
+        received = 0
+        if not kw.get('stream'):
+            # Read now (instead of in the session) to count the bytes.
+            received = len(response.content)
+        body = request.body or b''
+        metrics.record_request(
+            request.method, request.url, time.time() - start,
+            len(body.encode('utf-8') if isinstance(body, str) else body),
+            received, response.status_code)
+        return response
+
+
+class Client(object):
+    """A session on the shared pool plus an asynchronous interface."""
+
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 retries=DEFAULT_RETRIES, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.adapter = PooledAdapter(timeout, retries, pool_size)
+        self.session = requests.Session()
+        self.mount(self.session)
+        self._async_clients = {}
+        self._lock = threading.Lock()
+
+    def adapter_options(self):
+        return {'timeout': self.timeout, 'retries': self.retries,
+                'pool_size': self.pool_size}
+
+    def mount(self, session):
+        """Let another session (e.g. the GitHub one) share the pool."""
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+
+    def get(self, url, **kw):
+        return self.session.get(url, **kw)
+
+    def _async_client(self):
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                connect, read = self.timeout
+                self._async_clients[loop] = httpx.AsyncClient(
+                    http2=True,
+                    timeout=httpx.Timeout(read, connect=connect),
+                    limits=httpx.Limits(max_connections=self.pool_size),
+                    transport=httpx.AsyncHTTPTransport(
+                        http2=True, retries=self.retries))
+            return self._async_clients[loop]
+
+    async def aget(self, url, headers=None):
+        """Fetch the URL without blocking the event loop."""
+        if httpx is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self.get, url, headers=headers))
+        start = time.time()
+        response = await self._async_client().get(url, headers=headers)
+        metrics.record_request('GET', url, time.time() - start, 0,
+                               len(response.content), response.status_code)
+        return response
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._async_clients.values())
+            self._async_clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(config):
+    """Return the client shared by everything using these settings."""
+    timeout = (
+        config.getfloat('http', 'connect-timeout',
+                        fallback=DEFAULT_CONNECT_TIMEOUT),
+        config.getfloat('http', 'read-timeout', fallback=DEFAULT_READ_TIMEOUT))
+    retries = config.getint('http', 'retries', fallback=DEFAULT_RETRIES)
+    pool_size = config.getint('http', 'pool-size', fallback=DEFAULT_POOL_SIZE)
+    key = (timeout, retries, pool_size)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = Client(timeout, retries, pool_size)
+        return _clients[key]
@@ -0,0 +1,384 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Repository Reconcile Daemon
+
+Accepts organization webhook deliveries, puts the affected repositories on
+a deduplicating queue and updates only those with ``update_repositories``.
+A slow periodic sweep over all repositories remains as a safety net.
+"""
+from __future__ import print_function
+import collections
+import hashlib
+import hmac
+import http.server
+import io
+import json
+import optparse
+import sys
+import threading
+import time
+import urllib.request
+
+from zope.githubsupport import checkouts, repos, travis
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8321
+DEFAULT_SWEEP_INTERVAL = 24 * 3600
+DEFAULT_BATCH_DELAY = 5
+RETRY_DELAY = 60
+# Failed repositories are retried this often before waiting for the sweep.
+MAX_RETRIES = 5
+MAX_PAYLOAD_SIZE = 25 * 1024 * 1024
+SEEN_DELIVERIES = 1000
+
+# Events that concern the configuration of a repository.
+EVENTS = ('repository', 'team', 'team_add', 'meta')
+
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(
+        secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, headers):
+    signature = headers.get('X-Hub-Signature-256')
+    if signature is not None:
+        return hmac.compare_digest(sign(secret, body), signature)
+    signature = headers.get('X-Hub-Signature')
+    if signature is not None:
+        expected = 'sha1=' + hmac.new(
+            secret.encode('utf-8'), body, hashlib.sha1).hexdigest()
+        return hmac.compare_digest(expected, signature)
+    return False
+
+
+def get_affected(event, payload, org_name):
+    """Return the repositories to update and whether all are affected."""
+    if event not in EVENTS:
+        return [], False
+    org = (payload.get('organization') or {}).get('login')
+    if org is not None and org != org_name:
+        return [], False
+    if event == 'repository' and payload.get('action') == 'deleted':
+        return [], False
+    repo = payload.get('repository')
+    if repo is not None:
+        return [repo['name']], False
+    # A changed team without a repository may concern all of them.
+    return [], event == 'team'
+
+
+class WorkQueue(object):
+    """Repositories waiting for an update; each one is queued only once.
+
+    Retries are put with a ``delay`` and only handed out once it passed.
+    """
+
+    def __init__(self):
+        self.pending = set()
+        self.sweep = False
+        self.closed = False
+        # Name -> time when a retry is due
+        self.delayed = {}
+        self._condition = threading.Condition()
+
+    def put(self, names=(), sweep=False, delay=0):
+        with self._condition:
+            if delay:
+                due = time.time() + delay
+                for name in names:
+                    self.delayed[name] = min(self.delayed.get(name, due), due)
+            else:
+                self.pending.update(names)
+                for name in names:
+                    self.delayed.pop(name, None)
+            self.sweep = self.sweep or sweep
+            self._condition.notify()
+
+    def _ready(self):
+        now = time.time()
+        for name, due in list(self.delayed.items()):
+            if due <= now:
+                self.pending.add(name)
+                del self.delayed[name]
+        return self.pending or self.sweep or self.closed
+
+    def _next_due(self, deadline):
+        """Return how long to wait for the next retry or the deadline."""
+        times = list(self.delayed.values())
+        if deadline is not None:
+            times.append(deadline)
+        if not times:
+            return None
+        return max(min(times) - time.time(), 0)
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+    def get(self, timeout=None, delay=0):
+        """Wait for work and return ``(names, sweep)``.
+
+        Once there is work, wait another ``delay`` seconds, so that bursts
+        of deliveries for the same repositories are handled together.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                found = self._ready()
+                if found or (deadline is not None and time.time() >= deadline):
+                    break
+                self._condition.wait(self._next_due(deadline))
+        if found and delay and not self.closed:
+            time.sleep(delay)
+        with self._condition:
+            names, sweep = sorted(self.pending), self.sweep
+            self.pending.clear()
+            self.sweep = False
+        return names, sweep
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+
+    def respond(self, status, message):
+        content = (message + '\n').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        server = self.server
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self.respond(400, 'Invalid Content-Length')
+        if length > MAX_PAYLOAD_SIZE:
+            return self.respond(413, 'Payload too large')
+        body = self.rfile.read(length)
+        if not verify_signature(server.secret, body, self.headers):
+            return self.respond(401, 'Bad signature')
+        delivery = self.headers.get('X-GitHub-Delivery')
+        if not server.is_new_delivery(delivery):
+            return self.respond(200, 'Already delivered')
+        event = self.headers.get('X-GitHub-Event', '')
+        if event == 'ping':
+            return self.respond(200, 'pong')
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self.respond(400, 'Invalid JSON')
+        names, sweep = get_affected(event, payload, server.org_name)
+        if not names and not sweep:
+            return self.respond(202, 'Ignored')
+        server.queue.put(names, sweep)
+        print('%s: %s %s -> %s' % (
+            time.ctime(), event, payload.get('action', ''),
+            ', '.join(names) or 'all repositories'))
+        self.respond(202, 'Queued')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, secret, org_name, queue):
+        http.server.ThreadingHTTPServer.__init__(
+            self, address, WebhookHandler)
+        self.secret = secret
+        self.org_name = org_name
+        self.queue = queue
+        self._deliveries = collections.deque(maxlen=SEEN_DELIVERIES)
+        self._lock = threading.Lock()
+
+    def is_new_delivery(self, delivery):
+        """Whether a delivery is seen for the first time (not redelivered)."""
+        if delivery is None:
+            return True
+        with self._lock:
+            if delivery in self._deliveries:
+                return False
+            self._deliveries.append(delivery)
+            return True
+
+
+def get_update_options(options, **kw):
+    """Return ``updaterepos`` options for the credentials of the daemon."""
+    update_options = repos.parser.get_default_values()
+    update_options.username = options.username
+    update_options.password = options.password
+    update_options.token = options.token
+    update_options.jobs = options.jobs
+    update_options.update_travis_yaml = options.update_travis_yaml
+    for name, value in kw.items():
+        setattr(update_options, name, value)
+    return update_options
+
+
+def reset_caches():
+    """Make a batch see the current checkouts and templates."""
+    checkouts.reset()
+    travis.reset_templates()
+
+
+def reconcile(queue, gh, config, options, sweep_interval, delay):
+    """Update the queued repositories until the queue is closed."""
+    next_sweep = time.time() + sweep_interval
+    retries = collections.Counter()
+    while not queue.closed:
+        timeout = max(next_sweep - time.time(), 0)
+        names, sweep = queue.get(timeout, delay)
+        if time.time() >= next_sweep:
+            sweep = True
+        reset_caches()
+        failed = []
+        try:
+            if sweep:
+                print()
+                print('%s: Sweeping all repositories' % time.ctime())
+                succeeded, sweep_failed = repos.update_all_repositories(
+                    gh, config, get_update_options(options, all_repos=True))
+                failed.extend(repo.name for repo, err in sweep_failed)
+                next_sweep = time.time() + sweep_interval
+                retries.clear()
+            if names:
+                print()
+                print('%s: Updating %i repositories' % (
+                    time.ctime(), len(names)))
+                succeeded, names_failed = repos.update_repositories(
+                    gh, config, get_update_options(options, repos=names))
+                failed.extend(name for name, err in names_failed)
+                for name in succeeded:
+                    retries.pop(name, None)
+        except (Exception, SystemExit) as err:
+            # Keep running; the repositories are retried like failed ones.
+            print('**FAILED**: %s: %s' % (err.__class__.__name__, err))
+            failed.extend(names)
+            if sweep:
+                next_sweep = time.time() + RETRY_DELAY
+        retry = []
+        for name in sorted(set(failed)):
+            retries[name] += 1
+            if retries[name] <= MAX_RETRIES:
+                retry.append(name)
+            else:
+                print('Giving up on %s until the next sweep' % name)
+                del retries[name]
+        if retry:
+            print('Retrying in %is: %s' % (RETRY_DELAY, ', '.join(retry)))
+            queue.put(retry, delay=RETRY_DELAY)
+
+
+def deliver(url, secret, event, path):
+    """Post a recorded payload to a running daemon, e.g. for testing."""
+    with io.open(path, 'rb') as file:
+        body = file.read()
+    request = urllib.request.Request(url, data=body, headers={
+        'Content-Type': 'application/json', 'X-GitHub-Event': event,
+        'X-Hub-Signature-256': sign(secret, body)})
+    with urllib.request.urlopen(request) as response:
+        print('%s %s' % (response.status, response.read().decode().strip()))
+
+
+def serve(config, options):
+    secret = config.get('daemon', 'secret', fallback=None)
+    if not secret:
+        sys.exit("Please configure the webhook secret in [daemon] secret")
+    host = config.get('daemon', 'host', fallback=DEFAULT_HOST)
+    port = config.getint('daemon', 'port', fallback=DEFAULT_PORT)
+    if options.deliver:
+        return deliver('http://%s:%i/' % (host, port), secret, options.event,
+                       options.deliver)
+
+    sweep_interval = config.getint(
+        'daemon', 'sweep-interval', fallback=DEFAULT_SWEEP_INTERVAL)
+    delay = config.getfloat(
+        'daemon', 'batch-delay', fallback=DEFAULT_BATCH_DELAY)
+    repos.check_token(config, options)
+    gh = repos.get_github(options, config)
+    queue = WorkQueue()
+    server = WebhookServer(
+        (host, port), secret, config.get('github', 'organization'), queue)
+    worker = threading.Thread(
+        target=reconcile,
+        args=(queue, gh, config, options, sweep_interval, delay))
+    worker.daemon = True
+    worker.start()
+    print('Listening on http://%s:%i/' % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.close()
+        worker.join()
+
+###############################################################################
+# Command-line UI
+
+parser = optparse.OptionParser("%prog [options]")
+
+parser.add_option(
+    '--skip-travis-yaml', action="store_false", dest='update_travis_yaml',
+    default=True,
+    help="A flag indicating that the travis.yml file should not be added.")
+
+parser.add_option(
+    '--jobs', '-j', action="store", type="int", dest='jobs', default=1,
+    help="The number of repositories to update concurrently.")
+
+parser.add_option(
+    '--deliver', action="store", dest='deliver', default=None,
+    help="Sign and post a recorded webhook payload (a JSON file) to the "
+         "running daemon instead of starting one.")
+
+parser.add_option(
+    '--event', action="store", dest='event', default='repository',
+    help="The event name sent with --deliver.")
+
+parser.add_option(
+    '--username', '--user', action="store", dest='username',
+    help="Username to access the GitHub Web site.")
+
+parser.add_option(
+    '--password', '--pwd', action="store", dest='password',
+    help="Password to access the GitHub Web site.")
+
+parser.add_option(
+    '--travis-token', '--token', action="store", dest='token',
+    help="The user token used by GitHub to talk with Travis CI.")
+
+parser.add_option(
+    '--config', '-c', action="store", dest='configfile',
+    default=repos.DEFAULT_CONFIG_FILE,
+    help="The config file containing a lot of settings.")
+
+# Command-line UI
+###############################################################################
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    options, positional = parser.parse_args(args)
+    config = repos.load_config(options.configfile)
+    serve(config, options)
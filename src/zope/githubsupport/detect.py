@@ -0,0 +1,125 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Python Version Detection from Package Sources
+
+The classifiers are read from ``setup.py``, ``setup.cfg`` and ``tox.ini``
+without importing or running any of them.
+"""
+import ast
+import configparser
+import io
+import os
+import re
+
+PYTHON_PREFIX = 'Programming Language :: Python :: '
+PYPY_CLASSIFIER = PYTHON_PREFIX + 'Implementation :: PyPy'
+TOXENV = re.compile(r'^py(\d)(\d+)$')
+
+
+def _setup_call(tree):
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        name = getattr(func, 'id', None) or getattr(func, 'attr', None)
+        if name == 'setup':
+            return node
+    return None
+
+
+def _strings(node):
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        # Fall back to the literal strings, e.g. for concatenated lists.
+        return [n.value for n in ast.walk(node)
+                if isinstance(n, ast.Constant) and isinstance(n.value, str)]
+    if isinstance(value, str):
+        return [value]
+    return [v for v in value if isinstance(v, str)]
+
+
+def classifiers_from_setup_py(text):
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return []
+    call = _setup_call(tree)
+    if call is None:
+        return []
+    for keyword in call.keywords:
+        if keyword.arg == 'classifiers':
+            return _strings(keyword.value)
+    return []
+
+
+def classifiers_from_setup_cfg(text):
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read_string(text)
+    except configparser.Error:
+        return []
+    value = parser.get('metadata', 'classifiers', fallback='')
+    return [line.strip() for line in value.splitlines() if line.strip()]
+
+
+def classifiers_from_tox_ini(text):
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read_string(text)
+    except configparser.Error:
+        return []
+    envlist = parser.get('tox', 'envlist', fallback='')
+    classifiers = []
+    for env in re.split(r'[\s,]+', envlist):
+        match = TOXENV.match(env)
+        if match is not None:
+            classifiers.append(PYTHON_PREFIX + '.'.join(match.groups()))
+        elif env == 'pypy':
+            classifiers.append(PYPY_CLASSIFIER)
+    return classifiers
+
+
+PARSERS = (
+    ('setup.py', classifiers_from_setup_py),
+    ('setup.cfg', classifiers_from_setup_cfg),
+    ('tox.ini', classifiers_from_tox_ini),
+    )
+
+
+def detect_classifiers(read):
+    """Return the classifiers found in the package sources.
+
+    ``read(filename)`` returns the text of a top-level file or ``None``.
+    """
+    classifiers = []
+    for filename, parse in PARSERS:
+        text = read(filename)
+        if text is None:
+            continue
+        for classifier in parse(text):
+            if classifier not in classifiers:
+                classifiers.append(classifier)
+    return classifiers
+
+
+def file_reader(path):
+    def read(filename):
+        filepath = os.path.join(path, filename)
+        if not os.path.exists(filepath):
+            return None
+        with io.open(filepath, 'r', encoding='utf-8',
+                     errors='replace') as file:
+            return file.read()
+    return read
@@ -0,0 +1,588 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Local Stand-in for GitHub and PyPI
+
+Serves the parts of the GitHub REST and GraphQL APIs and of the PyPI JSON
+API used by the scripts from memory. It can be seeded with thousands of
+synthetic repositories, teams and hooks and counts the requests per
+endpoint. Point ``[github] api-url``, ``[github] graphql-url`` and
+``[pypi] url`` at it.
+"""
+from __future__ import print_function
+import base64
+import collections
+import hashlib
+import http.server
+import itertools
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+DEFAULT_PER_PAGE = 30
+START_TIME = 1356998400  # 2013-01-01
+
+SEED_CLASSIFIERS = (
+    ['Programming Language :: Python :: 2.6',
+     'Programming Language :: Python :: 2.7'],
+    ['Programming Language :: Python :: 2.7',
+     'Programming Language :: Python :: 3.3'],
+    ['Programming Language :: Python :: 2.7',
+     'Programming Language :: Python :: 3.2',
+     'Programming Language :: Python :: 3.3',
+     'Programming Language :: Python :: Implementation :: PyPy'],
+    )
+
+SETUP_PY = '''from setuptools import setup
+setup(
+    name=%r,
+    classifiers=%r,
+    )
+'''
+
+# ``{name}`` matches one path segment, ``{name*}`` the rest of the path.
+ROUTES = (
+    ('GET', '/orgs/{org}', 'get_org'),
+    ('GET', '/orgs/{org}/repos', 'list_repos'),
+    ('POST', '/orgs/{org}/repos', 'create_repo'),
+    ('GET', '/orgs/{org}/teams', 'list_teams'),
+    ('GET', '/teams/{id}/repos', 'list_team_repos'),
+    ('PUT', '/teams/{id}/repos/{owner}/{repo}', 'add_team_repo'),
+    ('DELETE', '/teams/{id}/repos/{owner}/{repo}', 'remove_team_repo'),
+    ('GET', '/repos/{owner}/{repo}', 'get_repo'),
+    ('PATCH', '/repos/{owner}/{repo}', 'edit_repo'),
+    ('GET', '/repos/{owner}/{repo}/hooks', 'list_hooks'),
+    ('POST', '/repos/{owner}/{repo}/hooks', 'create_hook'),
+    ('PATCH', '/repos/{owner}/{repo}/hooks/{id}', 'edit_hook'),
+    ('GET', '/repos/{owner}/{repo}/contents/{path*}', 'get_contents'),
+    ('GET', '/repos/{owner}/{repo}/git/refs/{ref*}', 'get_ref'),
+    ('PATCH', '/repos/{owner}/{repo}/git/refs/{ref*}', 'update_ref'),
+    ('GET', '/repos/{owner}/{repo}/git/commits/{sha}', 'get_commit'),
+    ('POST', '/repos/{owner}/{repo}/git/commits', 'create_commit'),
+    ('POST', '/repos/{owner}/{repo}/git/blobs', 'create_blob'),
+    ('POST', '/repos/{owner}/{repo}/git/trees', 'create_tree'),
+    ('POST', '/graphql', 'graphql'),
+    ('GET', '/pypi/{name}/json', 'pypi'),
+    )
+
+
+def compile_route(template):
+    pattern = re.sub(r'\{(\w+)\*\}', r'(?P<\1>.+)', template)
+    pattern = re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', pattern)
+    return re.compile('^' + pattern + '$')
+
+_routes = [(method, template, compile_route(template), handler)
+           for method, template, handler in ROUTES]
+
+
+def timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeGitHub(object):
+    """The state of one organization and the packages on PyPI."""
+
+    def __init__(self, org='zopefoundation'):
+        self.org = org
+        self.url = None
+        self.repos = collections.OrderedDict()
+        self.teams = collections.OrderedDict()
+        self.packages = {}
+        self.objects = {}
+        self.counts = collections.Counter()
+        self._ids = itertools.count(1)
+        self._ticks = itertools.count(1)
+        self._lock = threading.RLock()
+
+    # Seeding
+
+    def add_repo(self, name, description=None, files=None):
+        with self._lock:
+            now = self._now()
+            repo = self.repos[name] = {
+                'id': next(self._ids), 'name': name,
+                'description': description, 'created_at': now,
+                'updated_at': now, 'pushed_at': now,
+                'hooks': collections.OrderedDict(), 'refs': {}}
+            if files is not None:
+                tree = self._store('tree', {'entries': dict(
+                    (path, self._store('blob', {'content': text}))
+                    for path, text in files.items())})
+                repo['refs']['heads/master'] = self._store('commit', {
+                    'tree': tree, 'parents': [], 'message': 'Initial.'})
+            return repo
+
+    def add_team(self, name, repos=()):
+        with self._lock:
+            team = self.teams[name] = {
+                'id': next(self._ids), 'name': name, 'slug': name.lower(),
+                'repos': set('%s/%s' % (self.org, repo) for repo in repos)}
+            return team
+
+    def add_hook(self, repo_name, name, config, events=('push',),
+                 active=True):
+        with self._lock:
+            hook_id = next(self._ids)
+            hook = self.repos[repo_name]['hooks'][hook_id] = {
+                'id': hook_id, 'name': name, 'config': dict(config),
+                'events': list(events), 'active': active}
+            return hook
+
+    def seed(self, repos=100, teams=3, hooks=2, prefix='package',
+             hook_names=None):
+        """Create synthetic repositories, teams, hooks and PyPI packages.
+
+        Most teams miss some repositories and the hooks have an outdated
+        configuration, so that a first update has work to do.
+        """
+        if hook_names is None:
+            hook_names = ['hook%i' % number for number in range(hooks)]
+        names = ['%s.%04i' % (prefix, number) for number in range(repos)]
+        for number, name in enumerate(names):
+            classifiers = SEED_CLASSIFIERS[number % len(SEED_CLASSIFIERS)]
+            self.add_repo(name, 'Old description of %s' % name,
+                          get_seed_files(name, classifiers, number))
+            self.packages[name] = {
+                'name': name, 'version': '1.%i' % number,
+                'summary': 'Synthetic package %s' % name,
+                'classifiers': classifiers}
+            for hook_name in hook_names[:hooks]:
+                self.add_hook(name, hook_name,
+                              {'url': 'http://localhost/%s' % name})
+        for number in range(teams):
+            self.add_team('team%i' % number,
+                          names[number::number + 1] if number else names)
+        return names
+
+    # Helpers
+
+    def _now(self):
+        return timestamp(START_TIME + next(self._ticks))
+
+    def _store(self, kind, data):
+        data = dict(data, kind=kind)
+        sha = hashlib.sha1(
+            json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+        self.objects[sha] = data
+        return sha
+
+    def _repo(self, params):
+        if params['owner'] != self.org or params['repo'] not in self.repos:
+            raise NotFound()
+        return self.repos[params['repo']]
+
+    def _team(self, params):
+        for team in self.teams.values():
+            if str(team['id']) == params['id']:
+                return team
+        raise NotFound()
+
+    def _object(self, sha, kind):
+        data = self.objects.get(sha)
+        if data is None or data['kind'] != kind:
+            raise NotFound()
+        return data
+
+    def _resolve(self, repo, ref):
+        sha = repo['refs'].get('heads/' + ref, ref)
+        if sha is None or sha not in self.objects:
+            raise NotFound()
+        return sha
+
+    def _paginate(self, items, query, url):
+        per_page = int(query.get('per_page', [DEFAULT_PER_PAGE])[0])
+        page = int(query.get('page', [1])[0])
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            headers['Link'] = '<%s?per_page=%i&page=%i>; rel="next"' % (
+                url, per_page, page + 1)
+        return 200, items[start:start + per_page], headers
+
+    # Representations
+
+    def org_json(self):
+        return {'login': self.org, 'id': 1, 'type': 'Organization',
+                'url': '%s/orgs/%s' % (self.url, self.org)}
+
+    def repo_json(self, repo):
+        url = '%s/repos/%s/%s' % (self.url, self.org, repo['name'])
+        return {'id': repo['id'], 'name': repo['name'],
+                'full_name': '%s/%s' % (self.org, repo['name']),
+                'description': repo['description'], 'url': url,
+                'hooks_url': url + '/hooks', 'owner': {
+                    'login': self.org, 'id': 1, 'type': 'Organization',
+                    'url': '%s/users/%s' % (self.url, self.org)},
+                'private': False, 'fork': False, 'default_branch': 'master',
+                'created_at': repo['created_at'],
+                'updated_at': repo['updated_at'],
+                'pushed_at': repo['pushed_at']}
+
+    def team_json(self, team):
+        return {'id': team['id'], 'name': team['name'], 'slug': team['slug'],
+                'permission': 'push',
+                'url': '%s/teams/%i' % (self.url, team['id'])}
+
+    def hook_json(self, repo, hook):
+        return dict(hook, url='%s/repos/%s/%s/hooks/%i' % (
+            self.url, self.org, repo['name'], hook['id']))
+
+    def ref_json(self, repo, ref):
+        url = '%s/repos/%s/%s/git/' % (self.url, self.org, repo['name'])
+        sha = repo['refs'][ref]
+        return {'ref': 'refs/' + ref, 'url': url + 'refs/' + ref,
+                'object': {'sha': sha, 'type': 'commit',
+                           'url': url + 'commits/' + sha}}
+
+    def commit_json(self, repo, sha):
+        commit = self._object(sha, 'commit')
+        url = '%s/repos/%s/%s/git/' % (self.url, self.org, repo['name'])
+        author = dict(commit.get('author') or {},
+                      date=repo['created_at'])
+        return {'sha': sha, 'url': url + 'commits/' + sha,
+                'message': commit['message'], 'author': author,
+                'committer': author,
+                'tree': {'sha': commit['tree'],
+                         'url': url + 'trees/' + commit['tree']},
+                'parents': [{'sha': parent, 'url': url + 'commits/' + parent}
+                            for parent in commit['parents']]}
+
+    # REST API
+
+    def get_org(self, params, query, data):
+        if params['org'] != self.org:
+            raise NotFound()
+        return 200, self.org_json()
+
+    def list_repos(self, params, query, data):
+        self.get_org(params, query, data)
+        return self._paginate([self.repo_json(repo)
+                               for repo in self.repos.values()],
+                              query, '%s/orgs/%s/repos' % (self.url, self.org))
+
+    def create_repo(self, params, query, data):
+        self.get_org(params, query, data)
+        if data['name'] in self.repos:
+            return 422, {'message': 'Validation Failed'}
+        repo = self.add_repo(data['name'], data.get('description'))
+        return 201, self.repo_json(repo)
+
+    def list_teams(self, params, query, data):
+        self.get_org(params, query, data)
+        return self._paginate([self.team_json(team)
+                               for team in self.teams.values()],
+                              query, '%s/orgs/%s/teams' % (self.url, self.org))
+
+    def list_team_repos(self, params, query, data):
+        team = self._team(params)
+        return self._paginate(
+            [self.repo_json(repo) for repo in self.repos.values()
+             if '%s/%s' % (self.org, repo['name']) in team['repos']],
+            query, '%s/teams/%i/repos' % (self.url, team['id']))
+
+    def add_team_repo(self, params, query, data):
+        self._team(params)['repos'].add(
+            '%s/%s' % (params['owner'], params['repo']))
+        return 204, None
+
+    def remove_team_repo(self, params, query, data):
+        self._team(params)['repos'].discard(
+            '%s/%s' % (params['owner'], params['repo']))
+        return 204, None
+
+    def get_repo(self, params, query, data):
+        return 200, self.repo_json(self._repo(params))
+
+    def edit_repo(self, params, query, data):
+        repo = self._repo(params)
+        if 'description' in data:
+            repo['description'] = data['description']
+        repo['updated_at'] = self._now()
+        return 200, self.repo_json(repo)
+
+    def list_hooks(self, params, query, data):
+        repo = self._repo(params)
+        return self._paginate(
+            [self.hook_json(repo, hook) for hook in repo['hooks'].values()],
+            query, '%s/repos/%s/%s/hooks' % (self.url, self.org, repo['name']))
+
+    def create_hook(self, params, query, data):
+        repo = self._repo(params)
+        hook = self.add_hook(
+            repo['name'], data['name'], data.get('config', {}),
+            data.get('events', ['push']), data.get('active', True))
+        return 201, self.hook_json(repo, hook)
+
+    def edit_hook(self, params, query, data):
+        repo = self._repo(params)
+        hook = repo['hooks'].get(int(params['id']))
+        if hook is None:
+            raise NotFound()
+        for name in ('config', 'events', 'active'):
+            if name in data:
+                hook[name] = data[name]
+        return 200, self.hook_json(repo, hook)
+
+    def get_contents(self, params, query, data):
+        repo = self._repo(params)
+        commit = self._object(
+            self._resolve(repo, query.get('ref', ['master'])[0]), 'commit')
+        tree = self._object(commit['tree'], 'tree')
+        sha = tree['entries'].get(params['path'])
+        if sha is None:
+            raise NotFound()
+        content = self._object(sha, 'blob')['content'].encode('utf-8')
+        return 200, {
+            'type': 'file', 'name': params['path'].split('/')[-1],
+            'path': params['path'], 'sha': sha, 'size': len(content),
+            'encoding': 'base64', '_links': {},
+            'content': base64.b64encode(content).decode('ascii'),
+            'url': '%s/repos/%s/%s/contents/%s' % (
+                self.url, self.org, repo['name'], params['path'])}
+
+    def get_ref(self, params, query, data):
+        repo = self._repo(params)
+        if params['ref'] not in repo['refs']:
+            raise NotFound()
+        return 200, self.ref_json(repo, params['ref'])
+
+    def update_ref(self, params, query, data):
+        repo = self._repo(params)
+        self._object(data['sha'], 'commit')
+        if params['ref'] not in repo['refs']:
+            raise NotFound()
+        repo['refs'][params['ref']] = data['sha']
+        repo['pushed_at'] = self._now()
+        return 200, self.ref_json(repo, params['ref'])
+
+    def get_commit(self, params, query, data):
+        return 200, self.commit_json(self._repo(params), params['sha'])
+
+    def create_blob(self, params, query, data):
+        repo = self._repo(params)
+        content = data['content']
+        if data.get('encoding') == 'base64':
+            content = base64.b64decode(content).decode('utf-8')
+        sha = self._store('blob', {'content': content})
+        return 201, {'sha': sha, 'url': '%s/repos/%s/%s/git/blobs/%s' % (
+            self.url, self.org, repo['name'], sha)}
+
+    def create_tree(self, params, query, data):
+        repo = self._repo(params)
+        entries = {}
+        if data.get('base_tree'):
+            entries.update(
+                self._object(data['base_tree'], 'tree')['entries'])
+        for entry in data['tree']:
+            entries[entry['path']] = entry['sha']
+        sha = self._store('tree', {'entries': entries})
+        return 201, {'sha': sha, 'tree': [],
+                     'url': '%s/repos/%s/%s/git/trees/%s' % (
+                         self.url, self.org, repo['name'], sha)}
+
+    def create_commit(self, params, query, data):
+        repo = self._repo(params)
+        self._object(data['tree'], 'tree')
+        sha = self._store('commit', {
+            'tree': data['tree'], 'parents': data.get('parents', []),
+            'message': data['message'], 'author': data.get('author')})
+        return 201, self.commit_json(repo, sha)
+
+    # GraphQL API
+
+    def _connection(self, items, first, after):
+        start = int(after or 0)
+        return {'pageInfo': {'hasNextPage': start + first < len(items),
+                             'endCursor': str(start + first)},
+                'nodes': items[start:start + first],
+                'edges': items[start:start + first]}
+
+    def _team_edges(self, team):
+        return [{'permission': 'WRITE', 'node': {'nameWithOwner': full_name}}
+                for full_name in sorted(team['repos'])]
+
+    def graphql(self, params, query, data):
+        text = data['query']
+        variables = data.get('variables') or {}
+        first = int(re.search(r'first:\s*(\d+)', text).group(1))
+        after = variables.get('after')
+        if variables.get('org') != self.org:
+            return 200, {'errors': [{'message': 'Unknown organization'}]}
+        if 'team(slug' in text:
+            for team in self.teams.values():
+                if team['slug'] == variables.get('slug'):
+                    break
+            else:
+                return 200, {'errors': [{'message': 'Unknown team'}]}
+            result = {'team': {'repositories': self._connection(
+                self._team_edges(team), first, after)}}
+        elif 'teams(' in text:
+            nodes = [{'name': team['name'], 'slug': team['slug'],
+                      'repositories': self._connection(
+                          self._team_edges(team), first, None)}
+                     for team in self.teams.values()]
+            result = {'teams': self._connection(nodes, first, after)}
+        else:
+            nodes = [{'name': repo['name'],
+                      'nameWithOwner': '%s/%s' % (self.org, repo['name']),
+                      'description': repo['description'],
+                      'updatedAt': repo['updated_at'],
+                      'pushedAt': repo['pushed_at'], 'isArchived': False}
+                     for repo in self.repos.values()]
+            result = {'repositories': self._connection(nodes, first, after)}
+        return 200, {'data': {'organization': result}}
+
+    # PyPI JSON API
+
+    def pypi(self, params, query, data):
+        info = self.packages.get(params['name'])
+        if info is None:
+            raise NotFound()
+        return 200, {'info': info, 'releases': {}}
+
+    def dispatch(self, method, path, query, body):
+        """Return the status, JSON data and headers for a request."""
+        for route_method, template, pattern, handler in _routes:
+            match = pattern.match(path)
+            if route_method != method or match is None:
+                continue
+            data = json.loads(body.decode('utf-8')) if body else {}
+            params = dict((name, urllib.parse.unquote(value))
+                          for name, value in match.groupdict().items())
+            with self._lock:
+                self.counts[method + ' ' + template] += 1
+                try:
+                    result = getattr(self, handler)(params, query, data)
+                except NotFound:
+                    return 404, {'message': 'Not Found'}, {}
+            return result if len(result) == 3 else result + ({},)
+        with self._lock:
+            self.counts[method + ' <unknown>'] += 1
+        return 404, {'message': 'Not Found'}, {}
+
+    def reset_counts(self):
+        with self._lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+        return counts
+
+
+def get_seed_files(name, classifiers, number):
+    files = {'setup.py': SETUP_PY % (name, classifiers)}
+    if number % 2:
+        files['.gitignore'] = '*.pyc\n.*\n'
+    if number % 5 == 0:
+        files['.travis.yml'] = 'language: python\n# custom\n'
+    return files
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, like the real services.
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, data, headers = self.server.github.dispatch(
+            self.command, url.path, urllib.parse.parse_qs(url.query), body)
+        content = b''
+        if data is not None:
+            content = json.dumps(data).encode('utf-8')
+        if status == 200 and self.command == 'GET':
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                status, content = 304, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if content:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    """Serves a ``FakeGitHub`` on a local port in a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, github, host='127.0.0.1', port=0):
+        http.server.ThreadingHTTPServer.__init__(
+            self, (host, port), RequestHandler)
+        self.github = github
+        self.url = github.url = 'http://%s:%i' % self.server_address[:2]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def create_git_remotes(path, github, names=None):
+    """Create local bare Git repositories with the seeded files.
+
+    Use ``file://<path>/`` as ``[github] repo-url``.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name in names if names is not None else list(github.repos):
+        tree = github.objects[github.objects[
+            github.repos[name]['refs']['heads/master']]['tree']]
+        remote_path = os.path.join(path, name)
+        with tempfile.TemporaryDirectory() as work_path:
+            for filename, sha in tree['entries'].items():
+                with open(os.path.join(work_path, filename), 'w') as file:
+                    file.write(github.objects[sha]['content'])
+            git = ['git', '-c', 'user.name=Benchmark',
+                   '-c', 'user.email=benchmark@localhost']
+            subprocess.check_call(git + ['init', '-q'], cwd=work_path)
+            subprocess.check_call(
+                git + ['add', '-A', '-f', '.'], cwd=work_path)
+            subprocess.check_call(
+                git + ['commit', '-q', '-m', 'Initial.'], cwd=work_path)
+            subprocess.check_call(
+                git + ['clone', '-q', '--bare', work_path, remote_path])
+        # Like GitHub, allow partial clones.
+        subprocess.check_call(
+            ['git', 'config', 'uploadpack.allowFilter', 'true'],
+            cwd=remote_path)
@@ -0,0 +1,206 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Organization Inventory via the GitHub GraphQL API
+
+Repositories, their descriptions and the repositories of all teams are
+loaded in a few paginated queries instead of several REST calls per
+repository. Hooks are not available through GraphQL and still use REST.
+Repositories are reconciled against the inventory; their REST resource is
+only loaded for file contents and writes.
+"""
+from __future__ import print_function
+import collections
+import threading
+from github3.repos.hook import Hook
+
+DEFAULT_GRAPHQL_URL = 'https://api.github.com/graphql'
+PAGE_SIZE = 100
+
+RepoInfo = collections.namedtuple(
+    'RepoInfo', 'name full_name description updated_at pushed_at archived')
+
+REPOS_QUERY = '''
+query($org: String!, $after: String) {
+  organization(login: $org) {
+    repositories(first: %i, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name nameWithOwner description updatedAt pushedAt isArchived
+      }
+    }
+  }
+}
+''' % PAGE_SIZE
+
+TEAMS_QUERY = '''
+query($org: String!, $after: String) {
+  organization(login: $org) {
+    teams(first: %i, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name slug
+        repositories(first: %i) {
+          pageInfo { hasNextPage endCursor }
+          edges { permission node { nameWithOwner } }
+        }
+      }
+    }
+  }
+}
+''' % (PAGE_SIZE, PAGE_SIZE)
+
+TEAM_REPOS_QUERY = '''
+query($org: String!, $slug: String!, $after: String) {
+  organization(login: $org) {
+    team(slug: $slug) {
+      repositories(first: %i, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        edges { permission node { nameWithOwner } }
+      }
+    }
+  }
+}
+''' % PAGE_SIZE
+
+
+class GraphQLError(Exception):
+    pass
+
+
+class LazyRepository(object):
+    """A repository of the inventory.
+
+    Name, description, timestamps and the archive flag come from the
+    inventory; hooks are listed by name. Everything else loads the REST
+    repository on first use.
+    """
+
+    def __init__(self, gh, info):
+        self.info = info
+        self.name = info.name
+        self.full_name = info.full_name
+        self.description = info.description
+        self.updated_at = info.updated_at
+        self.pushed_at = info.pushed_at
+        self.archived = info.archived
+        self._gh = gh
+        self._repo = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._repo is None:
+                owner = self.full_name.split('/')[0]
+                self._repo = self._gh.repository(owner, self.name)
+            return self._repo
+
+    def iter_hooks(self, number=-1, etag=None):
+        if self._repo is not None:
+            return self._repo.iter_hooks(number, etag)
+        url = self._gh._build_url('repos', self.full_name, 'hooks')
+        return self._gh._iter(int(number), url, Hook, etag=etag)
+
+    def edit(self, name, **kw):
+        updated = self.load().edit(name, **kw)
+        if updated and 'description' in kw:
+            self.description = kw['description']
+        return updated
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+class Inventory(object):
+    """Repositories (``repos``) and team permissions (``teams``) of an org.
+
+    ``teams`` maps every team name to ``{repo full name: permission}``.
+    """
+
+    def __init__(self, repos, teams):
+        self.repos = repos
+        self.teams = teams
+
+    def team_repos(self):
+        return dict((name, set(perms)) for name, perms in self.teams.items())
+
+    def repository(self, gh, name):
+        """Return a lazy repository or ``None`` if there is none."""
+        info = self.repos.get(name)
+        return LazyRepository(gh, info) if info is not None else None
+
+    def iter_repositories(self, gh):
+        for name in sorted(self.repos):
+            yield self.repository(gh, name)
+
+
+def query(session, url, text, variables):
+    response = session.post(url, json={'query': text, 'variables': variables})
+    response.raise_for_status()
+    data = response.json()
+    if data.get('errors'):
+        raise GraphQLError(
+            '; '.join(error.get('message', '?') for error in data['errors']))
+    return data['data']
+
+
+def paginate(session, url, text, variables, path, after=None):
+    """Yield the nodes or edges of a paginated connection.
+
+    ``path`` leads from the result data to the connection.
+    """
+    while True:
+        data = query(session, url, text, dict(variables, after=after))
+        for key in path:
+            data = data[key]
+        for item in data.get('nodes') or data.get('edges') or ():
+            yield item
+        if not data['pageInfo']['hasNextPage']:
+            break
+        after = data['pageInfo']['endCursor']
+
+
+def fetch_inventory(session, org_name, url=DEFAULT_GRAPHQL_URL):
+    repos = {}
+    for node in paginate(session, url, REPOS_QUERY, {'org': org_name},
+                         ('organization', 'repositories')):
+        repos[node['name']] = RepoInfo(
+            node['name'], node['nameWithOwner'], node['description'],
+            node['updatedAt'], node['pushedAt'], node['isArchived'])
+
+    teams = {}
+    for node in paginate(session, url, TEAMS_QUERY, {'org': org_name},
+                         ('organization', 'teams')):
+        perms = teams[node['name']] = {}
+        connection = node['repositories']
+        for edge in connection['edges']:
+            perms[edge['node']['nameWithOwner']] = edge['permission']
+        if connection['pageInfo']['hasNextPage']:
+            # Only teams with many repositories need more queries.
+            for edge in paginate(
+                    session, url, TEAM_REPOS_QUERY,
+                    {'org': org_name, 'slug': node['slug']},
+                    ('organization', 'team', 'repositories'),
+                    connection['pageInfo']['endCursor']):
+                perms[edge['node']['nameWithOwner']] = edge['permission']
+    return Inventory(repos, teams)
+
+
+def get_inventory(gh, config):
+    url = config.get('github', 'graphql-url', fallback=DEFAULT_GRAPHQL_URL)
+    org_name = config.get('github', 'organization')
+    print('Loading inventory of ' + org_name + ' ...')
+    inventory = fetch_inventory(gh._session, org_name, url)
+    print('  * %i repositories, %i teams' % (
+        len(inventory.repos), len(inventory.teams)))
+    return inventory
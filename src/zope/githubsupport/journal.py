@@ -0,0 +1,78 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Migration Stage Journal
+
+Every finished or failed stage of a package is appended as one JSON line,
+so that an interrupted migration can be resumed.
+"""
+import io
+import json
+import os
+import threading
+import time
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with io.open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run.
+                        continue
+                    self.states[(entry['package'], entry['stage'])] = entry
+
+    def status(self, package, stage):
+        entry = self.states.get((package, stage))
+        return entry['status'] if entry is not None else None
+
+    def is_done(self, package, stage):
+        return self.status(package, stage) == DONE
+
+    def finished(self, package, stage):
+        """Return when a stage was last finished or ``None``."""
+        entry = self.states.get((package, stage))
+        if entry is None or entry['status'] != DONE:
+            return None
+        return entry['time']
+
+    def record(self, package, stage, status, error=None, duration=None):
+        entry = {'package': package, 'stage': stage, 'status': status,
+                 'time': time.time()}
+        if error is not None:
+            entry['error'] = error
+        if duration is not None:
+            entry['duration'] = duration
+        with self._lock:
+            self.states[(package, stage)] = entry
+            if self.path is None:
+                return
+            with io.open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, sort_keys=True) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def failures(self):
+        return sorted((entry['package'], entry['stage'], entry.get('error'))
+                      for entry in self.states.values()
+                      if entry['status'] == FAILED)
@@ -0,0 +1,314 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Run Metrics and Profiling
+
+Stage durations per repository, HTTP requests per endpoint and
+subprocesses per command are collected for every run. At the end they are
+summarized and written as a JSON report (``--metrics``) and a Prometheus
+textfile (``[metrics] textfile``). ``--profile`` samples the stacks of all
+threads and writes them in the collapsed format used by flame graphs.
+"""
+from __future__ import print_function
+import collections
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+DEFAULT_PROFILE_INTERVAL = 0.005
+PREFIX = 'githubsupport'
+
+# Turn request paths into endpoints, e.g. ``/repos/{owner}/{repo}/hooks``.
+ENDPOINT_PATTERNS = (
+    (re.compile(r'/repos/[^/]+/[^/]+'), '/repos/{owner}/{repo}'),
+    (re.compile(r'/orgs/[^/]+'), '/orgs/{org}'),
+    (re.compile(r'/teams/\d+/repos/.+'), '/teams/{id}/repos/{owner}/{repo}'),
+    (re.compile(r'/teams/\d+'), '/teams/{id}'),
+    (re.compile(r'/hooks/\d+$'), '/hooks/{id}'),
+    (re.compile(r'/contents/.+$'), '/contents/{path}'),
+    (re.compile(r'/git/refs/.+$'), '/git/refs/{ref}'),
+    (re.compile(r'/git/commits/\w+$'), '/git/commits/{sha}'),
+    (re.compile(r'/pypi/[^/]+/json$'), '/pypi/{name}/json'),
+    )
+
+# Commands reported together with their subcommand.
+SUBCOMMANDS = ('git', 'svn', 'svnadmin', 'svnlook', 'svnmucc')
+
+
+def get_endpoint(method, url):
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return '%s %s%s' % (method, parts.netloc, path)
+
+
+def get_command_name(cmd):
+    name = os.path.basename(cmd[0])
+    if name not in SUBCOMMANDS:
+        return name
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ('-c', '-C'):
+            # Global option with a value, e.g. ``git -c name=value``.
+            next(args, None)
+        elif not arg.startswith('-'):
+            return '%s %s' % (name, arg)
+    return name
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.started = time.time()
+        # stage -> [count, total seconds, max seconds]
+        self.stages = {}
+        self.repos = collections.defaultdict(dict)
+        self.requests = collections.Counter()
+        self.request_seconds = collections.Counter()
+        self.statuses = collections.Counter()
+        self.bytes = collections.Counter()
+        self.commands = collections.Counter()
+        self.command_seconds = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record_stage(self, stage, duration, repo=None):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+            if repo is not None:
+                repo_stages = self.repos[repo]
+                repo_stages[stage] = repo_stages.get(stage, 0.0) + duration
+
+    @contextlib.contextmanager
+    def timed(self, stage, repo=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.time() - start, repo)
+
+    def record_request(self, method, url, duration, sent, received, status):
+        endpoint = get_endpoint(method, url)
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.request_seconds[endpoint] += duration
+            self.statuses[str(status)] += 1
+            self.bytes['sent'] += sent
+            self.bytes['received'] += received
+
+    def record_command(self, cmd, duration):
+        name = get_command_name(cmd)
+        with self._lock:
+            self.commands[name] += 1
+            self.command_seconds[name] += duration
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'started': self.started, 'finished': time.time(),
+                'stages': dict(
+                    (stage, {'count': count, 'seconds': total, 'max': max_})
+                    for stage, (count, total, max_) in self.stages.items()),
+                'repos': dict(self.repos),
+                'requests': dict(
+                    (endpoint, {'count': count,
+                                'seconds': self.request_seconds[endpoint]})
+                    for endpoint, count in self.requests.items()),
+                'statuses': dict(self.statuses),
+                'bytes': dict(self.bytes),
+                'commands': dict(
+                    (name, {'count': count,
+                            'seconds': self.command_seconds[name]})
+                    for name, count in self.commands.items())}
+
+    def prometheus(self, job):
+        data = self.as_dict()
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append('# HELP %s_%s %s' % (PREFIX, name, help))
+            # Values of the last run, so all are gauges.
+            lines.append('# TYPE %s_%s gauge' % (PREFIX, name))
+            for labels, value in samples:
+                labels = dict(labels, job=job)
+                lines.append('%s_%s{%s} %s' % (PREFIX, name, ','.join(
+                    '%s="%s"' % (key, _escape(value))
+                    for key, value in sorted(labels.items())), value))
+
+        stages = sorted(data['stages'].items())
+        metric('stage_runs', 'Number of stage runs.',
+               [({'stage': stage}, entry['count']) for stage, entry in stages])
+        metric('stage_seconds', 'Time spent per stage.',
+               [({'stage': stage}, entry['seconds'])
+                for stage, entry in stages])
+        requests = sorted(data['requests'].items())
+        metric('http_requests', 'HTTP requests per endpoint.',
+               [({'endpoint': endpoint}, entry['count'])
+                for endpoint, entry in requests])
+        metric('http_request_seconds', 'HTTP time per endpoint.',
+               [({'endpoint': endpoint}, entry['seconds'])
+                for endpoint, entry in requests])
+        metric('http_bytes', 'HTTP bytes sent and received.',
+               [({'direction': direction}, count)
+                for direction, count in sorted(data['bytes'].items())])
+        commands = sorted(data['commands'].items())
+        metric('commands', 'Started subprocesses per command.',
+               [({'command': name}, entry['count'])
+                for name, entry in commands])
+        metric('command_seconds', 'Subprocess time per command.',
+               [({'command': name}, entry['seconds'])
+                for name, entry in commands])
+        metric('run_duration_seconds', 'Duration of the last run.',
+               [({}, data['finished'] - data['started'])])
+        metric('run_finished_timestamp_seconds', 'End of the last run.',
+               [({}, data['finished'])])
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self, limit=5):
+        data = self.as_dict()
+        print()
+        print('=====[ Metrics ]' + '='*62)
+        print('Duration: %.1fs' % (data['finished'] - data['started']))
+        for stage, entry in sorted(data['stages'].items(),
+                                   key=lambda item: -item[1]['seconds']):
+            print('  * %-20s %8.1fs in %i runs (max %.1fs)' % (
+                stage, entry['seconds'], entry['count'], entry['max']))
+        print('HTTP requests: %i (%i kB received)' % (
+            sum(self.requests.values()), data['bytes'].get('received', 0)
+            // 1024))
+        for endpoint, count in self.requests.most_common(limit):
+            print('  * %6i %s' % (count, endpoint))
+        print('Subprocesses: %i' % sum(self.commands.values()))
+        for name, count in self.commands.most_common(limit):
+            print('  * %6i %s (%.1fs)' % (
+                count, name, self.command_seconds[name]))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _write(path, text):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    # Readers like the node exporter must never see partial files.
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of all threads at a fixed interval.
+
+    Unlike ``cProfile``, this covers the worker threads and shows where
+    the run waits for the network or subprocesses.
+    """
+
+    def __init__(self, interval=DEFAULT_PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%i)' % (
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[tuple(reversed(stack))] += 1
+
+    def write(self, path):
+        _write(path, ''.join(
+            '%s %i\n' % (';'.join(stack), count)
+            for stack, count in sorted(self.samples.items())))
+
+    def print_top(self, limit=15):
+        total = sum(self.samples.values()) or 1
+        leaves = collections.Counter()
+        for stack, count in self.samples.items():
+            leaves[stack[-1]] += count
+        print()
+        print('=====[ Profile ]' + '='*62)
+        print('Samples: %i (every %ims, all threads)' % (
+            total, self.interval * 1000))
+        for frame, count in leaves.most_common(limit):
+            print('  * %5.1f%% %s' % (100.0 * count / total, frame))
+
+
+current = Metrics()
+
+def timed(stage, repo=None):
+    return current.timed(stage, repo)
+
+def record_stage(stage, duration, repo=None):
+    current.record_stage(stage, duration, repo)
+
+def record_request(method, url, duration, sent, received, status):
+    current.record_request(method, url, duration, sent, received, status)
+
+def record_command(cmd, duration):
+    current.record_command(cmd, duration)
+
+
+def start_profiler(options):
+    if not getattr(options, 'profile', None):
+        return None
+    return SamplingProfiler().start()
+
+
+def finish(job, config, options, profiler=None):
+    """Report the metrics of the run and write the configured files."""
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(options.profile)
+        profiler.print_top()
+        print('Profile written to ' + options.profile)
+    current.print_summary()
+    path = getattr(options, 'metrics_file', None) or config.get(
+        'metrics', 'report-file', fallback=None)
+    if path:
+        _write(path, json.dumps(
+            dict(current.as_dict(), job=job), indent=1, sort_keys=True))
+        print('Metrics written to ' + path)
+    textfile = config.get('metrics', 'textfile', fallback=None)
+    if textfile:
+        _write(textfile, current.prometheus(job))
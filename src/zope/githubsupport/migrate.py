@@ -14,151 +14,685 @@
 """SVN -> GitHub Repository Migration
 """
 from __future__ import print_function
-import configparser
+import collections
+import contextlib
+import copy
 import io
+import json
 import optparse
 import os
+import re
+import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+from concurrent import futures
 
-from zope.githubsupport import repos
-from zope.githubsupport.util import do
+from zope.githubsupport import (
+    journal, metrics, policy, repos, session, svnindex, travis, util)
+from zope.githubsupport.util import do, print_summary, run_parallel
 
 DEFAULT_CONFIG_FILE = os.path.join(
     os.path.dirname(__file__), '..', '..', '..', 'zope.cfg')
 
+def write_rules_file(pkg_names, config, rules_path):
+    rules = []
+    for pkg_name in pkg_names:
+        ns = {'package': pkg_name,
+              'package_regex': pkg_name.replace('.', '\\.'),
+              'package_path': pkg_name.replace('.', '/')}
+        rules.append(
+            config.get('migrate', 'pkg-rules-template').format(**ns))
+
+    ns = {'packages_rules': '\n\n'.join(rules)}
+    with io.open(rules_path, 'w') as file:
+        file.write(
+            config.get('migrate', 'rules-template').format(**ns))
+    print('***** Created rules file: ' + rules_path)
+    return rules_path
+
+
+def get_svn2git_cmd(config, rules_path, max_rev=None, resume_from=None):
+    cmd = [config.get('migrate', 'svn-all-fast-export'),
+           '--svn-branches',
+           '--add-metadata-notes',
+           '--identity-map', config.get('migrate', 'identity-map'),
+           '--rules', rules_path,
+           '--stats',
+           ]
+    if max_rev is not None:
+        cmd += ['--max-rev', str(max_rev)]
+    if resume_from is not None:
+        cmd += ['--resume-from', str(resume_from)]
+    return cmd + [config.get('migrate', 'svn-mirror')]
+
+
+def split_shards(pkg_names, count):
+    count = max(min(count, len(pkg_names)), 1)
+    return [pkg_names[i::count] for i in range(count)]
+
+
+def convert_shard(number, pkg_names, shard_path, config, max_rev=None,
+                  first_rev=None):
+    """Convert one shard of packages in its own directory."""
+    os.makedirs(shard_path)
+    rules_path = write_rules_file(
+        pkg_names, config, os.path.join(shard_path, 'rules.txt'))
+    log_path = os.path.join(shard_path, 'svn2git.log')
+    with io.open(log_path, 'w') as log:
+        result = util.run(
+            get_svn2git_cmd(config, rules_path, max_rev, first_rev),
+            cwd=shard_path,
+            on_output=lambda stream, line: log.write(line), capture=20)
+    return {'shard': number, 'packages': pkg_names, 'path': shard_path,
+            'log': log_path, 'result': result}
+
+
+# What svn-all-fast-export writes per repository into its working
+# directory. ``--resume-from`` needs the logs to restore the branches.
+CONVERSION_FILES = ('%s', 'log-%s', 'gitlog-%s')
+
+
+def remove_conversion(pkg_name, target_path):
+    """Remove an earlier conversion of a package before a full one."""
+    for name in CONVERSION_FILES:
+        path = os.path.join(target_path, name % pkg_name)
+        if os.path.isdir(path):
+            print('***** Removing earlier conversion: ' + path)
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def merge_shard(shard, target_path):
+    for pkg_name in shard['packages']:
+        for name in CONVERSION_FILES:
+            src = os.path.join(shard['path'], name % pkg_name)
+            if os.path.exists(src):
+                os.rename(src, os.path.join(target_path, name % pkg_name))
+
+
+def print_shard_report(shards):
+    print()
+    print('=====[ Conversion ]' + '='*59)
+    for shard in sorted(shards, key=lambda shard: shard['shard']):
+        result = shard['result']
+        print('Shard %i: %i packages, %.1fs, exit code %i' % (
+            shard['shard'], len(shard['packages']), result.duration,
+            result.returncode))
+        print('  Log: ' + shard['log'])
+        for line in result.stdout.splitlines()[-5:]:
+            print('  ' + line)
+
+
+WATERMARKS_FILE = 'svn2git-revisions.json'
+_watermarks_lock = threading.Lock()
+
+
+def load_watermarks(target_path):
+    path = os.path.join(target_path, WATERMARKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with io.open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_watermarks(target_path, watermarks):
+    path = os.path.join(target_path, WATERMARKS_FILE)
+    with io.open(path + '.tmp', 'w') as file:
+        json.dump(watermarks, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def update_watermarks(target_path, pkg_names, revision):
+    with _watermarks_lock:
+        watermarks = load_watermarks(target_path)
+        watermarks.update(dict((pkg_name, revision) for pkg_name in pkg_names))
+        save_watermarks(target_path, watermarks)
+
+
+def get_youngest_revision(config):
+    result = util.run(
+        ['svnlook', 'youngest', config.get('migrate', 'svn-mirror')],
+        check=True)
+    return int(result.stdout.strip())
+
+
+def convert_packages(pkg_names, target_path, config, options,
+                     max_rev=None, resume_from=None, first_rev=None):
+    """Convert the packages; ``first_rev`` skips the older revisions of a
+    new conversion, which must not concern the packages."""
+    shards = getattr(options, 'shards', 1)
+    if resume_from is None:
+        # A full conversion starts from scratch; existing repositories would
+        # also stop the merge of the shards after the conversion.
+        for pkg_name in pkg_names:
+            remove_conversion(pkg_name, target_path)
+    # Incremental conversions have to run where the Git repositories are.
+    if (options.rules_path is not None or shards <= 1 or
+        resume_from is not None):
+        if resume_from is None:
+            resume_from = first_rev
+        with tempfile.TemporaryDirectory(prefix='svn2git-') as tmp_path:
+            rules_path = options.rules_path
+            if rules_path is None:
+                rules_path = write_rules_file(
+                    pkg_names, config, os.path.join(tmp_path, 'rules.txt'))
+            do(get_svn2git_cmd(config, rules_path, max_rev, resume_from),
+               cwd=target_path, print_stdout=False)
+        return
+
+    # Every shard converts its packages concurrently with its own rules file
+    # against the (read-only) SVN mirror.
+    pkg_shards = split_shards(list(pkg_names), shards)
+    util.set_max_processes(max(len(pkg_shards), util.runner.max_processes))
+    work_path = tempfile.mkdtemp(prefix='shards-', dir=target_path)
+    with futures.ThreadPoolExecutor(max_workers=len(pkg_shards)) as executor:
+        results = list(executor.map(
+            lambda args: convert_shard(*args, config=config,
+                                       max_rev=max_rev, first_rev=first_rev),
+            [(number, names, os.path.join(work_path, str(number)))
+             for number, names in enumerate(pkg_shards)]))
+    print_shard_report(results)
+    failed = [shard for shard in results if shard['result'].returncode != 0]
+    if failed:
+        sys.exit('Conversion failed for shard(s): %s (see %s)' % (
+            ', '.join(str(shard['shard']) for shard in failed), work_path))
+    for shard in results:
+        merge_shard(shard, target_path)
+    shutil.rmtree(work_path)
+
+
 def svn2git(target_path, config, options):
     print('Converting package into Git repository. ' +
           'That may take several minutes.')
-    rules_path = options.rules_path
-    if rules_path is None:
-        rules = []
-        for pkg_name in options.repos:
-            ns = {'package': pkg_name,
-                  'package_regex': pkg_name.replace('.', '\\.'),
-                  'package_path': pkg_name.replace('.', '/')}
-            rules.append(
-                config.get('migrate', 'pkg-rules-template').format(**ns))
-
-        ns = {'packages_rules': '\n\n'.join(rules)}
-        rules_path = tempfile.mktemp(pkg_name+'.txt')
-        with io.open(rules_path, 'w') as file:
-            file.write(
-                config.get('migrate', 'rules-template').format(**ns))
-        print('***** Created rules file: ' + rules_path)
-
-    do([config.get('migrate', 'svn-all-fast-export'),
-        '--svn-branches',
-        '--add-metadata-notes',
-        '--identity-map', config.get('migrate', 'identity-map'),
-        '--rules', rules_path,
-        '--stats',
-        config.get('migrate', 'svn-mirror'),
-        ], cwd=target_path, print_stdout=False)
+    if options.rules_path is not None:
+        # The rules may cover anything, so only a full conversion is safe.
+        convert_packages(options.repos, target_path, config, options)
+        return
+
+    # The last converted SVN revision of every package is remembered, so
+    # that re-runs only convert the new revisions.
+    watermarks = {}
+    if not options.full_convert:
+        watermarks = load_watermarks(target_path)
+    youngest = get_youngest_revision(config)
+    # With an index only the revisions touching the packages are converted.
+    index = svnindex.get_index(config)
+    if index is not None:
+        index.update(youngest)
+    groups = collections.defaultdict(list)
+    for pkg_name in options.repos:
+        last = watermarks.get(pkg_name)
+        if last is not None and not os.path.exists(
+                os.path.join(target_path, pkg_name)):
+            last = None
+        if last is not None and last >= youngest:
+            print('***** %s is converted up to revision %i.' % (
+                pkg_name, last))
+            continue
+        if index is not None and index.get_range([pkg_name], last) is None:
+            if last is None:
+                print('***** %s has no SVN history.' % pkg_name)
+            else:
+                print('***** %s has no new SVN revisions.' % pkg_name)
+            continue
+        groups[last].append(pkg_name)
+
+    for last, pkg_names in sorted(groups.items(),
+                                  key=lambda item: item[0] or 0):
+        first_rev, max_rev = None, youngest
+        if index is not None:
+            first_rev, max_rev = index.get_range(pkg_names, last)
+        resume_from = None
+        if last is not None:
+            resume_from = first_rev or last + 1
+            print('***** Converting revisions %i-%i of: %s' % (
+                resume_from, max_rev, ', '.join(pkg_names)))
+        elif first_rev is not None:
+            print('***** Converting revisions %i-%i of: %s' % (
+                first_rev, max_rev, ', '.join(pkg_names)))
+        convert_packages(pkg_names, target_path, config, options,
+                         max_rev, resume_from, first_rev)
+        # Only what was converted; the next run starts after ``max_rev``.
+        update_watermarks(target_path, pkg_names, max_rev)
+
+
+PUSH_RETRIES = 3
+# The refs that are pushed and kept in sync with GitHub.
+PUSHED_REFS = ('refs/heads', 'refs/tags', 'refs/notes')
+
+
+def get_remote_url(config, pkg_name):
+    push_url = config.get('migrate', 'push-url', fallback=None)
+    if push_url:
+        return push_url + pkg_name
+    return 'git@github.com:%s/%s.git' % (
+        policy.get_policy(config).organization, pkg_name)
+
+
+def parse_refs(output):
+    refs = {}
+    for line in output.splitlines():
+        sha, ref = line.split(None, 1)
+        ref = ref.strip()
+        # Peeled tags and HEAD are not pushed themselves.
+        if ref.startswith('refs/') and not ref.endswith('^{}'):
+            refs[ref] = sha
+    return refs
+
+
+def ensure_remote(git_path, url):
+    result = util.run(['git', 'remote', 'get-url', 'origin'], cwd=git_path)
+    if result.returncode != 0:
+        do(['git', 'remote', 'add', 'origin', url], cwd=git_path)
+    elif result.stdout.strip() != url:
+        do(['git', 'remote', 'set-url', 'origin', url], cwd=git_path)
+
+
+def run_retried(cmd, git_path, description, capture=50):
+    """Run a network command, retrying with backoff before giving up."""
+    for attempt in range(PUSH_RETRIES + 1):
+        result = util.run(cmd, cwd=git_path, capture=capture)
+        if result.returncode == 0:
+            return result
+        if attempt < PUSH_RETRIES:
+            delay = 2 ** (attempt + 1)
+            print('***** %s failed; retrying in %is.' % (description, delay))
+            time.sleep(delay)
+    print(result.stderr)
+    sys.exit('%s failed.' % description)
+
+
+def get_changed_refs(git_path, url, pkg_name):
+    """Return the local refs whose commit differs from the remote and the
+    remote refs missing locally."""
+    local = parse_refs(util.run(
+        ['git', 'for-each-ref', '--format=%(objectname) %(refname)']
+        + list(PUSHED_REFS), cwd=git_path, check=True).stdout)
+    remote = parse_refs(run_retried(
+        ['git', 'ls-remote', url], git_path,
+        'Listing the GitHub refs of ' + pkg_name, capture=True).stdout)
+    changed = sorted(
+        ref for ref, sha in local.items() if remote.get(ref) != sha)
+    # Like ``git push --mirror``, refs deleted locally are deleted remotely.
+    deleted = sorted(ref for ref in remote if ref not in local and
+                     ref.startswith(tuple(p + '/' for p in PUSHED_REFS)))
+    return changed, deleted
+
+
+def repack(git_path):
+    do(['git', 'gc', '--prune=now', '--quiet'], cwd=git_path,
+       print_stdout=False)
+
+
+def push_package(pkg_name, target_path, config, options):
+    git_path = os.path.join(target_path, pkg_name)
+    url = get_remote_url(config, pkg_name)
+    ensure_remote(git_path, url)
+    if options.repack:
+        repack(git_path)
+    refs, deleted = get_changed_refs(git_path, url, pkg_name)
+    if not refs and not deleted:
+        print('***** %s is up-to-date on GitHub.' % pkg_name)
+        return
+    cmd = ['git', 'push', '-u', 'origin'] + [
+        '+%s:%s' % (ref, ref) for ref in refs] + [
+        ':' + ref for ref in deleted]
+    print(' '.join(cmd[:4]) + ' (%i refs, %i deleted)' % (
+        len(refs), len(deleted)))
+    run_retried(cmd, git_path, 'Push of ' + pkg_name)
+    print('***** Pushed %i refs of %s, deleted %i.' % (
+        len(refs), pkg_name, len(deleted)))
 
 
 def push2github(target_path, config, options):
+    # Only the refs that differ from GitHub are pushed; several packages are
+    # pushed at the same time.
+    jobs = getattr(options, 'push_jobs', 1)
+    util.set_max_processes(max(jobs, util.runner.max_processes))
+    succeeded, failed = run_parallel(
+        lambda pkg_name: push_package(pkg_name, target_path, config, options),
+        options.repos, jobs)
+    if failed:
+        print_summary(succeeded, failed)
+        sys.exit('Push failed for: ' +
+                 ', '.join(pkg_name for pkg_name, err in failed))
+
+
+MOVED_MESSAGE = 'Moved to GitHub.'
+
+
+def get_moved_text(pkg_name):
+    return "See https://github.com/zopefoundation/" + pkg_name
+
+
+def clean_svn_checkout(config, options):
     for pkg_name in options.repos:
-        git_path = os.path.join(target_path, pkg_name)
-        do(['git', 'remote', 'add', 'origin',
-            'git@github.com:%s/%s.git' %(
-                    config.get('github', 'organization'), pkg_name)
-            ], cwd=git_path)
-        do(['git', 'push', '-u', 'origin', '--mirror'], cwd=git_path)
+        with tempfile.TemporaryDirectory() as co_path:
+            print('Checking out code from SVN into: ' + co_path)
+            pkg_path = os.path.join(co_path, pkg_name+'.svn')
+            do(['svn', 'co', '--ignore-externals',
+                config.get('migrate', 'svn-repos')+pkg_name+'/trunk',
+                pkg_path
+                ])
+            do(['svn', 'propdel', 'svn:externals', '.'], pkg_path)
+            to_delete = [os.path.join(pkg_path, fn)
+                         for fn in os.listdir(pkg_path)
+                         if fn not in ('.svn',)]
+            if len(to_delete):
+                do(['svn', 'rm', '--force'] + to_delete)
+            moved_path = os.path.join(pkg_path, 'MOVED_TO_GITHUB')
+            with io.open(moved_path, 'w') as file:
+                file.write(get_moved_text(pkg_name))
+            do(['svn', 'add', moved_path])
+            do(['svn', 'ci', '-m', MOVED_MESSAGE, pkg_path])
+
+
+def get_svnmucc_actions(pkg_name, config, tmp_path):
+    """Return the ``svnmucc`` actions replacing trunk by a tombstone."""
+    root = config.get('migrate', 'svn-repos')
+    trunk = pkg_name + '/trunk'
+    actions = []
+    externals = util.run(
+        ['svn', 'propget', 'svn:externals', root + trunk])
+    if externals.returncode == 0 and externals.stdout.strip():
+        actions += ['propdel', 'svn:externals', trunk]
+    entries = util.run(['svn', 'ls', root + trunk], check=True).stdout
+    for entry in entries.splitlines():
+        entry = entry.strip().rstrip('/')
+        if entry:
+            actions += ['rm', trunk + '/' + entry]
+    moved_path = os.path.join(tmp_path, pkg_name + '.MOVED_TO_GITHUB')
+    with io.open(moved_path, 'w') as file:
+        file.write(get_moved_text(pkg_name))
+    actions += ['put', moved_path, trunk + '/MOVED_TO_GITHUB']
+    return actions
+
+
+def clean_svn_remote(config, options):
+    """Tombstone the trunks with ``svnmucc``, without any working copy.
+
+    Every package gets one atomic commit, or all packages share a single one
+    if ``[migrate] clean-svn-batch`` is set.
+    """
+    root = config.get('migrate', 'svn-repos')
+    batch = config.getboolean('migrate', 'clean-svn-batch', fallback=False)
+    groups = [options.repos] if batch else [[name] for name in options.repos]
+    with tempfile.TemporaryDirectory() as tmp_path:
+        for pkg_names in groups:
+            actions = []
+            for pkg_name in pkg_names:
+                actions += get_svnmucc_actions(pkg_name, config, tmp_path)
+            do(['svnmucc', '-m', MOVED_MESSAGE, '-U', root] + actions)
 
 
 def clean_svn(config, options):
-    for pkg_name in options.repos:
-        co_path = tempfile.mkdtemp()
-        print('Checking out code from SVN into: ' + co_path)
-        pkg_path = os.path.join(co_path, pkg_name+'.svn')
-        do(['svn', 'co', '--ignore-externals',
-            config.get('migrate', 'svn-repos')+pkg_name+'/trunk',
-            pkg_path
-            ])
-        do(['svn', 'propdel', 'svn:externals', '.'], pkg_path)
-        to_delete = [os.path.join(pkg_path, fn)
-                     for fn in os.listdir(pkg_path)
-                     if fn not in ('.svn',)]
-        if len(to_delete):
-            do(['svn', 'rm', '--force'] + to_delete)
-        moved_path = os.path.join(pkg_path, 'MOVED_TO_GITHUB')
-        with io.open(moved_path, 'w') as file:
-            file.write("See https://github.com/zopefoundation/"+pkg_name)
-        do(['svn', 'add', moved_path])
-        do(['svn', 'ci', '-m', 'Moved to GitHub.', pkg_path])
+    if config.get('migrate', 'clean-svn-mode', fallback='checkout') == 'remote':
+        clean_svn_remote(config, options)
+    else:
+        clean_svn_checkout(config, options)
+
+ZTK_LINE = r'(?<![\w.]){package} = .*'
+ZTK_REPLACEMENT = '{package} = git ${{buildout:github}}/{package}'
+WINEGG_LINE = r'(?<![\w.]){package},.*'
+WINEGG_REPLACEMENT = '{package},git://github.com/zopefoundation/{package}.git'
+
+
+def rewrite_file(path, pkg_names, line, replacement):
+    """Rewrite the lines of all packages in one pass.
+
+    Returns the packages for which no line matched.
+    """
+    with io.open(path, 'r') as file:
+        text = file.read()
+    unmatched = []
+    for pkg_name in pkg_names:
+        regex = re.compile(line.format(package=re.escape(pkg_name)))
+        new = replacement.format(package=pkg_name)
+        text, count = regex.subn(lambda match: new, text)
+        if not count:
+            unmatched.append(pkg_name)
+    with io.open(path, 'w') as file:
+        file.write(text)
+    return unmatched
+
+
+def update_moved_packages(path, wc_path, pkg_names, line, replacement):
+    print('Updating: ' + path)
+    unmatched = rewrite_file(path, pkg_names, line, replacement)
+    for pkg_name in unmatched:
+        print('  * No line found for: ' + pkg_name)
+    moved = [pkg_name for pkg_name in pkg_names if pkg_name not in unmatched]
+    if not moved:
+        return
+    do(['svn', 'ci', '-m', ', '.join(moved) + ' moved to GitHub.', wc_path])
+
 
 def update_ztk(config, options):
-    for pkg_name in options.repos:
-        do(['sed', '-i',
-            's/%s = .*/%s = git \$\{buildout:github\}\/%s/g' %(
-                    pkg_name, pkg_name, pkg_name),
-            os.path.join(config.get('migrate', 'ztk-path'), 'ztk-sources.cfg')
-            ])
-        do(['svn', 'ci',
-            '-m', pkg_name + ' moved to GitHub.',
-            config.get('migrate', 'ztk-path')])
+    ztk_path = config.get('migrate', 'ztk-path')
+    update_moved_packages(
+        os.path.join(ztk_path, 'ztk-sources.cfg'), ztk_path, options.repos,
+        ZTK_LINE, ZTK_REPLACEMENT)
 
 
 def update_winegg(config, options):
-    for pkg_name in options.repos:
-        web_path = config.get('migrate', 'wineggbuilder-path')
-        do(['sed', '-i',
-            's/%s,.*/%s,git:\/\/github.com\/zopefoundation\/%s.git/g' %(
-                    pkg_name, pkg_name, pkg_name),
-            os.path.join(web_path, 'project-list.cfg')
-            ])
-        do(['svn', 'ci', '-m', pkg_name+' moved to GitHub.', web_path])
+    web_path = config.get('migrate', 'wineggbuilder-path')
+    update_moved_packages(
+        os.path.join(web_path, 'project-list.cfg'), web_path, options.repos,
+        WINEGG_LINE, WINEGG_REPLACEMENT)
 
 def update_travis_yaml(config, options):
+    gh = None
+    if travis.get_update_mode(config) == 'remote':
+        gh = repos.get_github(options, config)
     for pkg_name in options.repos:
         print('Adding Travis YAML to: ' + pkg_name)
-        repos.update_travis_yaml(pkg_name, config, options)
+        repo = pkg_name
+        if gh is not None:
+            repo = gh.repository(
+                policy.get_policy(config).organization, pkg_name)
+        travis.update_travis_yaml(repo, config, options)
+
+def create_repositories(target_path, config, options):
+    gh = repos.get_github(options, config)
+    # Not the right time yet to update travis.yaml.
+    options.update_travis_yaml = False
+    succeeded, failed = repos.update_repositories(gh, config, options)
+    session.report(gh)
+    if failed:
+        sys.exit('Could not create or update: ' +
+                 ', '.join(name for name, err in failed))
+
+# (stage, option, function(target_path, config, options))
+STAGES = (
+    ('create', 'create_repos', create_repositories),
+    ('convert', 'convert', svn2git),
+    ('push', 'push', push2github),
+    ('clean_svn', 'clean_svn',
+     lambda target_path, config, options: clean_svn(config, options)),
+    ('update_ztk', 'update_ztk',
+     lambda target_path, config, options: update_ztk(config, options)),
+    ('update_winegg', 'update_winegg',
+     lambda target_path, config, options: update_winegg(config, options)),
+    ('travis', 'add_travis_yaml',
+     lambda target_path, config, options: update_travis_yaml(
+         config, options)),
+    )
+
+# These stages commit to the same SVN checkout and must not run in parallel.
+SHARED_STAGES = ('update_ztk', 'update_winegg')
+
+# These stages handle all packages at once (one GitHub session and one walk
+# of the SVN mirror), also when the others run per package.
+BATCH_STAGES = ('create', 'convert')
+
+JOURNAL_FILE = 'migrate-journal.jsonl'
+
+
+def run_stage(jour, stage, func, pkg_names, git_path, config, options):
+    """Run one stage for the given packages and journal the outcome."""
+    stage_options = copy.copy(options)
+    stage_options.repos = list(pkg_names)
+    start = time.time()
+    try:
+        func(git_path, config, stage_options)
+    except (Exception, SystemExit) as err:
+        error = util.describe_error(err)
+        print('***** Stage %s failed for %s: %s' % (
+            stage, ', '.join(pkg_names), error))
+        for pkg_name in pkg_names:
+            jour.record(pkg_name, stage, journal.FAILED, error,
+                        time.time() - start)
+        return False
+    finally:
+        # Batches share the time, so it is only kept per single package.
+        metrics.record_stage(stage, time.time() - start,
+                             pkg_names[0] if len(pkg_names) == 1 else None)
+    for pkg_name in pkg_names:
+        jour.record(pkg_name, stage, journal.DONE,
+                    duration=time.time() - start)
+    return True
+
+
+def get_stale_conversions(pkg_names, git_path, config, options):
+    """Return the converted packages with SVN revisions not converted yet."""
+    if options.rules_path is not None or options.full_convert:
+        return set()
+    watermarks = load_watermarks(git_path)
+    if not any(pkg_name in watermarks for pkg_name in pkg_names):
+        return set()
+    youngest = get_youngest_revision(config)
+    index = svnindex.get_index(config)
+    if index is not None:
+        index.update(youngest)
+    stale = set()
+    for pkg_name in pkg_names:
+        last = watermarks.get(pkg_name)
+        if last is None or last >= youngest:
+            continue
+        if index is None or index.get_range([pkg_name], last) is not None:
+            stale.add(pkg_name)
+    return stale
+
+
+def is_finished(jour, pkg_name, stage, options):
+    """Whether a stage of a package can be skipped."""
+    if stage in options.redo or not jour.is_done(pkg_name, stage):
+        return False
+    if stage == 'convert':
+        # Late SVN commits are converted by another run of the stage.
+        return pkg_name not in options.stale_conversions
+    if stage == 'push':
+        # A newer conversion has to be pushed again.
+        converted = jour.finished(pkg_name, 'convert')
+        return converted is None or (
+            converted <= jour.finished(pkg_name, 'push'))
+    return True
+
+
+def migrate_batch(jour, stages, git_path, config, options, pkg_names=None):
+    """Run every stage for all packages before starting the next one.
+
+    Returns the packages that finished all stages.
+    """
+    if pkg_names is None:
+        pkg_names = list(options.repos)
+    for stage, func in stages:
+        done = [name for name in pkg_names
+                if is_finished(jour, name, stage, options)]
+        todo = [name for name in pkg_names if name not in done]
+        if done:
+            print('***** Skipping finished stage %s for: %s' % (
+                stage, ', '.join(done)))
+        if todo and not run_stage(
+                jour, stage, func, todo, git_path, config, options):
+            # The following stages depend on this one.
+            pkg_names = done
+    return pkg_names
+
+
+def migrate_pipeline(jour, stages, git_path, config, options):
+    """Run the batch stages for all packages, then move every package
+    through the other stages on its own."""
+    locks = dict((stage, threading.Lock()) for stage in SHARED_STAGES)
+    pkg_names = migrate_batch(
+        jour, [(stage, func) for stage, func in stages
+               if stage in BATCH_STAGES], git_path, config, options)
+    stages = [(stage, func) for stage, func in stages
+              if stage not in BATCH_STAGES]
+
+    def migrate_package(pkg_name):
+        for stage, func in stages:
+            if is_finished(jour, pkg_name, stage, options):
+                print('***** Skipping finished stage %s for: %s' % (
+                    stage, pkg_name))
+                continue
+            with locks.get(stage) or contextlib.nullcontext():
+                if not run_stage(jour, stage, func, [pkg_name],
+                                 git_path, config, options):
+                    raise RuntimeError('Stage %s failed.' % stage)
+
+    succeeded, failed = run_parallel(migrate_package, pkg_names, options.jobs)
+    print_summary(succeeded, failed)
+
+
+def check_history(config, options):
+    """Report the SVN history of the packages and skip those without."""
+    index = svnindex.get_index(config)
+    if index is None:
+        if options.svn_history:
+            sys.exit('Please configure the index file in [migrate] svn-index')
+        return
+    index.update(get_youngest_revision(config))
+    missing = svnindex.print_history(index, options.repos)
+    if missing:
+        print('Skipping packages without SVN history: ' + ', '.join(missing))
+        options.repos = [pkg_name for pkg_name in options.repos
+                         if pkg_name not in missing]
+        if not options.repos and not options.svn_history:
+            sys.exit('No packages with SVN history to migrate.')
 
-def migrate_packages(config, options):
-    if options.create_repos:
-        gh = repos.get_github(options)
-        # Not the right time yet to update travis.yaml.
-        options.update_travis_yaml = False
-        repos.update_repositories(gh, config, options)
 
+def migrate_packages(config, options):
+    check_history(config, options)
+    if options.svn_history:
+        return
     git_path = options.git_path
     if git_path is None:
         git_path = tempfile.mkdtemp()
     print('Git Repos Path: ' + git_path)
 
+    journal_path = os.path.join(git_path, JOURNAL_FILE)
+    if options.reset_journal and os.path.exists(journal_path):
+        os.remove(journal_path)
+    jour = journal.Journal(journal_path)
+    stages = [(stage, func) for stage, option, func in STAGES
+              if getattr(options, option)]
+    unknown = set(options.redo).difference(stage for stage, func in stages)
+    if unknown:
+        sys.exit('Unknown or skipped stages: ' + ', '.join(sorted(unknown)))
+    options.stale_conversions = set()
     if options.convert:
-        svn2git(git_path, config, options)
-
-    if options.push:
-        push2github(git_path, config, options)
-
-    if options.clean_svn:
-        clean_svn(config, options)
-
-    if options.update_ztk:
-        update_ztk(config, options)
-
-    if options.update_winegg:
-        update_winegg(config, options)
-
-    if options.add_travis_yaml:
-        update_travis_yaml(config, options)
-
-def load_config(configfile):
-    conf = configparser.ConfigParser()
-    conf.read([configfile])
-    return conf
-
-
-def get_options(parser, args=None, defaults=None):
-    if args is None:
-        args = sys.argv
-    options, positional = parser.parse_args(args)
-    options.positional = positional
-    options.repos = positional
-    return options
+        options.stale_conversions = get_stale_conversions(
+            options.repos, git_path, config, options)
+    if options.jobs > 1:
+        migrate_pipeline(jour, stages, git_path, config, options)
+    else:
+        migrate_batch(jour, stages, git_path, config, options)
+
+    failures = [(pkg_name, stage, error)
+                for pkg_name, stage, error in jour.failures()
+                if pkg_name in options.repos]
+    if failures:
+        print()
+        print('=====[ Failed Stages ]' + '='*56)
+        for pkg_name, stage, error in failures:
+            print('  * %s: %s (%s)' % (pkg_name, stage, error))
+        print('Journal: ' + journal_path)
+        sys.exit(1)
 
 ###############################################################################
 # CLI
@@ -204,10 +738,59 @@ config.add_option(
     help="A flag indicating that the wineggbuilder config file should not "
          "be updated.")
 
+config.add_option(
+    '--jobs', '-j', action="store", type="int", dest='jobs', default=1,
+    help="The number of packages migrated concurrently. Every package moves "
+         "through all stages on its own.")
+
+config.add_option(
+    '--push-jobs', action="store", type="int", dest='push_jobs', default=4,
+    help="The number of packages pushed to GitHub concurrently.")
+
+config.add_option(
+    '--repack', action="store_true", dest='repack', default=False,
+    help="Repack the converted Git repositories before pushing them.")
+
+config.add_option(
+    '--reset-journal', action="store_true", dest='reset_journal',
+    default=False,
+    help="Forget which stages were finished by earlier runs.")
+
+config.add_option(
+    '--redo', action="append", dest='redo', default=[],
+    help="Run this stage again, even if an earlier run finished it "
+         "(repeatable): " + ', '.join(stage[0] for stage in STAGES))
+
 config.add_option(
     '--git-path', action="store", dest='git_path', default=None,
     help="The path to the local Git repository of the package.")
 
+config.add_option(
+    '--full-convert', action="store_true", dest='full_convert',
+    default=False,
+    help="Convert all SVN revisions, even if some of them were converted "
+         "by an earlier run.")
+
+config.add_option(
+    '--shards', action="store", type="int", dest='shards', default=1,
+    help="The number of concurrent conversions the packages are split into.")
+
+config.add_option(
+    '--svn-history', action="store_true", dest='svn_history',
+    default=False,
+    help="Only update the SVN index ([migrate] svn-index) and report the "
+         "history of the packages.")
+
+config.add_option(
+    '--metrics', action="store", dest='metrics_file', default=None,
+    help="Write the stage timings, requests and subprocesses of the run "
+         "as JSON to this file.")
+
+config.add_option(
+    '--profile', action="store", dest='profile', default=None,
+    help="Sample the stacks of all threads during the run and write them "
+         "to this file (collapsed format for flame graphs).")
+
 config.add_option(
     '--rules', '-r', action="store", dest='rules_path', default=None,
     help="Path to the rules file. If not specified, a file will be created.")
@@ -239,7 +822,11 @@ def migrate(args=None):
         args = sys.argv[1:]
 
     orig_args = args
-    options = get_options(parser, args)
+    options = repos.get_options(parser, args)
     options.orig_args = orig_args
-    config = load_config(options.configfile)
-    migrate_packages(config, options)
+    config = policy.load_config(options.configfile)
+    profiler = metrics.start_profiler(options)
+    try:
+        migrate_packages(config, options)
+    finally:
+        metrics.finish('migrate', config, options, profiler)
@@ -0,0 +1,205 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Plan and Apply Repository Changes
+
+The current state of every targeted repository is compared with the state
+described by the configuration. Only the differences are shown (``--plan``)
+or written (``--apply``).
+"""
+from __future__ import print_function
+import collections
+import threading
+
+from zope.githubsupport import repos, shard, travis
+from zope.githubsupport.policy import get_policy
+from zope.githubsupport.util import print_summary, run_parallel
+
+Change = collections.namedtuple(
+    'Change', 'kind name action current desired target')
+
+SYMBOLS = {'create': '+', 'update': '~', 'remove': '-'}
+
+# Marks a repository known not to exist.
+MISSING = object()
+
+
+def plan_title(name, repo, config, options):
+    desc = repos.get_repo_description(name, config, options)
+    current = repo.description if repo is not None else None
+    if desc is None or desc == current:
+        return []
+    return [Change('title', name, 'update', current, desc, None)]
+
+
+def plan_hooks(repo_name, repo, config, options):
+    hooks = {}
+    if repo is not None:
+        hooks = dict((h.name, h) for h in repo.iter_hooks())
+    changes = []
+    for name, (conf, events, active) in sorted(
+            repos.get_hook_configs(repo, config, options, repo_name).items()):
+        hook = hooks.get(name)
+        if hook is None:
+            changes.append(Change('hook', name, 'create', None,
+                                  (conf, events, active), None))
+        elif not repos.hook_matches(hook, conf, events, active):
+            changes.append(Change('hook', name, 'update',
+                                  (hook.config, hook.events, hook.active),
+                                  (conf, events, active), hook))
+    return changes
+
+
+def plan_teams(full_name, index):
+    add, delete = index.diff(full_name)
+    return ([Change('team', name, 'create', None, name, None)
+             for name in sorted(add)] +
+            [Change('team', name, 'remove', name, None, None)
+             for name in sorted(delete)])
+
+
+def plan_travis(name, repo, config, options):
+    contents = repo.contents('.travis.yml')
+    current = contents.decoded.decode() if contents is not None else None
+    if current is not None and travis.is_custom_travis_yaml(current):
+        return []
+    def read(filename):
+        contents = repo.contents(filename)
+        return contents.decoded.decode() if contents is not None else None
+    desired = travis.render_travis_yaml(name, config, options, read)
+    if desired == current:
+        return []
+    action = 'create' if current is None else 'update'
+    return [Change('travis', '.travis.yml', action, current, desired, None)]
+
+
+def plan_repository(gh, org, name, config, options, index, repo=None):
+    """Return the repository (or ``None``) and the list of needed changes."""
+    policy = get_policy(config)
+    if repo is MISSING:
+        repo = None
+    elif repo is None:
+        repo = gh.repository(policy.organization, name)
+    changes = []
+    if repos.is_archived(repo):
+        # Archived repositories are read-only.
+        return repo, changes
+    if repo is None:
+        if not policy.create_repo:
+            return None, changes
+        changes.append(Change('repo', name, 'create', None, name, None))
+    # Like ``update_all_repositories``, ``--all`` only covers teams and hooks.
+    all_repos = getattr(options, 'all_repos', False)
+    if policy.update_title and not all_repos:
+        changes.extend(plan_title(name, repo, config, options))
+    if index is not None:
+        changes.extend(plan_teams(
+            '%s/%s' % (policy.organization, name), index))
+    if policy.update_hooks:
+        changes.extend(plan_hooks(name, repo, config, options))
+    if (repo is not None and not all_repos and options.update_travis_yaml and
+        policy.update_travis):
+        changes.extend(plan_travis(name, repo, config, options))
+    return repo, changes
+
+
+def print_changes(name, repo, changes):
+    print()
+    print('=====[ '+name+' ]'+'='*(70-len(name)))
+    if repo is None and not changes:
+        print("Missing Repository: " + name)
+    elif repos.is_archived(repo):
+        print('  * Archived, skipped.')
+    elif not changes:
+        print('  * Up-to-date.')
+    for change in changes:
+        line = '  %s %s: %s' % (
+            SYMBOLS[change.action], change.kind, change.name)
+        if change.kind == 'title':
+            line += ' (%r -> %r)' % (change.current, change.desired)
+        print(line)
+
+
+def apply_changes(org, name, repo, changes, config, options, index):
+    for change in changes:
+        if change.kind == 'repo':
+            repo = org.create_repo(name)
+            print("Created Repository: " + repo.name)
+        elif change.kind == 'title':
+            if repo.edit(name, description=change.desired):
+                print("  * Updated Title: " + change.desired)
+            else:
+                print("  * Updated Title: **FAILED**")
+        elif change.kind == 'hook':
+            conf, events, active = change.desired
+            if change.action == 'create':
+                repo.create_hook(change.name, conf, events=events,
+                                 active=active)
+                print("  * Created Hook: " + change.name)
+            else:
+                change.target.edit(conf, events=events, active=active)
+                print("  * Updated Hook: " + change.name)
+        elif change.kind == 'travis':
+            travis.update_travis_yaml(repo, config, options)
+    if index is not None and any(c.kind == 'team' for c in changes):
+        # Team changes are collected and issued per team at the end.
+        index.plan(repo.full_name)
+
+
+def plan_repositories(gh, config, options, apply=False):
+    policy = get_policy(config)
+    repos.check_token(config, options)
+    org = gh.organization(policy.organization)
+    inventory = repos.get_inventory(gh, config, options)
+    index = repos.get_team_index(org, config, inventory)
+    plans = {}
+    lock = threading.Lock()
+
+    repo_shard = getattr(options, 'shard', None)
+    if options.all_repos:
+        targets = ((repo.name, repo) for repo in
+                   repos.iter_repositories(gh, org, inventory)
+                   if shard.in_shard(repo.name, repo_shard))
+    else:
+        names = [name for name in options.repos
+                 if shard.in_shard(name, repo_shard)]
+        repos.prefetch_pypi_metadata(names, config, options)
+        targets = ((name, None) for name in names)
+
+    def process(target):
+        name, repo = target
+        if repo is None and inventory is not None:
+            repo = inventory.repository(gh, name) or MISSING
+        repo, changes = plan_repository(
+            gh, org, name, config, options, index, repo)
+        print_changes(name, repo, changes)
+        if apply and changes:
+            apply_changes(org, name, repo, changes, config, options, index)
+        with lock:
+            plans[name] = changes
+
+    succeeded, failed = run_parallel(
+        process, targets, getattr(options, 'jobs', 1))
+    if apply:
+        repos.apply_team_changes(index)
+
+    print()
+    print('=====[ Plan ]' + '='*65)
+    changed = [name for name, changes in plans.items() if changes]
+    print('Repositories: %i (%i with changes)' % (len(plans), len(changed)))
+    counter = collections.Counter(
+        (c.kind, c.action) for changes in plans.values() for c in changes)
+    for (kind, action), count in sorted(counter.items()):
+        print('  %s %s: %i' % (SYMBOLS[action], kind, count))
+    print_summary(succeeded, failed, name=lambda target: target[0])
+    return plans
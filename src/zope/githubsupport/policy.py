@@ -0,0 +1,137 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Compiled Configuration Policy
+
+The ``[github]`` switches, the wanted teams, the ``hooks:*`` sections and
+the Travis YAML template path are read, converted and validated once when
+the configuration is loaded. Configuration errors stop the scripts before
+any API call, and nothing of it is parsed again per repository.
+"""
+from __future__ import print_function
+import collections
+import configparser
+import os
+import string
+import sys
+import types
+
+noop = lambda x: x
+to_bool = lambda x: x.lower() in ('t', 'true', 'y', 'yes', 'on') or None
+
+CONV_MAP = {
+    'email': {'send_from_author': to_bool}
+    }
+
+# Placeholders that can be used in the hook options.
+HOOK_FIELDS = ('github_username', 'github_password', 'travis_token',
+               'package')
+
+Policy = collections.namedtuple('Policy', (
+    'organization', 'teams', 'create_repo', 'update_title', 'update_teams',
+    'update_hooks', 'update_travis', 'hooks', 'travis_template'))
+
+# ``conf`` holds the converted options without placeholders, ``templates``
+# the others as ``(name, template, converter)``.
+HookTemplate = collections.namedtuple(
+    'HookTemplate', 'name conf templates events active')
+
+
+def get_fields(value):
+    """Return the placeholders of a ``str.format`` template."""
+    fields = set()
+    for text, field, spec, conversion in string.Formatter().parse(value):
+        if field is not None:
+            fields.add(field.split('.')[0].split('[')[0])
+    return fields
+
+
+def compile_hook(config, name):
+    section = 'hooks:' + name
+    active = config.getboolean(section, 'active', fallback=True)
+    events = tuple(config.get(section, 'events', fallback='push').split())
+    OMAP = CONV_MAP.get(name, {})
+    conf, templates = {}, []
+    for oname, value in config.items(section):
+        convert = OMAP.get(oname, noop)
+        if oname in ('active', 'events') or convert(value) is None:
+            continue
+        try:
+            fields = get_fields(value)
+        except ValueError as err:
+            raise ValueError('[%s] %s: %s' % (section, oname, err))
+        unknown = fields.difference(HOOK_FIELDS)
+        if unknown:
+            raise ValueError('[%s] %s: Unknown placeholder(s): %s' % (
+                section, oname, ', '.join(sorted(unknown))))
+        if fields:
+            templates.append((oname, value, convert))
+        else:
+            conf[oname] = convert(value.format())
+    return HookTemplate(
+        name, types.MappingProxyType(conf), tuple(templates), events, active)
+
+
+def compile_policy(config, path=None):
+    """Return the policy of a configuration read from ``path``.
+
+    Raises ``ValueError`` or ``configparser.Error`` for invalid settings.
+    """
+    switches = {}
+    for option in ('create-repo', 'update-title', 'update-teams',
+                   'update-hooks', 'update-travis'):
+        try:
+            switches[option.replace('-', '_')] = config.getboolean(
+                'github', option, fallback=False)
+        except ValueError as err:
+            raise ValueError('[github] %s: %s' % (option, err))
+    hooks = tuple(compile_hook(config, section[6:])
+                  for section in sorted(config.sections())
+                  if section.startswith('hooks'))
+    template = config.get('travis', 'yaml-template', fallback=None)
+    if template and path is not None:
+        template = os.path.join(
+            os.path.dirname(os.path.abspath(path)),
+            os.path.expanduser(template))
+    return Policy(
+        organization=config.get('github', 'organization'),
+        teams=frozenset(config.get('github', 'teams', fallback='').split()),
+        hooks=hooks, travis_template=template, **switches)
+
+
+def get_policy(config):
+    """Return the compiled policy of a configuration."""
+    policy = getattr(config, 'policy', None)
+    if policy is None:
+        # Configurations not read by ``load_config``, e.g. in scripts.
+        policy = config.policy = compile_policy(config)
+    return policy
+
+
+def render_hook(hook, ns):
+    """Return ``(conf, events, active)`` of a hook for a repository."""
+    conf = dict(hook.conf)
+    for oname, template, convert in hook.templates:
+        conf[oname] = convert(template.format(**ns))
+    return conf, list(hook.events), hook.active
+
+
+def load_config(configfile):
+    """Read and compile the configuration used by all scripts."""
+    conf = configparser.ConfigParser()
+    conf.read([configfile])
+    try:
+        conf.policy = compile_policy(conf, configfile)
+    except (ValueError, configparser.Error) as err:
+        sys.exit('Invalid configuration %s: %s' % (configfile, err))
+    return conf
@@ -0,0 +1,170 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""PyPI Package Metadata Cache
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+from . import client
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'zope.githubsupport', 'pypi')
+DEFAULT_TTL = 24*60*60
+DEFAULT_PREFETCH_JOBS = 8
+# Seconds until a failed revalidation is tried again.
+RETRY_DELAY = 60
+
+
+class PyPIMetadata(object):
+    """Package metadata from the PyPI JSON API.
+
+    Responses are kept in memory and stored on disk; once they are older
+    than ``ttl`` seconds, they are revalidated using the
+    ``ETag``/``Last-Modified`` headers of the last response.
+    """
+
+    def __init__(self, url, cache_dir=None, ttl=DEFAULT_TTL, http=None):
+        self.url = url.rstrip('/')
+        self.http = http if http is not None else client.Client()
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, name):
+        if self.cache_dir is None:
+            return None
+        key = hashlib.sha1((self.url + '/' + name).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _load(self, name):
+        path = self._path(name)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with io.open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except ValueError:
+            return None
+
+    def _store(self, name, entry):
+        path = self._path(name)
+        if path is None:
+            return
+        tmp_path = '%s.%i.tmp' % (path, threading.get_ident())
+        with io.open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+
+    def _fetch(self, name, entry):
+        headers = {'Accept': 'application/json'}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self.http.get(
+            '%s/%s/json' % (self.url, name), headers=headers)
+        if response.status_code == 304 and entry is not None:
+            entry = dict(entry, fetched=time.time())
+            entry.pop('retry', None)
+            return entry
+        if response.status_code == 404:
+            # Remember unreleased packages as well.
+            return {'fetched': time.time(), 'info': None}
+        response.raise_for_status()
+        data = response.json()
+        return {
+            'fetched': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'info': data['info']}
+
+    def _is_fresh(self, entry):
+        if entry is None:
+            return False
+        if 'retry' in entry:
+            # A stale entry kept after a failed revalidation.
+            return time.time() < entry['retry']
+        return time.time() - entry['fetched'] <= self.ttl
+
+    def get(self, name):
+        """Return the ``info`` mapping of the package or ``None``."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if self._is_fresh(entry):
+                return entry['info']
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            with self._lock:
+                entry = self._entries.get(name)
+                if self._is_fresh(entry):
+                    return entry['info']
+            if entry is None:
+                entry = self._load(name)
+            if not self._is_fresh(entry):
+                try:
+                    entry = self._fetch(name, entry)
+                except Exception:
+                    # A stale entry is still better than nothing; it is used
+                    # until the next try, so an outage does not cost a
+                    # request per lookup.
+                    if entry is None:
+                        return None
+                    entry = dict(entry, retry=time.time() + RETRY_DELAY)
+                    with self._lock:
+                        self._entries[name] = entry
+                    return entry['info']
+                self._store(name, entry)
+            with self._lock:
+                self._entries[name] = entry
+            return entry['info']
+
+    def prefetch(self, names, jobs=DEFAULT_PREFETCH_JOBS):
+        """Warm the cache for all given packages concurrently."""
+        with futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(self.get, names))
+
+    def description(self, name):
+        info = self.get(name)
+        return info['summary'] if info is not None else None
+
+    def classifiers(self, name):
+        info = self.get(name)
+        return info['classifiers'] if info is not None else []
+
+
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+def get_metadata(config):
+    """Return the metadata cache shared by everything using this config."""
+    url = config.get('pypi', 'url')
+    cache_dir = config.get('pypi', 'cache-dir', fallback=DEFAULT_CACHE_DIR)
+    cache_dir = os.path.expanduser(cache_dir.strip()) or None
+    ttl = config.getint('pypi', 'cache-ttl', fallback=DEFAULT_TTL)
+    key = (url, cache_dir, ttl)
+    with _metadata_lock:
+        if key not in _metadata:
+            _metadata[key] = PyPIMetadata(
+                url, cache_dir, ttl, client.get_client(config))
+        return _metadata[key]
@@ -14,235 +14,398 @@
 """GitHub Repository Management
 """
 from __future__ import print_function
-import configparser
-import json
+import collections
 import optparse
 import os
 import sys
-import urllib.request
+import threading
+import time
 from github3 import login
 
-from .util import do
+from . import (
+    checkouts, inventory, metrics, pypi, session, shard, snapshot, travis)
+from .policy import get_policy, load_config, render_hook
+from .travis import update_travis_yaml
+from .util import print_summary, run_parallel
 
 DEFAULT_CONFIG_FILE = os.path.join(
     os.path.dirname(__file__), '..', '..', '..', 'zope.cfg')
 
-noop = lambda x: x
-to_bool = lambda x: x.lower() in ('t', 'true', 'y', 'yes', 'on') or None
-
-CONV_MAP = {
-    'email': {'send_from_author': to_bool}
-    }
-
-TROVE_TO_TRAVIS_PY_VERSIONS = {
-    "Programming Language :: Python :: 2.6": '2.6',
-    "Programming Language :: Python :: 2.7": '2.7',
-    "Programming Language :: Python :: 3.2": '3.2',
-    "Programming Language :: Python :: 3.3": '3.3',
-    "Programming Language :: Python :: Implementation :: PyPy": 'pypy',
-}
-
-TROVE_TO_TOXENV_VERSIONS = {
-    "Programming Language :: Python :: 2.6": 'py26',
-    "Programming Language :: Python :: 2.7": 'py27',
-    "Programming Language :: Python :: 3.2": 'py32',
-    "Programming Language :: Python :: 3.3": 'py33',
-    "Programming Language :: Python :: Implementation :: PyPy": 'pypy',
-}
-
-def get_sub_ns(config, options, repo=None):
+def get_sub_ns(config, options, repo=None, name=None):
     return {
         'github_username': options.username,
         'github_password': options.password,
         'travis_token': options.token,
-        'package': getattr(repo, 'name', None)}
+        'package': name or getattr(repo, 'name', None)}
 
 def get_repo_description(name, config, options):
-    url = '%s/%s/json' % (config.get('pypi', 'url'), name)
-    try:
-        data = urllib.request.urlopen(url).read().decode()
-    except Exception as err:
-        return None
-    info = json.loads(data)['info']
-    return info['summary']
+    return pypi.get_metadata(config).description(name)
 
 def get_repo_classifiers(name, config, options):
-    url = '%s/%s/json' % (config.get('pypi', 'url'), name)
-    try:
-        data = urllib.request.urlopen(url).read().decode()
-    except:
-        return []
-    info = json.loads(data)['info']
-    return info['classifiers']
-
-def update_travis_yaml(repo, config, options):
-    name = repo if isinstance(repo, str) else repo.name
-    repos_path = config.get('local', 'packages-dir')
-    repo_path = os.path.join(repos_path, name)
-    if not os.path.exists(repo_path):
-        do(['git', 'clone', config.get('github', 'repo-url') + name],
-           cwd=repos_path)
-    elif not os.path.exists(os.path.join(repo_path, '.git')):
-        print('  * Skipping Travis YAML update')
-        print('    (Not a Git checkout: ' + repo_path + ')')
+    return pypi.get_metadata(config).classifiers(name)
+
+def prefetch_pypi_metadata(names, config, options):
+    jobs = config.getint(
+        'pypi', 'prefetch-jobs', fallback=pypi.DEFAULT_PREFETCH_JOBS)
+    with metrics.timed('pypi-prefetch'):
+        pypi.get_metadata(config).prefetch(names, jobs)
+
+def prepare_checkouts(names, config, options):
+    if (not options.update_travis_yaml or
+        not get_policy(config).update_travis or
+        travis.get_update_mode(config) != 'checkout'):
         return
-    else:
-        do(['git', 'pull', '-r'], cwd=repo_path,
-           print_stdout=False, print_cmd=False)
-    yaml_path = os.path.join(repo_path, '.travis.yml')
-    has_yaml = os.path.exists(yaml_path)
-    # Check whether this is a custom Travis configuration file.
-    if has_yaml:
-        with open(yaml_path, 'r') as file:
-            if 'custom' in file.read():
-                print('  * Skipping Travis YAML update')
-                print('    (The file is marked as custom.)')
-                return
-
-    # Check whether .gitignore is too restrictive.
-    ignore_path = os.path.join(repo_path, '.gitignore')
-    if os.path.exists(ignore_path):
-        do(['sed', '-i', 's/^\.\*$/\.installed\.cfg/g', ignore_path])
-
-    classifiers = get_repo_classifiers(name, config, options)
-    py_versions = [v for k, v in TROVE_TO_TRAVIS_PY_VERSIONS.items()
-                   if k in classifiers]
-    toxenvs = [v for k, v in TROVE_TO_TOXENV_VERSIONS.items()
-               if k in classifiers]
-    if not py_versions:
-        py_versions.append('2.7')
-    if not toxenvs:
-        toxenvs.append('py27')
-    ns = {'python_versions': '- ' + '\n    - '.join(sorted(py_versions)),
-          'tox_environments': '\n    '.join('- TOXENV=' + e for e in sorted(toxenvs))}
-
-    with open(yaml_path, 'w') as out_file:
-        with open(config.get('travis', 'yaml-template'), 'r') as in_file:
-            out_file.write(in_file.read().format(**ns))
-    if not has_yaml:
-        do(['git', 'add', '.travis.yml'], cwd=repo_path)
-    do(['git', 'commit', '.travis.yml', '-m', "Updated Travis YAML."],
-       cwd=repo_path, print_stdout=False, print_cmd=False, ignore_exit=True)
-    do(['git', 'push'], cwd=repo_path, print_stdout=False, print_cmd=False)
-    print('  * Updated Travis YAML file.')
+    with metrics.timed('checkouts'):
+        checkouts.get_manager(config).refresh(names)
+
+def get_hook_configs(repo, config, options, name=None):
+    """Return the configured hooks as ``{name: (conf, events, active)}``.
+
+    ``name`` is the repository name, also when it does not exist yet.
+    """
+    ns = get_sub_ns(config, options, repo, name)
+    return dict((hook.name, render_hook(hook, ns))
+                for hook in get_policy(config).hooks)
+
+# GitHub returns secrets of hooks like this.
+MASKED_VALUE = '********'
+
+def _hook_value(value):
+    if value is True:
+        return '1'
+    return str(value)
+
+def hook_matches(hook, conf, events, active):
+    """Whether a hook has the configured options, events and state.
+
+    Options not set by the configuration (like the defaults GitHub adds) are
+    ignored, as are secrets, which GitHub masks.
+    """
+    for key, value in conf.items():
+        current = hook.config.get(key)
+        if current is None:
+            return False
+        current = _hook_value(current)
+        if current != MASKED_VALUE and current != _hook_value(value):
+            return False
+    return (sorted(hook.events) == sorted(events) and
+            bool(hook.active) == bool(active))
+
+def check_token(config, options):
+    """Stop before the run if the hooks need the missing Travis token."""
+    if get_policy(config).update_hooks and not options.token:
+        sys.exit("Please specify the Travis CI token")
 
 def update_hooks(repo, config, options):
-    if not options.token:
-        sys.exit("Please specify the Travis CI token")
-    ns = get_sub_ns(config, options, repo)
     hooks = dict((h.name, h) for h in repo.iter_hooks())
-    for name in [section[6:] for section in config.sections()
-                 if section.startswith('hooks')]:
-        active = config.getboolean('hooks:'+name, 'active', fallback=True)
-        events = config.get('hooks:'+name, 'events', fallback='push').split()
-        OMAP = CONV_MAP.get(name, {})
-        conf = dict(
-            [(oname, OMAP.get(oname, noop)(value.format(**ns)))
-             for (oname, value) in config.items('hooks:'+name)
-             if (oname not in ('active', 'events') and
-                 OMAP.get(oname, noop)(value) is not None)])
+    for name, (conf, events, active) in sorted(
+            get_hook_configs(repo, config, options).items()):
         if name not in hooks:
             hook = repo.create_hook(name, conf, events=events,
                                     active=active)
             print("  * Created Hook: " + hook.name)
+        elif hook_matches(hooks[name], conf, events, active):
+            print("  * Hook is up-to-date: " + name)
         else:
             hook = hooks[name]
-            hook.edit(conf, events=events)
+            hook.edit(conf, events=events, active=active)
             print("  * Updated Hook: " + hook.name)
 
 
-def update_teams(org, repo, config, options):
-    all_teams = dict((t.name, t) for t in org.iter_teams())
-    updated_team_names = [
-        t.strip() for t in config.get('github', 'teams').split()]
-    repo_teams = [t.name for t in repo.iter_teams()]
-    add = set(updated_team_names).difference(set(repo_teams))
-    delete = set(repo_teams).difference(set(updated_team_names))
-    # Add teams
-    for name in add:
-        all_teams[name].add_repo(repo.full_name)
-        print('  * Added Team: '+name)
-    # Delete teams
-    for name in delete:
-        all_teams[name].remove_repo(repo.full_name)
-        print('  * Removed Team: '+name)
+class TeamIndex(object):
+    """Repository membership of all organization teams.
+
+    The index is built once per run with one repository listing per team.
+    Membership changes are collected per team and only issued by ``apply()``.
+    """
+
+    def __init__(self, org, config, inventory=None):
+        self.wanted = set(get_policy(config).teams)
+        self.teams = {}
+        self.repos = {}
+        self.add = collections.defaultdict(set)
+        self.remove = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        memberships = None
+        if inventory is not None:
+            memberships = inventory.team_repos()
+        for team in org.iter_teams():
+            self.teams[team.name] = team
+            if memberships is not None:
+                self.repos[team.name] = memberships.get(team.name, set())
+            else:
+                self.repos[team.name] = set(
+                    r.full_name for r in team.iter_repos())
+
+    def repo_teams(self, full_name):
+        return set(name for name, repos in self.repos.items()
+                   if full_name in repos)
+
+    def diff(self, full_name):
+        repo_teams = self.repo_teams(full_name)
+        return (self.wanted.difference(repo_teams),
+                repo_teams.difference(self.wanted))
+
+    def plan(self, full_name):
+        add, delete = self.diff(full_name)
+        with self._lock:
+            for name in add:
+                self.add[name].add(full_name)
+            for name in delete:
+                self.remove[name].add(full_name)
+        return add, delete
+
+    def apply(self):
+        """Issue all collected changes, team by team."""
+        failed = []
+        for changes, verb, method, update in (
+                (self.add, 'Added', 'add_repo', set.add),
+                (self.remove, 'Removed', 'remove_repo', set.discard)):
+            for name, full_names in sorted(changes.items()):
+                team = self.teams.get(name)
+                for full_name in sorted(full_names):
+                    if team is not None and getattr(team, method)(full_name):
+                        update(self.repos[name], full_name)
+                        print('  * %s Team: %s (%s)' % (verb, name, full_name))
+                    else:
+                        print('  * %s Team: %s (%s) **FAILED**' % (
+                            verb, name, full_name))
+                        failed.append((name, full_name))
+            changes.clear()
+        return failed
+
+
+def update_teams(org, repo, config, options, index=None):
+    # Without a shared index, the changes are applied right away.
+    apply_now = index is None
+    if apply_now:
+        index = TeamIndex(org, config)
+    add, delete = index.plan(repo.full_name)
+    for name in sorted(add):
+        print('  * Adding Team: '+name)
+    for name in sorted(delete):
+        print('  * Removing Team: '+name)
+    if apply_now:
+        index.apply()
+
+
+def apply_team_changes(index):
+    if index is None or not (index.add or index.remove):
+        return
+    print()
+    print('=====[ Teams ]' + '='*64)
+    with metrics.timed('team-apply'):
+        index.apply()
 
 
-def update_repositories(gh, config, options):
-    org_name = config.get('github', 'organization')
-    org = gh.organization(org_name)
+def get_team_index(org, config, inventory=None):
+    if not get_policy(config).update_teams:
+        return None
+    with metrics.timed('team-index'):
+        return TeamIndex(org, config, inventory)
 
-    for name in options.repos:
-        print()
-        print('=====[ '+name+' ]'+'='*(70-len(name)))
-        repo = gh.repository(org_name, name)
-        created = False
-        if repo is None:
-            if not config.getboolean('github', 'create-repo'):
-                print("Missing Repository: " + name)
-                continue
-            repo = org.create_repo(name)
-            created = True
-            print("Created Repository: " + repo.name)
+
+def get_inventory(gh, config, options):
+    if not getattr(options, 'graphql', False):
+        return None
+    with metrics.timed('inventory'):
+        return inventory.get_inventory(gh, config)
+
+
+def is_archived(repo):
+    """Archived repositories are read-only; only the inventory knows them."""
+    return bool(getattr(repo, 'archived', False))
+
+
+def iter_repositories(gh, org, inventory=None):
+    if inventory is not None:
+        return inventory.iter_repositories(gh)
+    return org.iter_repos()
+
+
+def update_title(repo, name, config, options):
+    desc = get_repo_description(name, config, options)
+    if desc is not None and desc != repo.description:
+        updated = repo.edit(name, description=desc)
+        if updated:
+            print("  * Updated Title: " + desc)
         else:
-            print("Found Repository: " + repo.name)
-            if not options.update_repo:
-                print("  * Skipping update.")
-                continue
-        if config.getboolean('github', 'update-title'):
-            desc = get_repo_description(name, config, options)
-            if desc is not None and desc != repo.description:
-                updated = repo.edit(name, description=desc)
-                if updated:
-                    print("  * Updated Title: " + desc)
-                else:
-                    print("  * Updated Title: **FAILED**")
-            else:
-                if desc is None:
-                    print("  * No Title found.")
-                else:
-                    print("  * Title is up-to-date.")
-        if config.getboolean('github', 'update-teams'):
-            update_teams(org, repo, config, options)
-        if config.getboolean('github', 'update-hooks'):
+            print("  * Updated Title: **FAILED**")
+    else:
+        if desc is None:
+            print("  * No Title found.")
+        else:
+            print("  * Title is up-to-date.")
+
+
+def update_repository(gh, org, name, config, options, index=None,
+                      inventory=None):
+    policy = get_policy(config)
+    print()
+    print('=====[ '+name+' ]'+'='*(70-len(name)))
+    with metrics.timed('lookup', name):
+        if inventory is not None:
+            # The inventory knows all repositories; no need to ask.
+            repo = inventory.repository(gh, name)
+        else:
+            repo = gh.repository(policy.organization, name)
+    created = False
+    if repo is None:
+        if not policy.create_repo:
+            print("Missing Repository: " + name)
+            return
+        with metrics.timed('create', name):
+            repo = org.create_repo(name)
+        created = True
+        print("Created Repository: " + repo.name)
+    else:
+        print("Found Repository: " + repo.name)
+        if is_archived(repo):
+            print("  * Skipping archived repository.")
+            return
+        if not options.update_repo:
+            print("  * Skipping update.")
+            return
+    if policy.update_title:
+        with metrics.timed('title', name):
+            update_title(repo, name, config, options)
+    if policy.update_teams:
+        with metrics.timed('teams', name):
+            update_teams(org, repo, config, options, index)
+    if policy.update_hooks:
+        with metrics.timed('hooks', name):
             update_hooks(repo, config, options)
-        if (options.update_travis_yaml and
-            config.getboolean('github', 'update-travis')):
-            if not created:
+    if options.update_travis_yaml and policy.update_travis:
+        if not created:
+            with metrics.timed('travis', name):
                 update_travis_yaml(repo, config, options)
-            else:
-                print('  * Skipping Travis YAML file update.')
-                print('    (No source code yet.)')
+        else:
+            print('  * Skipping Travis YAML file update.')
+            print('    (No source code yet.)')
 
 
-def update_all_repositories(gh, config, options):
-    org_name = config.get('github', 'organization')
-    org = gh.organization(org_name)
-    for repo in org.iter_repos():
-        print("Found Repository: " + repo.name)
-        if config.getboolean('github', 'update-teams'):
-            update_teams(org, repo, config, options)
-        if config.getboolean('github', 'update-hooks'):
+def update_repositories(gh, config, options):
+    policy = get_policy(config)
+    org = gh.organization(policy.organization)
+    names = [name for name in options.repos
+             if shard.in_shard(name, getattr(options, 'shard', None))]
+    check_token(config, options)
+
+    if (policy.update_title or
+        (options.update_travis_yaml and policy.update_travis)):
+        prefetch_pypi_metadata(names, config, options)
+    prepare_checkouts(names, config, options)
+
+    inv = get_inventory(gh, config, options)
+    index = get_team_index(org, config, inv)
+
+    def update(name):
+        update_repository(gh, org, name, config, options, index, inv)
+
+    succeeded, failed = run_parallel(
+        update, names, getattr(options, 'jobs', 1))
+    apply_team_changes(index)
+    print_summary(succeeded, failed)
+    return succeeded, failed
+
+
+def update_existing_repository(org, repo, config, options, index=None):
+    print()
+    print('=====[ '+repo.name+' ]'+'='*(70-len(repo.name)))
+    print("Found Repository: " + repo.name)
+    if is_archived(repo):
+        print("  * Skipping archived repository.")
+        return
+    policy = get_policy(config)
+    if policy.update_teams:
+        with metrics.timed('teams', repo.name):
+            update_teams(org, repo, config, options, index)
+    if policy.update_hooks:
+        with metrics.timed('hooks', repo.name):
             update_hooks(repo, config, options)
 
 
-def get_github(options):
+def update_all_repositories(gh, config, options):
+    policy = get_policy(config)
+    check_token(config, options)
+    org = gh.organization(policy.organization)
+
+    inv = get_inventory(gh, config, options)
+    index = get_team_index(org, config, inv)
+    snap = snapshot.get_snapshot(config)
+    config_hash = snapshot.get_config_hash(config, options)
+    since_last_run = getattr(options, 'since_last_run', False)
+    repo_shard = getattr(options, 'shard', None)
+    unchanged = []
+
+    def update(repo):
+        hooks = snapshot.get_hook_digests(
+            get_hook_configs(repo, config, options))
+        teams = None
+        if index is not None:
+            teams = sorted(index.repo_teams(repo.full_name))
+        if since_last_run and snap.is_current(
+                repo, config_hash, hooks=hooks, teams=teams):
+            # Team changes are still found, since the index is org-wide.
+            if index is not None and any(index.diff(repo.full_name)):
+                print()
+                print('=====[ '+repo.name+' ]'+'='*(70-len(repo.name)))
+                update_teams(org, repo, config, options, index)
+            unchanged.append(repo.name)
+            return
+        update_existing_repository(org, repo, config, options, index)
+        snap.record(repo, config_hash, hooks=hooks, teams=teams)
+
+    try:
+        succeeded, failed = run_parallel(
+            update, (repo for repo in iter_repositories(gh, org, inv)
+                     if shard.in_shard(repo.name, repo_shard)),
+            getattr(options, 'jobs', 1))
+        apply_team_changes(index)
+    finally:
+        snap.save()
+    if since_last_run:
+        print()
+        print('Unchanged since last run: %i' % len(unchanged))
+    print_summary(succeeded, failed, name=lambda repo: repo.name)
+    return succeeded, failed
+
+
+def get_github(options, config=None):
     if not options.username and not options.password:
         sys.exit("Please specify your GitHub username and password")
-    return login(options.username, options.password)
-
-def load_config(configfile):
-    conf = configparser.ConfigParser()
-    conf.read([configfile])
-    return conf
+    gh = login(options.username, options.password)
+    if config is not None:
+        api_url = config.get('github', 'api-url', fallback=None)
+        if api_url:
+            # E.g. the local stand-in of ``zope.githubsupport.fakeserver``.
+            gh._session.base_url = api_url.rstrip('/')
+        session.install(gh, config)
+    return gh
 
 def get_options(parser, args=None, defaults=None):
     if args is None:
         args = sys.argv
     options, positional = parser.parse_args(args)
     options.positional = options.repos = positional
+    if getattr(options, 'shard', None):
+        try:
+            options.shard = shard.parse_shard(options.shard)
+        except ValueError as err:
+            parser.error(str(err))
     return options
 
+def write_shard_result(gh, options, succeeded, failed, started,
+                       name=str):
+    path = shard.get_result_path(options)
+    if path is None:
+        return
+    limiter = session.get_limiter(gh)
+    shard.write_result(
+        path, options.shard, [name(item) for item in succeeded],
+        [(name(item), err) for item, err in failed], started,
+        limiter.requests if limiter is not None else None)
+
 ###############################################################################
 # Command-line UI
 
@@ -265,6 +428,56 @@ config.add_option(
     '--all', action="store_true", dest='all_repos', default=False,
     help="Update all repositories.")
 
+config.add_option(
+    '--since-last-run', action="store_true", dest='since_last_run',
+    default=False,
+    help="With --all, only update repositories that are new, changed on "
+         "GitHub or affected by a configuration change since the last run.")
+
+config.add_option(
+    '--graphql', action="store_true", dest='graphql', default=False,
+    help="Load repositories and team memberships of the organization with "
+         "a few GraphQL queries instead of REST calls per repository.")
+
+config.add_option(
+    '--plan', action="store_true", dest='plan', default=False,
+    help="Only show the changes needed to match the configuration.")
+
+config.add_option(
+    '--apply', action="store_true", dest='apply', default=False,
+    help="Compare the repositories with the configuration and only make "
+         "the needed changes.")
+
+config.add_option(
+    '--render-travis-yaml', action="store", dest='travis_output_dir',
+    default=None,
+    help="Only render the Travis YAML of all repositories into the given "
+         "directory and compare it with the local checkouts.")
+
+config.add_option(
+    '--shard', action="store", dest='shard', default=None,
+    help="Only handle the repositories of shard i of N (e.g. 2/3); "
+         "assignments are stable as the organization grows.")
+
+config.add_option(
+    '--result-file', action="store", dest='result_file', default=None,
+    help="Write the succeeded and failed repositories as JSON to this "
+         "file (with --shard, defaults to a file per shard).")
+
+config.add_option(
+    '--jobs', '-j', action="store", type="int", dest='jobs', default=1,
+    help="The number of repositories to update concurrently.")
+
+config.add_option(
+    '--metrics', action="store", dest='metrics_file', default=None,
+    help="Write the stage timings, requests and subprocesses of the run "
+         "as JSON to this file.")
+
+config.add_option(
+    '--profile', action="store", dest='profile', default=None,
+    help="Sample the stacks of all threads during the run and write them "
+         "to this file (collapsed format for flame graphs).")
+
 config.add_option(
     '--username', '--user', action="store", dest='username',
     help="Username to access the GitHub Web site.")
@@ -292,18 +505,52 @@ def addrepos(args=None):
         args = sys.argv[1:]
 
     options = get_options(parser, args)
-    gh = get_github(options)
     config = load_config(options.configfile)
-    update_repositories(gh, config, options)
+    profiler = metrics.start_profiler(options)
+    try:
+        gh = get_github(options, config)
+        started = time.time()
+        succeeded, failed = update_repositories(gh, config, options)
+        write_shard_result(gh, options, succeeded, failed, started)
+        session.report(gh)
+        if failed:
+            sys.exit(1)
+    finally:
+        metrics.finish('addrepos', config, options, profiler)
 
 def updaterepos(args=None):
     if args is None:
         args = sys.argv[1:]
 
     options = get_options(parser, args)
-    gh = get_github(options)
     config = load_config(options.configfile)
-    if options.all_repos:
-        update_all_repositories(gh, config, options)
-    else:
-        update_repositories(gh, config, options)
+    profiler = metrics.start_profiler(options)
+    try:
+        if options.travis_output_dir and not options.all_repos:
+            # Rendering only needs PyPI metadata, no GitHub session.
+            travis.render_all(
+                options.repos, config, options, options.travis_output_dir)
+            return
+        gh = get_github(options, config)
+        failed = []
+        if options.travis_output_dir:
+            org = gh.organization(get_policy(config).organization)
+            travis.render_all((repo.name for repo in org.iter_repos()),
+                              config, options, options.travis_output_dir)
+        elif options.plan or options.apply:
+            from zope.githubsupport import plan
+            plan.plan_repositories(gh, config, options, apply=options.apply)
+        elif options.all_repos:
+            started = time.time()
+            succeeded, failed = update_all_repositories(gh, config, options)
+            write_shard_result(gh, options, succeeded, failed, started,
+                               name=lambda repo: repo.name)
+        else:
+            started = time.time()
+            succeeded, failed = update_repositories(gh, config, options)
+            write_shard_result(gh, options, succeeded, failed, started)
+        session.report(gh)
+        if failed:
+            sys.exit(1)
+    finally:
+        metrics.finish('updaterepos', config, options, profiler)
@@ -0,0 +1,227 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""GitHub Session Caching and Rate Limiting
+"""
+from __future__ import print_function
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from . import client
+
+API_URL = 'https://api.github.com'
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'zope.githubsupport', 'github')
+DEFAULT_RESERVE = 50
+MAX_RETRIES = 5
+
+
+class RateLimiter(object):
+    """Paces requests using the rate limit headers sent by GitHub."""
+
+    def __init__(self, reserve=DEFAULT_RESERVE, sleep=time.sleep):
+        self.reserve = reserve
+        self.sleep = sleep
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        # Reset time -> highest and lowest remaining budget seen in that
+        # rate limit window.
+        self.windows = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the request budget allows another request."""
+        with self._lock:
+            if (self.remaining is None or self.remaining > self.reserve or
+                self.reset is None):
+                return
+            delay = self.reset - time.time() + 1
+        if delay > 0:
+            print('  * Rate limit almost used up; waiting %is.' % delay)
+            self._pause(delay)
+
+    def _pause(self, delay):
+        with self._lock:
+            self.waited += delay
+        self.sleep(delay)
+
+    def update(self, response):
+        headers = response.headers
+        with self._lock:
+            self.requests += 1
+            if response.status_code == 304:
+                self.not_modified += 1
+            if 'X-RateLimit-Limit' in headers:
+                self.limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Reset' in headers:
+                self.reset = int(headers['X-RateLimit-Reset'])
+            if 'X-RateLimit-Remaining' in headers:
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+                high, low = self.windows.get(
+                    self.reset, (self.remaining, self.remaining))
+                self.windows[self.reset] = (
+                    max(high, self.remaining), min(low, self.remaining))
+
+    def budget_used(self):
+        """Return the requests counted against the rate limit."""
+        with self._lock:
+            # The first response of a window already counts itself.
+            return sum(high - low + 1 for high, low in self.windows.values())
+
+    def retry_delay(self, response):
+        """Return the seconds to wait before retrying or ``None``."""
+        if response.status_code not in (403, 429):
+            return None
+        if 'Retry-After' in response.headers:
+            # Secondary (abuse) rate limit.
+            return int(response.headers['Retry-After'])
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            reset = int(response.headers.get('X-RateLimit-Reset', 0))
+            return max(reset - time.time() + 1, 1)
+        return None
+
+    def pause_for(self, response):
+        delay = self.retry_delay(response)
+        if delay is None:
+            return False
+        print('  * Rate limited by GitHub; retrying in %is.' % delay)
+        self._pause(delay)
+        return True
+
+    def report(self):
+        print()
+        print('=====[ GitHub Rate Limit ]' + '='*52)
+        print('Requests: %i (%i not modified)' % (
+            self.requests, self.not_modified))
+        if self.windows:
+            print('Budget used: %i' % self.budget_used())
+            print('Remaining: %i/%s' % (self.remaining, self.limit))
+        if self.waited:
+            print('Waited for rate limit: %is' % self.waited)
+
+
+class CachingAdapter(client.PooledAdapter):
+    """An adapter sending conditional requests for cached responses.
+
+    ``GET`` responses with an ``ETag`` are stored on disk. Later requests
+    for the same resource send ``If-None-Match`` and a ``304 Not Modified``
+    answer, which does not count against the rate limit, is replaced by the
+    cached response.
+    """
+
+    def __init__(self, cache_dir=None, limiter=None, **kw):
+        super(CachingAdapter, self).__init__(**kw)
+        self.cache_dir = cache_dir
+        self.limiter = limiter or RateLimiter()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, request):
+        if self.cache_dir is None or request.method != 'GET':
+            return None
+        key = '\n'.join([
+            request.url,
+            request.headers.get('Accept', ''),
+            request.headers.get('Authorization', '')])
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+    def _load(self, path):
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with io.open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except ValueError:
+            return None
+
+    def _store(self, path, response):
+        entry = {
+            'headers': dict(response.headers),
+            'content': base64.b64encode(response.content).decode('ascii')}
+        tmp_path = '%s.%i.tmp' % (path, threading.get_ident())
+        with io.open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+
+    def _from_cache(self, response, entry):
+        headers = CaseInsensitiveDict(entry['headers'])
+        # Keep the current rate limit information.
+        for name, value in response.headers.items():
+            if name.lower().startswith('x-ratelimit-'):
+                headers[name] = value
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = headers
+        response._content = base64.b64decode(entry['content'])
+        response._content_consumed = True
+        response.encoding = None
+        return response
+
+    def send(self, request, **kw):
+        path = self._path(request)
+        entry = self._load(path)
+        if entry is not None and 'ETag' in entry['headers']:
+            request.headers['If-None-Match'] = entry['headers']['ETag']
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.wait()
+            response = super(CachingAdapter, self).send(request, **kw)
+            self.limiter.update(response)
+            if attempt == MAX_RETRIES or not self.limiter.pause_for(response):
+                break
+        if response.status_code == 304 and entry is not None:
+            return self._from_cache(response, entry)
+        if (path is not None and response.status_code == 200 and
+            'ETag' in response.headers):
+            self._store(path, response)
+        return response
+
+
+def install(gh, config):
+    """Mount the caching and rate-limiting adapter on the GitHub session."""
+    cache_dir = config.get('github', 'cache-dir', fallback=DEFAULT_CACHE_DIR)
+    cache_dir = os.path.expanduser(cache_dir.strip()) or None
+    reserve = config.getint(
+        'github', 'rate-limit-reserve', fallback=DEFAULT_RESERVE)
+    http = client.get_client(config)
+    http.mount(gh._session)
+    adapter = CachingAdapter(
+        cache_dir, RateLimiter(reserve), **http.adapter_options())
+    gh._session.mount(get_api_url(gh), adapter)
+    return adapter
+
+
+def get_api_url(gh):
+    return getattr(gh._session, 'base_url', None) or API_URL
+
+
+def get_limiter(gh):
+    adapter = gh._session.get_adapter(get_api_url(gh))
+    return getattr(adapter, 'limiter', None)
+
+
+def report(gh):
+    limiter = get_limiter(gh)
+    if limiter is not None:
+        limiter.report()
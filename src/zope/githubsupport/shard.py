@@ -0,0 +1,164 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Sharding of Organization-wide Runs
+
+``--shard i/N`` splits the repositories between N hosts. Repositories are
+assigned with rendezvous hashing on their name: new repositories do not
+move existing ones, and changing N only moves the repositories of the
+added or removed shards. Every shard writes a JSON result file, which
+``mergeshards`` combines into one report.
+"""
+from __future__ import print_function
+import hashlib
+import io
+import json
+import optparse
+import os
+import socket
+import sys
+import time
+
+from .util import describe_error
+
+RESULT_FILE = 'updaterepos-shard-%i-of-%i.json'
+
+
+def parse_shard(text):
+    """Parse ``i/N`` into ``(i, N)`` with ``1 <= i <= N``."""
+    try:
+        index, count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard (expected i/N): ' + text)
+    if not 1 <= index <= count:
+        raise ValueError('Invalid shard (expected 1 <= i <= N): ' + text)
+    return index, count
+
+
+def get_shard(name, count):
+    """Return the shard (1 to ``count``) of a repository."""
+    return max(range(1, count + 1), key=lambda index: hashlib.sha1(
+        ('%i:%s' % (index, name)).encode('utf-8')).digest())
+
+
+def in_shard(name, shard):
+    return shard is None or get_shard(name, shard[1]) == shard[0]
+
+
+def get_result_path(options):
+    path = getattr(options, 'result_file', None)
+    shard = getattr(options, 'shard', None)
+    if path is None and shard is not None:
+        path = RESULT_FILE % shard
+    return path
+
+
+def write_result(path, shard, succeeded, failed, started, requests=None):
+    """Store the outcome of a run as JSON."""
+    result = {
+        'shard': list(shard) if shard is not None else None,
+        'host': socket.gethostname(),
+        'started': started, 'finished': time.time(),
+        'succeeded': sorted(succeeded),
+        'failed': dict((name, describe_error(err)) for name, err in failed),
+        'requests': requests}
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(json.dumps(result, indent=1, sort_keys=True))
+    os.replace(path + '.tmp', path)
+    print('Result written to ' + path)
+
+
+def merge_results(results):
+    """Combine the results of all shards into one org-wide report."""
+    counts = set(result['shard'][1] for result in results
+                 if result['shard'] is not None)
+    if len(counts) > 1:
+        raise ValueError('Results of different shard counts: %s' % (
+            ', '.join(str(count) for count in sorted(counts))))
+    count = counts.pop() if counts else 1
+    seen = set(result['shard'][0] for result in results
+               if result['shard'] is not None)
+    owners = {}
+    duplicates = set()
+    merged = {'shards': count, 'missing': sorted(
+                  set(range(1, count + 1)).difference(seen)),
+              'hosts': {}, 'succeeded': [], 'failed': {}, 'requests': 0,
+              'started': min(result['started'] for result in results),
+              'finished': max(result['finished'] for result in results)}
+    for result in results:
+        index = result['shard'][0] if result['shard'] is not None else 1
+        merged['hosts'][index] = result['host']
+        merged['succeeded'].extend(result['succeeded'])
+        merged['failed'].update(result['failed'])
+        merged['requests'] += result.get('requests') or 0
+        for name in list(result['succeeded']) + list(result['failed']):
+            if name in owners and owners[name] != index:
+                duplicates.add(name)
+            owners[name] = index
+    merged['succeeded'].sort()
+    # The same repository in two shards means different configurations.
+    merged['duplicates'] = sorted(duplicates)
+    return merged
+
+
+def print_report(merged):
+    print()
+    print('=====[ Organization Summary ]' + '='*49)
+    print('Shards: %i' % merged['shards'])
+    for index, host in sorted(merged['hosts'].items()):
+        print('  * %i: %s' % (index, host))
+    if merged['missing']:
+        print('Missing shards: ' + ', '.join(
+            str(index) for index in merged['missing']))
+    print('Duration: %is' % (merged['finished'] - merged['started']))
+    print('API requests: %i' % merged['requests'])
+    print('Succeeded: %i' % len(merged['succeeded']))
+    print('Failed: %i' % len(merged['failed']))
+    for name, error in sorted(merged['failed'].items()):
+        print('  * %s: %s' % (name, error))
+    if merged['duplicates']:
+        print('In more than one shard: ' + ', '.join(merged['duplicates']))
+
+###############################################################################
+# Command-line UI
+
+parser = optparse.OptionParser("%prog [options] RESULT1 RESULT2 ...")
+
+parser.add_option(
+    '--output', '-o', action="store", dest='output', default=None,
+    help="Also write the merged report as JSON into this file.")
+
+# Command-line UI
+###############################################################################
+
+def merge(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    options, paths = parser.parse_args(args)
+    if not paths:
+        parser.error('Please specify the result files of the shards.')
+    results = []
+    for path in paths:
+        with io.open(path, 'r', encoding='utf-8') as file:
+            results.append(json.load(file))
+    try:
+        merged = merge_results(results)
+    except ValueError as err:
+        sys.exit(str(err))
+    print_report(merged)
+    if options.output:
+        with io.open(options.output, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(merged, indent=1, sort_keys=True))
+    if merged['missing'] or merged['failed'] or merged['duplicates']:
+        sys.exit(1)
@@ -0,0 +1,115 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Repository State Snapshots
+
+The state of every repository after a successful update is stored locally,
+so that later runs can skip repositories that did not change since.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+DEFAULT_STATE_FILE = os.path.join(
+    os.path.expanduser('~'), '.cache', 'zope.githubsupport',
+    'repos-state.json')
+
+# Settings that influence how an existing repository is updated.
+CONFIG_OPTIONS = (
+    ('github', 'teams'),
+    ('github', 'update-teams'),
+    ('github', 'update-hooks'),
+    )
+
+
+def get_config_hash(config, options):
+    """Return a hash of everything the repository update depends on."""
+    data = [(section, name, config.get(section, name, fallback=None))
+            for section, name in CONFIG_OPTIONS]
+    for section in sorted(config.sections()):
+        if section.startswith('hooks'):
+            data.append((section, sorted(config.items(section))))
+    data.append((options.username, options.token))
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _timestamp(value):
+    # REST returns datetimes, the GraphQL inventory ISO strings.
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return str(value)
+
+
+def get_hook_digests(hook_configs):
+    """Return a digest of every rendered hook configuration.
+
+    The configurations contain passwords and tokens, which are not stored.
+    """
+    return dict((name, hashlib.sha1(json.dumps(
+                     [conf, sorted(events), bool(active)],
+                     sort_keys=True).encode('utf-8')).hexdigest())
+                for name, (conf, events, active) in hook_configs.items())
+
+
+def get_repo_state(repo):
+    return {'updated_at': _timestamp(repo.updated_at),
+            'pushed_at': _timestamp(repo.pushed_at)}
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.repos = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with io.open(path, 'r', encoding='utf-8') as file:
+                self.repos = json.load(file).get('repos', {})
+
+    def is_current(self, repo, config_hash, **info):
+        """Whether the repository did not change since its last update.
+
+        ``info`` holds the current values of what ``record`` stored, e.g.
+        the rendered hooks and the team membership.
+        """
+        entry = self.repos.get(repo.name)
+        if entry is None or entry.get('config_hash') != config_hash:
+            return False
+        state = get_repo_state(repo)
+        state.update(info)
+        return all(entry.get(key) == value for key, value in state.items())
+
+    def record(self, repo, config_hash, **info):
+        entry = get_repo_state(repo)
+        entry.update(info, config_hash=config_hash, synced=time.time())
+        with self._lock:
+            self.repos[repo.name] = entry
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            data = json.dumps({'repos': self.repos}, indent=1, sort_keys=True)
+        with io.open(self.path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def get_snapshot(config):
+    path = config.get('local', 'state-file', fallback=DEFAULT_STATE_FILE)
+    return Snapshot(os.path.expanduser(path))
@@ -0,0 +1,234 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""SVN Mirror Path/Revision Index
+
+Records which revisions of the local SVN mirror touched which package
+paths, both the standalone ``/<package>/`` projects and the packages inside
+the monolithic Zope 3 and Zope 2 trees. The index is built once with
+``svnlook changed`` and afterwards only extended by the new revisions.
+
+The migration uses it to skip packages without history and to limit
+``svn-all-fast-export`` to the revisions that concern the converted
+packages.
+"""
+from __future__ import print_function
+import bisect
+import io
+import json
+import os
+import re
+import threading
+from concurrent import futures
+
+from . import util
+
+# Indexes of another version are rebuilt.
+VERSION = 2
+DEFAULT_JOBS = 8
+# Revisions indexed between two saves of the index.
+CHUNK_SIZE = 1000
+# ``zope/app/publisher`` is indexed, ``zope/app/publisher/browser`` not.
+MAX_DEPTH = 4
+
+# Package locations inside the monolithic trees; ``path`` is the package
+# path below the source directory, e.g. ``zope/interface/...``.
+MONOLITHIC_PATHS = (
+    r'(?:Zope|Zope3)/(?:trunk|branches/[^/]+|tags/[^/]+)/'
+    r'(?:src|lib/python)/(?P<path>.*)',
+    )
+
+# Changes above the package paths of a monolithic tree, e.g. the copy of
+# the whole tree that creates a branch or tag (``A + Zope3/branches/X/``).
+TREE_PATHS = (
+    r'(?:Zope|Zope3)/(?:trunk|branches/[^/]+|tags/[^/]+)/'
+    r'(?:(?:src|lib|lib/python)/)?$',
+    r'(?:Zope|Zope3)/(?:branches|tags)/$',
+    )
+
+
+def parse_changed(output):
+    """Return the paths of ``svnlook changed`` output."""
+    # Every line starts with four status columns, e.g. ``U   path``.
+    return [line[4:] for line in output.splitlines() if len(line) > 4]
+
+
+class SVNIndex(object):
+
+    def __init__(self, path, mirror, patterns=MONOLITHIC_PATHS,
+                 jobs=DEFAULT_JOBS, tree_patterns=TREE_PATHS):
+        self.path = path
+        self.mirror = mirror
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.tree_patterns = [
+            re.compile(pattern) for pattern in tree_patterns]
+        self.jobs = jobs
+        # The last indexed revision.
+        self.revision = 0
+        # Top-level directory -> revisions
+        self.projects = {}
+        # Package path in a monolithic tree -> revisions
+        self.monolithic = {}
+        # Revisions that changed whole monolithic trees; they concern all
+        # packages that were in a tree by then.
+        self.trees = []
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('version') != VERSION:
+            return
+        self.revision = data['revision']
+        self.projects = data['projects']
+        self.monolithic = data['monolithic']
+        self.trees = data['trees']
+
+    def save(self):
+        data = {'version': VERSION, 'revision': self.revision,
+                'projects': self.projects, 'monolithic': self.monolithic,
+                'trees': self.trees}
+        with io.open(self.path + '.tmp', 'w', encoding='utf-8') as file:
+            file.write(json.dumps(data, sort_keys=True))
+        os.replace(self.path + '.tmp', self.path)
+
+    def is_tree(self, path):
+        path = path.lstrip('/')
+        return any(pattern.match(path) for pattern in self.tree_patterns)
+
+    def get_keys(self, path):
+        """Return the project and monolithic keys a changed path touches."""
+        projects, monolithic = set(), set()
+        path = path.lstrip('/')
+        # A directory path ends with a slash, so ``parts[-1]`` is ``''``.
+        parts = path.split('/')
+        if len(parts) > 1:
+            projects.add(parts[0])
+        for pattern in self.patterns:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            dirs = match.group('path').split('/')[:-1]
+            for depth in range(1, min(len(dirs), MAX_DEPTH) + 1):
+                monolithic.add('/'.join(dirs[:depth]))
+        return projects, monolithic
+
+    def add(self, revision, paths):
+        projects, monolithic = set(), set()
+        for path in paths:
+            more_projects, more_monolithic = self.get_keys(path)
+            projects.update(more_projects)
+            monolithic.update(more_monolithic)
+        for key in projects:
+            self.projects.setdefault(key, []).append(revision)
+        for key in monolithic:
+            self.monolithic.setdefault(key, []).append(revision)
+        if any(self.is_tree(path) for path in paths):
+            self.trees.append(revision)
+
+    def changed(self, revision):
+        result = util.run(
+            ['svnlook', 'changed', '-r', str(revision), self.mirror],
+            check=True)
+        return parse_changed(result.stdout)
+
+    def update(self, youngest):
+        """Index the revisions up to ``youngest`` not indexed yet."""
+        with self._lock:
+            if self.revision >= youngest:
+                return
+            print('***** Indexing SVN revisions %i-%i of %s' % (
+                self.revision + 1, youngest, self.mirror))
+            with futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                while self.revision < youngest:
+                    revisions = range(
+                        self.revision + 1,
+                        min(self.revision + CHUNK_SIZE, youngest) + 1)
+                    # ``map`` keeps the order, so the lists stay sorted.
+                    for revision, paths in zip(
+                            revisions, pool.map(self.changed, revisions)):
+                        self.add(revision, paths)
+                    self.revision = revisions[-1]
+                    # An interrupted run continues after the last chunk.
+                    self.save()
+
+    def revisions(self, pkg_name):
+        """Return the sorted revisions that touched a package."""
+        revisions = set(self.projects.get(pkg_name, ()))
+        monolithic = self.monolithic.get(pkg_name.replace('.', '/'))
+        if monolithic:
+            revisions.update(monolithic)
+            # Branches and tags copy the package without touching its path.
+            revisions.update(self.trees[
+                bisect.bisect_left(self.trees, monolithic[0]):])
+        return sorted(revisions)
+
+    def get_range(self, pkg_names, after=None):
+        """Return the first and last revision after ``after`` that touched
+        any of the packages, or ``None``."""
+        first = last = None
+        for pkg_name in pkg_names:
+            revisions = self.revisions(pkg_name)
+            if after is not None:
+                revisions = revisions[bisect.bisect_right(revisions, after):]
+            if not revisions:
+                continue
+            if first is None or revisions[0] < first:
+                first = revisions[0]
+            if last is None or revisions[-1] > last:
+                last = revisions[-1]
+        if first is None:
+            return None
+        return first, last
+
+
+def print_history(index, pkg_names):
+    """Print the history size of the packages; return those without."""
+    print()
+    print('=====[ SVN History ]' + '='*58)
+    print('Indexed up to revision %i' % index.revision)
+    missing = []
+    for pkg_name in pkg_names:
+        revisions = index.revisions(pkg_name)
+        if not revisions:
+            missing.append(pkg_name)
+            print('  * %s: no history' % pkg_name)
+            continue
+        print('  * %s: %i revisions (%i-%i)' % (
+            pkg_name, len(revisions), revisions[0], revisions[-1]))
+    return missing
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(config):
+    """Return the index shared by everything in this run or ``None``."""
+    path = config.get('migrate', 'svn-index', fallback=None)
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    with _indexes_lock:
+        if path not in _indexes:
+            patterns = config.get('migrate', 'svn-index-paths', fallback=None)
+            if patterns:
+                patterns = patterns.split()
+            _indexes[path] = SVNIndex(
+                path, config.get('migrate', 'svn-mirror'),
+                patterns or MONOLITHIC_PATHS,
+                config.getint('migrate', 'svn-index-jobs',
+                              fallback=DEFAULT_JOBS))
+        return _indexes[path]
@@ -0,0 +1 @@
+# Make a package.
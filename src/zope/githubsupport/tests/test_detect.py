@@ -0,0 +1,93 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Python Version Detection Tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from zope.githubsupport import detect
+
+SETUP_PY = '''
+from setuptools import setup
+setup(
+    name='zope.example',
+    classifiers=[
+        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3.3',
+    ] + ['Programming Language :: Python :: Implementation :: PyPy'],
+)
+'''
+
+SETUP_CFG = '''
+[metadata]
+name = zope.example
+classifiers =
+    Programming Language :: Python :: 2.7
+    Programming Language :: Python :: 3.4
+'''
+
+TOX_INI = '''
+[tox]
+envlist = py27,py34, pypy
+    docs
+'''
+
+
+class DetectTests(unittest.TestCase):
+
+    def test_setup_py(self):
+        self.assertEqual(detect.classifiers_from_setup_py(SETUP_PY), [
+            'Programming Language :: Python :: 2.7',
+            'Programming Language :: Python :: 3.3',
+            'Programming Language :: Python :: Implementation :: PyPy'])
+
+    def test_setup_py_broken(self):
+        self.assertEqual(detect.classifiers_from_setup_py('setup(\n'), [])
+        self.assertEqual(
+            detect.classifiers_from_setup_py('print("no setup")'), [])
+        self.assertEqual(
+            detect.classifiers_from_setup_py('setup(name="x")'), [])
+
+    def test_setup_cfg(self):
+        self.assertEqual(detect.classifiers_from_setup_cfg(SETUP_CFG), [
+            'Programming Language :: Python :: 2.7',
+            'Programming Language :: Python :: 3.4'])
+        self.assertEqual(detect.classifiers_from_setup_cfg('no section'), [])
+
+    def test_tox_ini(self):
+        self.assertEqual(detect.classifiers_from_tox_ini(TOX_INI), [
+            'Programming Language :: Python :: 2.7',
+            'Programming Language :: Python :: 3.4',
+            'Programming Language :: Python :: Implementation :: PyPy'])
+        self.assertEqual(detect.classifiers_from_tox_ini('[tox]\n'), [])
+
+    def test_detect_classifiers(self):
+        files = {'setup.py': SETUP_PY, 'tox.ini': TOX_INI}
+        self.assertEqual(detect.detect_classifiers(files.get), [
+            'Programming Language :: Python :: 2.7',
+            'Programming Language :: Python :: 3.3',
+            'Programming Language :: Python :: Implementation :: PyPy',
+            'Programming Language :: Python :: 3.4'])
+        self.assertEqual(detect.detect_classifiers({}.get), [])
+
+    def test_file_reader(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with open(os.path.join(path, 'setup.cfg'), 'w') as file:
+            file.write(SETUP_CFG)
+        read = detect.file_reader(path)
+        self.assertEqual(read('setup.cfg'), SETUP_CFG)
+        self.assertIsNone(read('setup.py'))
@@ -0,0 +1,60 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Migration Journal Tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from zope.githubsupport import journal
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path)
+        self.path = os.path.join(self.tmp_path, 'journal.jsonl')
+
+    def test_record(self):
+        jour = journal.Journal(self.path)
+        self.assertIsNone(jour.status('zope.interface', 'convert'))
+        jour.record('zope.interface', 'convert', journal.DONE, duration=2.5)
+        jour.record('zope.interface', 'push', journal.FAILED, 'Error: x')
+        self.assertTrue(jour.is_done('zope.interface', 'convert'))
+        self.assertFalse(jour.is_done('zope.interface', 'push'))
+        self.assertIsNotNone(jour.finished('zope.interface', 'convert'))
+        self.assertIsNone(jour.finished('zope.interface', 'push'))
+        self.assertEqual(jour.failures(),
+                         [('zope.interface', 'push', 'Error: x')])
+
+    def test_resume(self):
+        jour = journal.Journal(self.path)
+        jour.record('zope.interface', 'push', journal.FAILED, 'Error: x')
+        jour.record('zope.interface', 'push', journal.DONE)
+        jour.record('zope.schema', 'create', journal.DONE)
+        # An interrupted run may leave a partial line behind.
+        with open(self.path, 'a') as file:
+            file.write('{"package": "zope.sch')
+        jour = journal.Journal(self.path)
+        self.assertTrue(jour.is_done('zope.interface', 'push'))
+        self.assertTrue(jour.is_done('zope.schema', 'create'))
+        self.assertEqual(jour.failures(), [])
+
+    def test_in_memory(self):
+        jour = journal.Journal(None)
+        jour.record('zope.interface', 'create', journal.DONE)
+        self.assertTrue(jour.is_done('zope.interface', 'create'))
+        self.assertEqual(os.listdir(self.tmp_path), [])
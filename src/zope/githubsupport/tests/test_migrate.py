@@ -0,0 +1,136 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Migration Tests
+"""
+import configparser
+import io
+import optparse
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from zope.githubsupport import migrate
+
+HAS_SVN = all(shutil.which(cmd) for cmd in ('svnadmin', 'svn', 'svnmucc'))
+
+VERSIONS_CFG = u'''\
+[versions]
+zope.interface = 4.0.5
+zope.interface.common = 1.0
+five.zope.interface = 2.0
+zope.schema = 4.3.2
+'''
+
+
+class RewriteFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path)
+        self.path = os.path.join(self.tmp_path, 'versions.cfg')
+        with io.open(self.path, 'w') as file:
+            file.write(VERSIONS_CFG)
+
+    def read(self):
+        with io.open(self.path, 'r') as file:
+            return file.read()
+
+    def test_rewrite(self):
+        unmatched = migrate.rewrite_file(
+            self.path, ['zope.interface', 'zope.schema'],
+            migrate.ZTK_LINE, migrate.ZTK_REPLACEMENT)
+        self.assertEqual(unmatched, [])
+        self.assertEqual(self.read(), (
+            '[versions]\n'
+            'zope.interface = git ${buildout:github}/zope.interface\n'
+            'zope.interface.common = 1.0\n'
+            'five.zope.interface = 2.0\n'
+            'zope.schema = git ${buildout:github}/zope.schema\n'))
+
+    def test_unmatched(self):
+        unmatched = migrate.rewrite_file(
+            self.path, ['zope.unknown', 'zope.schema'],
+            migrate.ZTK_LINE, migrate.ZTK_REPLACEMENT)
+        self.assertEqual(unmatched, ['zope.unknown'])
+        self.assertIn('zope.schema = git', self.read())
+
+
+@unittest.skipUnless(HAS_SVN, 'Subversion is not installed.')
+class CleanSVNRemoteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path)
+        repos_path = os.path.join(self.tmp_path, 'repos')
+        subprocess.check_call(['svnadmin', 'create', repos_path])
+        self.url = 'file://' + repos_path + '/'
+        subprocess.check_call(
+            ['svnmucc', '-q', '-m', 'Initial import.', '-U', self.url,
+             'mkdir', 'zope.example',
+             'mkdir', 'zope.example/trunk',
+             'mkdir', 'zope.example/trunk/src',
+             'put', os.devnull, 'zope.example/trunk/setup.py',
+             'propset', 'svn:externals', '^/other other',
+             'zope.example/trunk',
+             'mkdir', 'zope.plain',
+             'mkdir', 'zope.plain/trunk',
+             'put', os.devnull, 'zope.plain/trunk/README.txt'])
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({'migrate': {'svn-repos': self.url}})
+
+    def svn(self, *args):
+        return subprocess.check_output(
+            ('svn',) + args, universal_newlines=True)
+
+    def test_get_svnmucc_actions(self):
+        actions = migrate.get_svnmucc_actions(
+            'zope.example', self.config, self.tmp_path)
+        moved_path = os.path.join(
+            self.tmp_path, 'zope.example.MOVED_TO_GITHUB')
+        self.assertEqual(actions, [
+            'propdel', 'svn:externals', 'zope.example/trunk',
+            'rm', 'zope.example/trunk/setup.py',
+            'rm', 'zope.example/trunk/src',
+            'put', moved_path, 'zope.example/trunk/MOVED_TO_GITHUB'])
+        with io.open(moved_path, 'r') as file:
+            self.assertEqual(file.read(),
+                             migrate.get_moved_text('zope.example'))
+
+    def test_get_svnmucc_actions_without_externals(self):
+        actions = migrate.get_svnmucc_actions(
+            'zope.plain', self.config, self.tmp_path)
+        self.assertEqual(actions[:2], ['rm', 'zope.plain/trunk/README.txt'])
+
+    def test_clean_svn_remote(self):
+        options = optparse.Values({'repos': ['zope.example', 'zope.plain']})
+        migrate.clean_svn_remote(self.config, options)
+        for pkg_name in options.repos:
+            trunk = self.url + pkg_name + '/trunk'
+            self.assertEqual(self.svn('ls', trunk), 'MOVED_TO_GITHUB\n')
+            self.assertEqual(
+                self.svn('cat', trunk + '/MOVED_TO_GITHUB'),
+                migrate.get_moved_text(pkg_name))
+            self.assertEqual(self.svn('proplist', trunk), '')
+        # Without [migrate] clean-svn-batch every package gets a commit.
+        log = self.svn('log', '-q', self.url)
+        self.assertEqual(log.count('\nr'), 3)
+
+    def test_clean_svn_remote_batch(self):
+        self.config.set('migrate', 'clean-svn-batch', 'true')
+        options = optparse.Values({'repos': ['zope.example', 'zope.plain']})
+        migrate.clean_svn_remote(self.config, options)
+        log = self.svn('log', '-q', self.url)
+        self.assertEqual(log.count('\nr'), 2)
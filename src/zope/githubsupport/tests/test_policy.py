@@ -0,0 +1,101 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Policy Tests
+"""
+import configparser
+import unittest
+
+from zope.githubsupport import policy
+
+
+def make_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+
+class CompileHookTests(unittest.TestCase):
+
+    def test_static_options(self):
+        config = make_config(
+            '[hooks:web]\n'
+            'url = https://example.com/hook\n'
+            'content_type = json\n')
+        hook = policy.compile_hook(config, 'web')
+        self.assertEqual(hook.name, 'web')
+        self.assertEqual(dict(hook.conf), {
+            'url': 'https://example.com/hook', 'content_type': 'json'})
+        self.assertEqual(hook.templates, ())
+        self.assertEqual(hook.events, ('push',))
+        self.assertTrue(hook.active)
+        # The compiled options cannot be changed by accident.
+        with self.assertRaises(TypeError):
+            hook.conf['url'] = 'x'
+
+    def test_events_and_active(self):
+        config = make_config(
+            '[hooks:web]\n'
+            'url = https://example.com/hook\n'
+            'events = push pull_request\n'
+            'active = no\n')
+        hook = policy.compile_hook(config, 'web')
+        self.assertEqual(hook.events, ('push', 'pull_request'))
+        self.assertFalse(hook.active)
+        self.assertNotIn('events', hook.conf)
+        self.assertNotIn('active', hook.conf)
+
+    def test_templates(self):
+        config = make_config(
+            '[hooks:travis]\n'
+            'user = {github_username}\n'
+            'token = {travis_token}\n'
+            'domain = travis-ci.org\n')
+        hook = policy.compile_hook(config, 'travis')
+        self.assertEqual(dict(hook.conf), {'domain': 'travis-ci.org'})
+        self.assertEqual(sorted(name for name, template, convert
+                                in hook.templates), ['token', 'user'])
+        conf, events, active = policy.render_hook(hook, {
+            'github_username': 'jim', 'travis_token': 'secret'})
+        self.assertEqual(conf, {'domain': 'travis-ci.org', 'user': 'jim',
+                                'token': 'secret'})
+        self.assertEqual(events, ['push'])
+
+    def test_converters(self):
+        config = make_config(
+            '[hooks:email]\n'
+            'address = {package}@example.com\n'
+            'send_from_author = yes\n')
+        hook = policy.compile_hook(config, 'email')
+        self.assertEqual(dict(hook.conf), {'send_from_author': True})
+        config = make_config(
+            '[hooks:email]\n'
+            'address = {package}@example.com\n'
+            'send_from_author = no\n')
+        # False values are left out, like GitHub does.
+        hook = policy.compile_hook(config, 'email')
+        self.assertEqual(dict(hook.conf), {})
+
+    def test_unknown_placeholder(self):
+        config = make_config(
+            '[hooks:web]\n'
+            'url = https://example.com/{repo}\n')
+        with self.assertRaises(ValueError) as context:
+            policy.compile_hook(config, 'web')
+        self.assertIn('Unknown placeholder(s): repo', str(context.exception))
+
+    def test_invalid_template(self):
+        config = make_config(
+            '[hooks:web]\n'
+            'url = https://example.com/{package\n')
+        self.assertRaises(ValueError, policy.compile_hook, config, 'web')
@@ -0,0 +1,67 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Repository Update Tests
+"""
+import unittest
+
+from zope.githubsupport import repos
+
+
+class Hook(object):
+
+    def __init__(self, config, events=('push',), active=True):
+        self.config = config
+        self.events = list(events)
+        self.active = active
+
+
+class HookMatchesTests(unittest.TestCase):
+
+    def test_matches(self):
+        hook = Hook({'url': 'https://example.com', 'send': '1'})
+        self.assertTrue(repos.hook_matches(
+            hook, {'url': 'https://example.com', 'send': True},
+            ['push'], True))
+
+    def test_different_value(self):
+        hook = Hook({'url': 'https://example.com'})
+        self.assertFalse(repos.hook_matches(
+            hook, {'url': 'https://example.org'}, ['push'], True))
+
+    def test_missing_option(self):
+        hook = Hook({'url': 'https://example.com'})
+        self.assertFalse(repos.hook_matches(
+            hook, {'url': 'https://example.com', 'secret': 'x'},
+            ['push'], True))
+
+    def test_github_defaults(self):
+        # Options GitHub adds on its own are not compared.
+        hook = Hook({'url': 'https://example.com', 'content_type': 'form',
+                     'insecure_ssl': '0'})
+        self.assertTrue(repos.hook_matches(
+            hook, {'url': 'https://example.com'}, ['push'], True))
+
+    def test_masked_secret(self):
+        hook = Hook({'url': 'https://example.com', 'secret': '********'})
+        self.assertTrue(repos.hook_matches(
+            hook, {'url': 'https://example.com', 'secret': 'x'},
+            ['push'], True))
+
+    def test_events_and_active(self):
+        hook = Hook({}, events=('push', 'pull_request'))
+        self.assertTrue(repos.hook_matches(
+            hook, {}, ['pull_request', 'push'], True))
+        self.assertFalse(repos.hook_matches(hook, {}, ['push'], True))
+        self.assertFalse(repos.hook_matches(
+            hook, {}, ['push', 'pull_request'], False))
@@ -0,0 +1,44 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""GitHub Session Tests
+"""
+import unittest
+
+from zope.githubsupport import session
+
+
+class Response(object):
+
+    def __init__(self, remaining, reset, status_code=200):
+        self.status_code = status_code
+        self.headers = {'X-RateLimit-Limit': '5000',
+                        'X-RateLimit-Remaining': str(remaining),
+                        'X-RateLimit-Reset': str(reset)}
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def test_budget_used(self):
+        limiter = session.RateLimiter()
+        for remaining in (4999, 4997, 4998, 4996):
+            limiter.update(Response(remaining, 1000))
+        self.assertEqual(limiter.budget_used(), 4)
+
+    def test_budget_used_across_reset(self):
+        limiter = session.RateLimiter()
+        for remaining, reset in ((10, 1000), (9, 1000), (4999, 4600),
+                                 (4998, 4600), (4997, 4600)):
+            limiter.update(Response(remaining, reset))
+        self.assertEqual(limiter.budget_used(), 5)
+        self.assertEqual(limiter.remaining, 4997)
@@ -0,0 +1,81 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Shard Tests
+"""
+import unittest
+
+from zope.githubsupport import shard
+
+
+def make_result(index, count, succeeded=(), failed=None, requests=10):
+    return {'shard': [index, count] if count else None,
+            'host': 'host%i' % index, 'started': 100 + index,
+            'finished': 200 + index, 'succeeded': list(succeeded),
+            'failed': failed or {}, 'requests': requests}
+
+
+class ShardTests(unittest.TestCase):
+
+    def test_parse_shard(self):
+        self.assertEqual(shard.parse_shard('2/3'), (2, 3))
+        for text in ('3', 'a/b', '0/3', '4/3'):
+            self.assertRaises(ValueError, shard.parse_shard, text)
+
+    def test_get_shard(self):
+        names = ['zope.pkg%i' % number for number in range(200)]
+        shards = [shard.get_shard(name, 4) for name in names]
+        self.assertEqual(set(shards), set([1, 2, 3, 4]))
+        # The assignment only depends on the name and the shard count.
+        self.assertEqual(shards, [shard.get_shard(name, 4) for name in names])
+
+    def test_get_shard_stable(self):
+        # Rendezvous hashing: a new shard only takes repositories over.
+        names = ['zope.pkg%i' % number for number in range(200)]
+        for name in names:
+            index = shard.get_shard(name, 5)
+            if index != 5:
+                self.assertEqual(index, shard.get_shard(name, 4))
+
+    def test_in_shard(self):
+        self.assertTrue(shard.in_shard('zope.interface', None))
+        matches = [index for index in (1, 2, 3)
+                   if shard.in_shard('zope.interface', (index, 3))]
+        self.assertEqual(len(matches), 1)
+
+    def test_merge_results(self):
+        merged = shard.merge_results([
+            make_result(1, 3, ['a', 'b']),
+            make_result(3, 3, ['c'], {'d': 'Error: d'}, requests=None)])
+        self.assertEqual(merged['shards'], 3)
+        self.assertEqual(merged['missing'], [2])
+        self.assertEqual(merged['hosts'], {1: 'host1', 3: 'host3'})
+        self.assertEqual(merged['succeeded'], ['a', 'b', 'c'])
+        self.assertEqual(merged['failed'], {'d': 'Error: d'})
+        self.assertEqual(merged['requests'], 10)
+        self.assertEqual((merged['started'], merged['finished']), (101, 203))
+        self.assertEqual(merged['duplicates'], [])
+
+    def test_merge_results_duplicates(self):
+        merged = shard.merge_results([
+            make_result(1, 2, ['a', 'b']), make_result(2, 2, ['b'])])
+        self.assertEqual(merged['duplicates'], ['b'])
+
+    def test_merge_results_unsharded(self):
+        merged = shard.merge_results([make_result(1, None, ['a'])])
+        self.assertEqual(merged['shards'], 1)
+        self.assertEqual(merged['missing'], [1])
+
+    def test_merge_results_different_counts(self):
+        self.assertRaises(ValueError, shard.merge_results, [
+            make_result(1, 2), make_result(1, 3)])
@@ -0,0 +1,86 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""SVN Index Tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from zope.githubsupport import svnindex
+
+
+class SVNIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path)
+        self.index = svnindex.SVNIndex(
+            os.path.join(self.tmp_path, 'index.json'), '/svn-mirror')
+        for revision, paths in (
+                (1, ['/zope.interface/', '/zope.interface/trunk/']),
+                # A tag of the monolithic tree before the package was in it.
+                (2, ['/Zope3/tags/3.0/']),
+                (3, ['/Zope3/trunk/src/zope/interface/interface.py']),
+                (4, ['/zope.schema/trunk/setup.py']),
+                (5, ['/Zope3/branches/3.4/']),
+                (6, ['/zope.interface/trunk/setup.py'])):
+            self.index.add(revision, paths)
+        self.index.revision = 6
+
+    def test_parse_changed(self):
+        self.assertEqual(svnindex.parse_changed(
+            'A   zope.interface/trunk/\n'
+            'U   zope.interface/trunk/setup.py\n'
+            '_U  zope.interface/\n'), [
+                'zope.interface/trunk/', 'zope.interface/trunk/setup.py',
+                'zope.interface/'])
+
+    def test_get_keys(self):
+        self.assertEqual(
+            self.index.get_keys(
+                'Zope3/trunk/src/zope/app/publisher/browser/x.py'),
+            (set(['Zope3']), set(['zope', 'zope/app', 'zope/app/publisher',
+                                  'zope/app/publisher/browser'])))
+        self.assertEqual(self.index.get_keys('/README.txt'), (set(), set()))
+
+    def test_revisions(self):
+        # The tree copies after the first monolithic revision count.
+        self.assertEqual(self.index.revisions('zope.interface'),
+                         [1, 3, 5, 6])
+        self.assertEqual(self.index.revisions('zope.schema'), [4])
+        self.assertEqual(self.index.revisions('zope.unknown'), [])
+
+    def test_get_range(self):
+        self.assertEqual(self.index.get_range(['zope.interface']), (1, 6))
+        self.assertEqual(
+            self.index.get_range(['zope.interface'], after=3), (5, 6))
+        self.assertEqual(
+            self.index.get_range(['zope.interface', 'zope.schema'], after=1),
+            (3, 6))
+        self.assertIsNone(self.index.get_range(['zope.schema'], after=4))
+        self.assertIsNone(self.index.get_range(['zope.unknown']))
+        self.assertIsNone(self.index.get_range([]))
+
+    def test_save_and_load(self):
+        self.index.save()
+        index = svnindex.SVNIndex(self.index.path, '/svn-mirror')
+        self.assertEqual(index.revision, 6)
+        self.assertEqual(index.revisions('zope.interface'), [1, 3, 5, 6])
+
+    def test_load_other_version(self):
+        with open(self.index.path, 'w') as file:
+            file.write('{"version": 1, "revision": 6}')
+        index = svnindex.SVNIndex(self.index.path, '/svn-mirror')
+        self.assertEqual(index.revision, 0)
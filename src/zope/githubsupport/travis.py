@@ -0,0 +1,274 @@
+##############################################################################
+#
+# Copyright (c) 2013 Zope Corporation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Travis CI Configuration
+"""
+from __future__ import print_function
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+
+from . import checkouts, detect, pypi
+from .policy import get_policy
+from .util import do
+
+COMMIT_MESSAGE = "Updated Travis YAML."
+RESTRICTIVE_IGNORE = re.compile(r'^\.\*$', re.MULTILINE)
+
+TROVE_TO_TRAVIS_PY_VERSIONS = {
+    "Programming Language :: Python :: 2.6": '2.6',
+    "Programming Language :: Python :: 2.7": '2.7',
+    "Programming Language :: Python :: 3.2": '3.2',
+    "Programming Language :: Python :: 3.3": '3.3',
+    "Programming Language :: Python :: Implementation :: PyPy": 'pypy',
+}
+
+TROVE_TO_TOXENV_VERSIONS = {
+    "Programming Language :: Python :: 2.6": 'py26',
+    "Programming Language :: Python :: 2.7": 'py27',
+    "Programming Language :: Python :: 3.2": 'py32',
+    "Programming Language :: Python :: 3.3": 'py33',
+    "Programming Language :: Python :: Implementation :: PyPy": 'pypy',
+}
+
+def is_custom_travis_yaml(text):
+    return 'custom' in text
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_template(config):
+    """Return the YAML template, read only once per run."""
+    path = get_policy(config).travis_template
+    if not path:
+        sys.exit("Please configure the template in [travis] yaml-template")
+    with _templates_lock:
+        if path not in _templates:
+            with io.open(path, 'r') as in_file:
+                _templates[path] = in_file.read().format
+        return _templates[path]
+
+def reset_templates():
+    """Read the templates again, e.g. in long-running processes."""
+    with _templates_lock:
+        _templates.clear()
+
+def content_hash(text):
+    if text is None:
+        return None
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def get_classifiers(name, config, options, read=None):
+    """Return the classifiers of the package.
+
+    The package sources are used if ``read`` is given and they mention any
+    supported Python version; PyPI is only used as a fallback.
+    """
+    if read is not None:
+        classifiers = detect.detect_classifiers(read)
+        if any(c in TROVE_TO_TRAVIS_PY_VERSIONS for c in classifiers):
+            return classifiers
+    return pypi.get_metadata(config).classifiers(name)
+
+def render_travis_yaml(name, config, options, read=None):
+    classifiers = get_classifiers(name, config, options, read)
+    py_versions = [v for k, v in TROVE_TO_TRAVIS_PY_VERSIONS.items()
+                   if k in classifiers]
+    toxenvs = [v for k, v in TROVE_TO_TOXENV_VERSIONS.items()
+               if k in classifiers]
+    if not py_versions:
+        print('  * No Python versions found for %s; using 2.7.' % name)
+        py_versions.append('2.7')
+    if not toxenvs:
+        toxenvs.append('py27')
+    ns = {'python_versions': '- ' + '\n    - '.join(sorted(py_versions)),
+          'tox_environments': '\n    '.join('- TOXENV=' + e for e in sorted(toxenvs))}
+    return get_template(config)(**ns)
+
+def update_travis_yaml_checkout(repo, config, options):
+    name = repo if isinstance(repo, str) else repo.name
+    manager = checkouts.get_manager(config)
+    repo_path = manager.checkout(name)
+    if repo_path is None:
+        print('  * Skipping Travis YAML update')
+        print('    (Not a Git checkout: ' + manager.path(name) + ')')
+        return
+    if manager.is_empty(name):
+        # There is no branch to push to yet.
+        print('  * Skipping Travis YAML file update.')
+        print('    (No source code yet.)')
+        return
+    yaml_path = os.path.join(repo_path, '.travis.yml')
+    has_yaml = os.path.exists(yaml_path)
+    yaml = None
+    # Check whether this is a custom Travis configuration file.
+    if has_yaml:
+        with io.open(yaml_path, 'r') as file:
+            yaml = file.read()
+        if is_custom_travis_yaml(yaml):
+            print('  * Skipping Travis YAML update')
+            print('    (The file is marked as custom.)')
+            return
+
+    changed = []
+    # Check whether .gitignore is too restrictive.
+    ignore_path = os.path.join(repo_path, '.gitignore')
+    if os.path.exists(ignore_path):
+        with io.open(ignore_path, 'r') as file:
+            ignore = file.read()
+        new_ignore = fix_gitignore(ignore)
+        if content_hash(new_ignore) != content_hash(ignore):
+            with io.open(ignore_path, 'w') as file:
+                file.write(new_ignore)
+            changed.append('.gitignore')
+
+    new_yaml = render_travis_yaml(
+        name, config, options, detect.file_reader(repo_path))
+    if content_hash(new_yaml) != content_hash(yaml):
+        with io.open(yaml_path, 'w') as out_file:
+            out_file.write(new_yaml)
+        changed.append('.travis.yml')
+    if not changed:
+        print('  * Travis YAML is up-to-date.')
+        return
+
+    if not has_yaml:
+        do(['git', 'add', '.travis.yml'], cwd=repo_path)
+    do(['git', 'commit', '-m', COMMIT_MESSAGE] + changed,
+       cwd=repo_path, print_stdout=False, print_cmd=False, ignore_exit=True)
+    do(['git', 'push'], cwd=repo_path, print_stdout=False, print_cmd=False)
+    print('  * Updated Travis YAML file.')
+
+def fix_gitignore(text):
+    """Replace a too restrictive ``.*`` line in ``.gitignore``."""
+    return RESTRICTIVE_IGNORE.sub('.installed.cfg', text)
+
+def _read_file(repo, path, ref):
+    contents = repo.contents(path, ref=ref)
+    if contents is None:
+        return None
+    return contents.decoded.decode('utf-8')
+
+def get_commit_author(config, options):
+    name = config.get('travis', 'commit-name', fallback=options.username)
+    email = config.get(
+        'travis', 'commit-email',
+        fallback='%s@users.noreply.github.com' % options.username)
+    return {'name': name, 'email': email}
+
+def update_travis_yaml_remote(repo, config, options):
+    """Update ``.travis.yml`` and ``.gitignore`` through the Git data API.
+
+    No checkout is needed: both files are read through the contents API and
+    all changes are stored in a single commit on the default branch.
+    """
+    branch = getattr(repo, 'default_branch', None) or 'master'
+    ref = repo.ref('heads/' + branch)
+    if ref is None:
+        print('  * Skipping Travis YAML update')
+        print('    (No branch found: ' + branch + ')')
+        return
+    head = ref.object.sha
+    yaml = _read_file(repo, '.travis.yml', head)
+    if yaml is not None and is_custom_travis_yaml(yaml):
+        print('  * Skipping Travis YAML update')
+        print('    (The file is marked as custom.)')
+        return
+
+    files = {
+        '.travis.yml': (yaml, render_travis_yaml(
+            repo.name, config, options,
+            lambda filename: _read_file(repo, filename, head)))}
+    ignore = _read_file(repo, '.gitignore', head)
+    if ignore is not None:
+        files['.gitignore'] = (ignore, fix_gitignore(ignore))
+    tree = [{'path': path, 'mode': '100644', 'type': 'blob',
+             'sha': repo.create_blob(new, 'utf-8')}
+            for path, (old, new) in sorted(files.items()) if old != new]
+    if not tree:
+        print('  * Travis YAML is up-to-date.')
+        return
+
+    base_tree = repo.git_commit(head).tree.sha
+    new_tree = repo.create_tree(tree, base_tree)
+    author = get_commit_author(config, options)
+    commit = repo.create_commit(
+        COMMIT_MESSAGE, new_tree.sha, [head], author, author)
+    if ref.update(commit.sha):
+        print('  * Updated Travis YAML file.')
+    else:
+        print('  * Updated Travis YAML file: **FAILED**')
+        print('    (%s was updated concurrently.)' % branch)
+
+def get_update_mode(config):
+    return config.get('travis', 'update-mode', fallback='checkout')
+
+def update_travis_yaml(repo, config, options):
+    if get_update_mode(config) == 'remote':
+        update_travis_yaml_remote(repo, config, options)
+    else:
+        update_travis_yaml_checkout(repo, config, options)
+
+def render_all(names, config, options, output_dir=None):
+    """Render the Travis YAML of all packages in one pass.
+
+    Classifiers come from the checkouts below ``[local] packages-dir`` or
+    the PyPI metadata cache, and the result is compared with the checkouts.
+    If ``output_dir`` is given, the rendered files are written there as
+    ``<name>.yml``.
+    """
+    names = list(names)
+    # Only needed for packages without local sources, but cheap when cached.
+    pypi.get_metadata(config).prefetch(
+        names, config.getint('pypi', 'prefetch-jobs',
+                             fallback=pypi.DEFAULT_PREFETCH_JOBS))
+    repos_path = config.get('local', 'packages-dir', fallback=None)
+    if output_dir is not None and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    rendered = {}
+    status = {'new': [], 'changed': [], 'unchanged': [], 'custom': [],
+              'no_checkout': []}
+    for name in names:
+        read = None
+        if repos_path is not None and os.path.isdir(
+                os.path.join(repos_path, name)):
+            read = detect.file_reader(os.path.join(repos_path, name))
+        yaml = render_travis_yaml(name, config, options, read)
+        rendered[name] = yaml
+        if output_dir is not None:
+            with io.open(os.path.join(output_dir, name + '.yml'), 'w') as file:
+                file.write(yaml)
+        if read is None:
+            # Nothing to compare with.
+            status['no_checkout'].append(name)
+            continue
+        current = read('.travis.yml')
+        if current is None:
+            status['new'].append(name)
+        elif is_custom_travis_yaml(current):
+            status['custom'].append(name)
+        elif content_hash(current) != content_hash(yaml):
+            status['changed'].append(name)
+        else:
+            status['unchanged'].append(name)
+
+    print('=====[ Travis YAML ]' + '='*58)
+    for key in ('changed', 'new', 'custom', 'unchanged', 'no_checkout'):
+        print('%s: %i' % (
+            key.replace('_', ' ').capitalize(), len(status[key])))
+    for name in status['changed']:
+        print('  ~ ' + name)
+    return rendered, status
@@ -13,24 +13,372 @@
 ##############################################################################
 """Support Utilities
 """
+import asyncio
+import collections
+import io
+import os
+import selectors
+import signal
 import subprocess
 import sys
+import threading
+import time
+from concurrent import futures
 
-def do(cmd, cwd=None, print_stdout=True, print_cmd=True, ignore_exit=False):
+from . import metrics
+
+Result = collections.namedtuple(
+    'Result', 'cmd returncode stdout stderr duration timed_out')
+
+DEFAULT_MAX_PROCESSES = 8
+READ_SIZE = 64*1024
+
+
+class CommandError(Exception):
+
+    def __init__(self, result):
+        super(CommandError, self).__init__(
+            '%s failed with exit code %s' % (
+                ' '.join(result.cmd), result.returncode))
+        self.result = result
+
+
+def _kill(process):
+    """Kill a process started in a new session with all its children.
+
+    They would otherwise keep the output pipes open.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class _Output(object):
+    """Splits a byte stream into lines and collects them."""
+
+    def __init__(self, name, on_output, capture):
+        self.name = name
+        self.on_output = on_output
+        # ``capture`` is either a boolean or the number of last lines to keep.
+        maxlen = None if capture is True else int(capture)
+        self.lines = collections.deque(maxlen=maxlen)
+        self.pending = b''
+
+    def feed(self, data):
+        data = self.pending + data
+        *lines, self.pending = data.split(b'\n')
+        for line in lines:
+            self._line(line + b'\n')
+
+    def close(self):
+        if self.pending:
+            self._line(self.pending)
+            self.pending = b''
+
+    def _line(self, line):
+        text = line.decode('utf-8', 'replace')
+        if self.lines.maxlen != 0:
+            self.lines.append(text)
+        if self.on_output is not None:
+            self.on_output(self.name, text)
+
+    def text(self):
+        return ''.join(self.lines)
+
+
+class Runner(object):
+    """Runs commands with a limit on the number of concurrent processes.
+
+    Output is read incrementally and passed to ``on_output(stream, line)``.
+    ``capture`` controls how much of it is kept for the result: everything
+    (``True``), nothing (``False``) or only the last ``capture`` lines.
+    """
+
+    def __init__(self, max_processes=DEFAULT_MAX_PROCESSES):
+        self.max_processes = max_processes
+        self.running = 0
+        self._slots = threading.Condition()
+        # The number of started processes, e.g. for benchmarks.
+        self.processes = 0
+        self._count_lock = threading.Lock()
+
+    def set_max_processes(self, max_processes):
+        """Change the limit, also for commands already waiting."""
+        with self._slots:
+            self.max_processes = max_processes
+            self._slots.notify_all()
+
+    def _acquire(self):
+        with self._slots:
+            self._slots.wait_for(
+                lambda: self.running < self.max_processes)
+            self.running += 1
+        with self._count_lock:
+            self.processes += 1
+
+    def _release(self):
+        with self._slots:
+            self.running -= 1
+            self._slots.notify()
+
+    def run(self, cmd, cwd=None, env=None, timeout=None, on_output=None,
+            capture=True, check=False):
+        self._acquire()
+        try:
+            result = self._run(cmd, cwd, env, timeout, on_output, capture)
+        finally:
+            self._release()
+        metrics.record_command(cmd, result.duration)
+        if check and result.returncode != 0:
+            raise CommandError(result)
+        return result
+
+    def _run(self, cmd, cwd, env, timeout, on_output, capture):
+        start = time.time()
+        deadline = start + timeout if timeout is not None else None
+        process = subprocess.Popen(
+            cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True)
+        outputs = {process.stdout: _Output('stdout', on_output, capture),
+                   process.stderr: _Output('stderr', on_output, capture)}
+        timed_out = False
+        # The output is read in the calling thread, so that ``on_output``
+        # runs there as well (see ``ThreadOutput``).
+        with selectors.DefaultSelector() as selector:
+            for stream in outputs:
+                selector.register(stream, selectors.EVENT_READ)
+            while selector.get_map():
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        timed_out = True
+                        _kill(process)
+                        break
+                for key, _ in selector.select(wait):
+                    data = os.read(key.fd, READ_SIZE)
+                    if data:
+                        outputs[key.fileobj].feed(data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+        for stream, output in outputs.items():
+            output.close()
+            stream.close()
+        process.wait()
+        return Result(cmd, process.returncode,
+                      outputs[process.stdout].text(),
+                      outputs[process.stderr].text(),
+                      time.time() - start, timed_out)
+
+    async def arun(self, cmd, cwd=None, env=None, timeout=None,
+                   on_output=None, capture=True, check=False):
+        """Run the command without blocking the event loop."""
+        loop = asyncio.get_event_loop()
+        acquired = loop.run_in_executor(None, self._acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # The executor takes the slot anyway; give it back afterwards.
+            def release(future):
+                if future.exception() is None:
+                    self._release()
+            acquired.add_done_callback(release)
+            raise
+        try:
+            result = await self._arun(
+                cmd, cwd, env, timeout, on_output, capture)
+        finally:
+            self._release()
+        metrics.record_command(cmd, result.duration)
+        if check and result.returncode != 0:
+            raise CommandError(result)
+        return result
+
+    async def _arun(self, cmd, cwd, env, timeout, on_output, capture):
+        start = time.time()
+        process = await asyncio.create_subprocess_exec(
+            *cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True)
+        stdout = _Output('stdout', on_output, capture)
+        stderr = _Output('stderr', on_output, capture)
+
+        async def read(stream, output):
+            while True:
+                data = await stream.read(READ_SIZE)
+                if not data:
+                    break
+                output.feed(data)
+            output.close()
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(read(process.stdout, stdout),
+                               read(process.stderr, stderr),
+                               process.wait()),
+                timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill(process)
+            await process.wait()
+        return Result(cmd, process.returncode, stdout.text(), stderr.text(),
+                      time.time() - start, timed_out)
+
+
+runner = Runner()
+
+def set_max_processes(max_processes):
+    runner.set_max_processes(max_processes)
+
+def run(cmd, **kw):
+    return runner.run(cmd, **kw)
+
+async def arun(cmd, **kw):
+    return await runner.arun(cmd, **kw)
+
+
+def do(cmd, cwd=None, print_stdout=True, print_cmd=True, ignore_exit=False,
+       timeout=None):
     if print_cmd:
         print(' '.join(cmd))
-    p = subprocess.Popen(
-        cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        cwd=cwd)
-    out, _ = p.communicate()
-    if out and print_stdout:
-        print(out.decode())
-    if p.returncode != 0:
+
+    def on_output(stream, line):
+        if stream == 'stderr':
+            # Parallel runs keep it with the buffered output of the item.
+            captured = getattr(sys.stdout, 'captured', None)
+            if captured is not None:
+                captured.write(line)
+            else:
+                sys.stderr.write(line)
+        elif print_stdout:
+            print(line, end='')
+
+    # Only the end of the output is kept for the error report.
+    result = run(cmd, cwd=cwd, timeout=timeout, on_output=on_output,
+                 capture=100)
+    if result.returncode != 0:
         print('Failed command:')
         print(' '.join(cmd))
-        if out:
-            print(out.decode())
+        if result.timed_out:
+            print('(Timed out after %is.)' % result.duration)
+        if result.stdout and not print_stdout:
+            print(result.stdout)
         if not ignore_exit:
-            sys.exit(p.returncode)
+            sys.exit(result.returncode)
+    return result
+
+
+class ThreadOutput(object):
+    """A ``sys.stdout`` replacement that can buffer output per thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    @property
+    def captured(self):
+        return getattr(self.local, 'captured', None)
+
+    def write(self, data):
+        captured = self.captured
+        if captured is None:
+            return self.stream.write(data)
+        return captured.write(data)
+
+    def flush(self):
+        if self.captured is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+_output_lock = threading.Lock()
+
+def install_thread_output():
+    with _output_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+    return sys.stdout
+
+
+def describe_error(err):
+    return '%s: %s' % (err.__class__.__name__, err)
+
+
+def _run_one(func, item, buffered, parent=None):
+    out = install_thread_output() if buffered else None
+    if buffered:
+        out.local.captured = io.StringIO()
+    try:
+        func(item)
+    except (Exception, SystemExit) as err:
+        print('  * FAILED: ' + describe_error(err))
+        result = (item, err)
+    else:
+        result = (item, None)
+    finally:
+        if buffered:
+            text = out.local.captured.getvalue()
+            out.local.captured = None
+            with _output_lock:
+                if parent is not None:
+                    # Nested runs add to the block of the outer item.
+                    parent.write(text)
+                else:
+                    out.stream.write(text)
+                    out.stream.flush()
+    return result
+
+
+def run_parallel(func, items, jobs=1):
+    """Call ``func(item)`` for every item, using up to ``jobs`` threads.
+
+    When running in parallel, the output of every call is buffered and
+    printed as one block once the call is done. A failing call does not stop
+    the run. Returns the list of succeeded items and a list of
+    ``(item, error)`` tuples for the failed ones.
+    """
+    succeeded, failed = [], []
+    if jobs <= 1:
+        for item in items:
+            _record(_run_one(func, item, False), succeeded, failed)
+        return succeeded, failed
+
+    parent = getattr(sys.stdout, 'captured', None)
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for item in items:
+            # Keep the queue bounded, so that lazy iterators (like paginated
+            # API listings) are not exhausted up-front.
+            if len(pending) >= jobs * 2:
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                _collect(done, succeeded, failed)
+            pending.add(
+                executor.submit(_run_one, func, item, True, parent))
+        _collect(futures.wait(pending)[0], succeeded, failed)
+    return succeeded, failed
+
+def _record(result, succeeded, failed):
+    item, err = result
+    if err is not None:
+        failed.append((item, err))
+    else:
+        succeeded.append(item)
+
+def _collect(done, succeeded, failed):
+    for future in done:
+        _record(future.result(), succeeded, failed)
+
+
+def print_summary(succeeded, failed, name=str):
+    print()
+    print('=====[ Summary ]' + '='*62)
+    print('Succeeded: %i' % len(succeeded))
+    print('Failed: %i' % len(failed))
+    for item, err in failed:
+        print('  * %s: %s' % (name(item), describe_error(err)))